@@ -8,9 +8,9 @@ import click
 import configparser
 import os
 import json
-from pandas import read_csv, merge, Series
+from pandas import read_csv, merge
 from numpy import nan
-from .core.Mods.ProcessSIFTS import RetrieveSIFTS, handle_SIFTS, deal_with_insertionDeletion_SIFTS, update_range_SIFTS, map_muta_from_unp_to_pdb
+from .core.Mods.ProcessSIFTS import RetrieveSIFTS, handle_SIFTS, deal_with_insertionDeletion_SIFTS, update_range_SIFTS, map_muta_table, BestStructureIndex
 from .core.Mods.ProcessMMCIF import MMCIF2Dfrm
 from .core.Mods.ProcessUniProt import retrieveUniProtSeq, split_fasta
 from .core.AsyncV.ProcessUniProt import MapUniProtID
@@ -42,6 +42,7 @@ try:
     _INTERGRATE_PATH = _config.get("DEFAULT", "INTERGRATE_PATH")
     _I3D_META_INI_PATH = _config.get("DEFAULT", "I3D_META_INI_PATH")
     _COMPO_PATH = _config.get("DEFAULT", "COMPO_PATH")
+    _BEST_INDEX_PATH = _config.get("DEFAULT", "BEST_INDEX_PATH")
     _CONVERTER = {"chain_id": str, "struct_asym_id": str, "entity_id": int, "asym_id": str}
 except configparser.NoOptionError:
     raise ValueError("File Path of config file: %s; Exists: %s; Code Path: %s" % (_configPath, os.path.exists(_configPath), __file__))
@@ -51,10 +52,22 @@ def colorClick(a, b="Initializing %s DataSet", fg="green"):
     return click.style(b % a, fg=fg)
 
 
+def chain_filter(intergrate_df):
+    return intergrate_df[
+        (intergrate_df['_pdbx_coordinate_model.type'].isnull())
+        & (intergrate_df['contains_unk_in_chain_pdb'] == False)
+        & (intergrate_df['coordinates_len'] > 20)  # For Chain
+        & (intergrate_df['method'].isin(["X-RAY DIFFRACTION", "SOLUTION NMR"]))
+        & (intergrate_df['delete'] == False)
+        & (intergrate_df['identity'] >= 0.9)  # For Chain
+        & (intergrate_df['pdb_contain_chain_type'].isin(["protein", "DNA,protein", "protein,DNA", "RNA,protein", "protein,RNA"]))
+    ].reset_index(drop=True)
+
+
 @click.group()
 @click.option("--folder", default="", help="The file folder of new files.", type=click.Path())
 def interface(folder):
-    global _FOLDER, _LOGGER_PATH, _SIFTS_RAW_PATH, _SIFTS_MODIFIED_PATH, _SIFTS_PDB, _MMCIF_RAW_PATH, _MMCIF_MODIFIED_PATH, _UniProt_ID_Mapping_RAW_PATH, _UniProt_ID_Mapping_MODIFIED_PATH, _SITE_INFO_PATH, _INTERGRATE_PATH, _I3D_META_INI_PATH, _COMPO_PATH
+    global _FOLDER, _LOGGER_PATH, _SIFTS_RAW_PATH, _SIFTS_MODIFIED_PATH, _SIFTS_PDB, _MMCIF_RAW_PATH, _MMCIF_MODIFIED_PATH, _UniProt_ID_Mapping_RAW_PATH, _UniProt_ID_Mapping_MODIFIED_PATH, _SITE_INFO_PATH, _INTERGRATE_PATH, _I3D_META_INI_PATH, _COMPO_PATH, _BEST_INDEX_PATH
     _FOLDER = folder
     _LOGGER_PATH = os.path.join(_FOLDER, _LOGGER_PATH)
     _SIFTS_RAW_PATH = os.path.join(_FOLDER, _SIFTS_RAW_PATH)
@@ -68,6 +81,7 @@ def interface(folder):
     _INTERGRATE_PATH = os.path.join(_FOLDER, _INTERGRATE_PATH)
     _I3D_META_INI_PATH = os.path.join(_FOLDER, _I3D_META_INI_PATH)
     _COMPO_PATH = os.path.join(_FOLDER, _COMPO_PATH)
+    _BEST_INDEX_PATH = os.path.join(_FOLDER, _BEST_INDEX_PATH)
 
 
 @interface.command()
@@ -224,13 +238,13 @@ def unp2PDB(fastafolder, siteinfofile):
         siteSe = siteSe.apply(json.loads)
         sifts_mmcif_df['mutation_unp'] = sifts_mmcif_df.apply(
             lambda x: getItem(siteSe, x['yourlist']) if not isinstance(x['yourlist'], float) else nan, axis=1)
-        muta_info_li = []
-
-        sifts_mmcif_df['mutation_pdb'] = sifts_mmcif_df.apply(lambda x: map_muta_from_unp_to_pdb(
-            x, 'mutation_unp', 'new_sifts_unp_range', 'new_sifts_pdb_range', muta_info_li
-            ) if not isinstance(x['new_sifts_pdb_range'], float) and not isinstance(x['mutation_unp'], float) else nan, axis=1)
-
-        sifts_mmcif_df['muta_map_info'] = Series(muta_info_li, index=sifts_mmcif_df.dropna(subset=['mutation_unp']).index)
+        valid = (sifts_mmcif_df['new_sifts_pdb_range'].map(lambda x: not isinstance(x, float))
+                 & sifts_mmcif_df['mutation_unp'].map(lambda x: not isinstance(x, float)))
+        muta_df = map_muta_table(sifts_mmcif_df[valid], 'mutation_unp', 'new_sifts_unp_range', 'new_sifts_pdb_range')
+        # collect the tidy result back into one list per row by the row labels
+        for col in ('mutation_pdb', 'muta_map_info'):
+            collected = muta_df.groupby('index', sort=False)[col].agg(list).to_dict()
+            sifts_mmcif_df[col] = [collected.get(label, []) if ok else nan for label, ok in zip(sifts_mmcif_df.index, valid)]
 
     logger.warning("\n%s\n" % sifts_mmcif_df.isnull().sum())
     sifts_mmcif_df.to_csv(_INTERGRATE_PATH, sep="\t", index=False)
@@ -244,15 +258,7 @@ def i3dMap(i3dpath):
     logger = RunningLogger("constraintMapping", _LOGGER_PATH).logger
     intergrate_df = read_csv(_INTERGRATE_PATH, sep="\t", converters=_CONVERTER)
     # Maybe the filtering process should be a mutable function
-    filter_df = intergrate_df[
-        (intergrate_df['_pdbx_coordinate_model.type'].isnull())
-        & (intergrate_df['contains_unk_in_chain_pdb'] == False)
-        & (intergrate_df['coordinates_len'] > 20)  # For Chain
-        & (intergrate_df['method'].isin(["X-RAY DIFFRACTION", "SOLUTION NMR"]))
-        & (intergrate_df['delete'] == False)
-        & (intergrate_df['identity'] >= 0.9)  # For Chain
-        & (intergrate_df['pdb_contain_chain_type'].isin(["protein", "DNA,protein", "protein,DNA", "RNA,protein", "protein,RNA"]))
-    ].reset_index(drop=True)
+    filter_df = chain_filter(intergrate_df)
 
     sort_li = ["i3d_TYPE", "pdb_id", "i3d_CHAIN_COMPO", "chain_id", "i3d_BIO_UNIT", "i3d_MODEL", "i3d_INTERACT_COMPO", "Entry"]
     redundant_li = ["i3d_TYPE", "pdb_id", "i3d_CHAIN_COMPO", "chain_id", "i3d_INTERACT_COMPO", "Entry"]
@@ -271,12 +277,28 @@ def i3dMap(i3dpath):
     logger.info("\nThere are %s rows related to mo, \n%s rows related to ho, \n%s rows related to he and \n%s rows to discard." % (mo_len, ho_len, he_len, discard_len))
 
 
+@interface.command()
+@click.option("--indexFolder", default="", help="The folder of the index files.", type=click.Path())
+@click.option("--filtering/--no-filtering", default=True, help="Whether to keep the chains that pass the filters of i3dMap only.", is_flag=True)
+def bestIndex(indexfolder, filtering):
+    click.echo(colorClick("Best Structure Index"))
+    logger = RunningLogger("bestStructureIndex", _LOGGER_PATH).logger
+    if indexfolder == "":
+        indexfolder = _BEST_INDEX_PATH
+    intergrate_df = read_csv(_INTERGRATE_PATH, sep="\t", converters=_CONVERTER)
+    if filtering:
+        intergrate_df = chain_filter(intergrate_df)
+    index = BestStructureIndex.build(intergrate_df, indexfolder)
+    logger.info("Safe Index: %s %s" % (indexfolder, index))
+
+
 interface.add_command(initUniProt)
 interface.add_command(initUnpFASTA)
 interface.add_command(initSIFTS)
 interface.add_command(initMMCIF)
 interface.add_command(unp2PDB)
 interface.add_command(i3dMap)
+interface.add_command(bestIndex)
 
 
 if __name__ == '__main__':
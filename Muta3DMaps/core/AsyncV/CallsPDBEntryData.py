@@ -21,7 +21,7 @@ import numpy as np
 import json
 import time
 import os
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
 try:
     from .Logger import RunningLogger
@@ -69,6 +69,43 @@ def getFiles(workdir: str, suffix: str):
         if suffix in file:
             yield os.path.join(workdir, file)
 
+def yieldShards(workdir, shard_bytes):
+    '''
+    Group the json files of each api into shards of about `shard_bytes`
+    '''
+    for api in API_LYST:
+        shard, size = [], 0
+        for path in getFiles(workdir, "_{}.json".format(api)):
+            cur = os.path.getsize(path)
+            if shard and size + cur > shard_bytes:
+                yield api, shard, size
+                shard, size = [], 0
+            shard.append(path)
+            size += cur
+        if shard:
+            yield api, shard, size
+
+def decodeShard(suffix, files, path):
+    '''
+    Decode a shard of json files into one part file of the partitioned output
+    '''
+    try:
+        dfrm = traversePDBeData(suffix, PDBeJsonDecoder, files)
+    except ValueError:
+        # No objects to concatenate
+        return None
+    if dfrm is None:
+        return None
+    dfrm.to_csv(path, sep="\t", index=False)
+    return path
+
+def available_memory():
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
 def dispatch_on_set(keys):
     """
     Decorator to add new dispatch functions
@@ -104,20 +141,59 @@ class PathNode(object):
     @property
     def paths(self):
         for api in API_LYST:
-            yield "{}{}/{}".format(BASE_URL, api, self.id), "{}_{}.json".format(self.id, api)
+            if api not in self.api_status:
+                yield "{}{}/{}".format(BASE_URL, api, self.id), "{}_{}.json".format(self.id, api)
 
-    def log(self):
-        with open(self.logpath, 'a+') as outFile:
-            outFile.write("{}\t{}\n".format(
-                self.id,
-                "\t".join(str(self.api_status[key]) for key in API_LYST)
-            ))
+    @property
+    def finished(self):
+        return len(self.api_status) == len(API_LYST)
+
+    def log(self, outFile=None):
+        '''
+        Write the status row of the pdb into `outFile` (a buffered writer shared by the nodes),
+        or append it to `logpath` if `outFile` is not given
+        '''
+        row = "{}\t{}\n".format(
+            self.id,
+            "\t".join(str(self.api_status[key]) for key in API_LYST))
+        if outFile is None:
+            with open(self.logpath, 'a+') as outFile:
+                outFile.write(row)
+        else:
+            outFile.write(row)
+
+    @staticmethod
+    def read_overview(logpath):
+        '''
+        Status of the (pdb, api) pairs recorded in the overview file
+        '''
+        status = {}
+        if logpath is None or not os.path.exists(logpath):
+            return status
+        with open(logpath) as inFile:
+            for line in inFile:
+                pdb, *values = line.rstrip('\n').split('\t')
+                if len(values) == len(API_LYST):
+                    status[pdb] = dict(zip(API_LYST, (int(value) for value in values)))
+        return status
 
     @classmethod
-    def main(cls, pdbs, logpath):
+    def main(cls, pdbs, logpath, workdir=None, resume=False):
+        '''
+        Yield the nodes lazily
+
+        * `resume`: skip the pairs recorded in the overview file or already saved in `workdir`
+        '''
         cls.logpath = logpath
+        status = cls.read_overview(logpath) if resume else {}
         for pdb in pdbs:
             cur = cls(pdb)
+            if resume:
+                if pdb in status:
+                    continue
+                for api in API_LYST:
+                    if os.path.exists(os.path.join(workdir, "{}_{}.json".format(pdb, api))):
+                        cur.api_status[api] = 1
             yield cur
 
 
@@ -162,7 +238,7 @@ class RetrieveEntryData(object):
         with open(path, 'wb') as fp:
             fp.write(data)
 
-    async def unit(self, pdbNode, url, path, session, semaphore):
+    async def unit(self, pdbNode, url, path, session, semaphore, outFile=None):
         async with semaphore:
             self.Logger.logger.info("Start to get data")
             rawData = await self.retrieve(session, url, pdbNode)
@@ -171,28 +247,70 @@ class RetrieveEntryData(object):
             else:
                 self.Logger.logger.info(
                     "{} Not Found {}".format(pdbNode.id, path[4:]))
-        if len(pdbNode.api_status) == len(API_LYST):
+        if pdbNode.finished:
             # self.Logger.logger.info(str(pdbNode))
-            pdbNode.log()
+            pdbNode.log(outFile)
         return url
 
-    async def multi(self, nodes, concur_req):
+    async def multi(self, nodes, concur_req, window=None):
+        '''
+        Create the tasks lazily, at most `window` (default: `4*concur_req`) tasks would be pending at the same time;
+        the status rows are written through one buffered writer of the overview file
+        '''
+        window = 4*concur_req if window is None else window
         semaphore = asyncio.Semaphore(concur_req)
-        async with aiohttp.ClientSession() as session:
-            res = await asyncio.gather(
-                *[asyncio.create_task(self.unit(pdbNode, url, path, session, semaphore))
-                    for pdbNode in nodes for url, path in pdbNode.paths])
-
-        return len(res)
-
-    def main(self, concur_req=100):
-        nodes = PathNode.main(self.pdbs, self.overview)
+        count = 0
+        pending = set()
+        with open(self.overview, 'a+') as outFile:
+            async with aiohttp.ClientSession() as session:
+                for pdbNode in nodes:
+                    if pdbNode.finished:
+                        pdbNode.log(outFile)
+                        continue
+                    for url, path in list(pdbNode.paths):
+                        if len(pending) >= window:
+                            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                            count += len(done)
+                            for task in done:
+                                task.result()
+                        pending.add(asyncio.create_task(self.unit(pdbNode, url, path, session, semaphore, outFile)))
+                if pending:
+                    done, _ = await asyncio.wait(pending)
+                    count += len(done)
+                    for task in done:
+                        task.result()
+        return count
+
+    def main(self, concur_req=100, window=None, resume=False):
+        nodes = PathNode.main(self.pdbs, self.overview, self.workdir, resume)
         t0 = time.perf_counter()
-        count = asyncio.run(self.multi(nodes, concur_req))
+        count = asyncio.run(self.multi(nodes, concur_req, window))
         elapsed = time.perf_counter() - t0
         self.Logger.logger.info(
             '\n{} entries downloaded in {:.2f}s'.format(count, elapsed))
 
+    def refresh(self, pdbs, withdrawn=(), concur_req=100, window=None):
+        '''
+        Download the entries in `pdbs` again and drop the entries in `withdrawn`
+        (e.g. the changed and the withdrawn entries of `ProcessEntryData.incremental`)
+
+        * the saved json files and the status rows of both are removed, the other entries are kept
+        '''
+        removed = set(pdbs) | set(withdrawn)
+        for pdb in removed:
+            for api in API_LYST:
+                path = os.path.join(self.workdir, "{}_{}.json".format(pdb, api))
+                if os.path.exists(path):
+                    os.remove(path)
+        if os.path.exists(self.overview):
+            with open(self.overview) as inFile:
+                rows = [line for line in inFile if line.split("\t", 1)[0] not in removed]
+            with open(self.overview, 'w') as outFile:
+                outFile.writelines(rows)
+        if pdbs:
+            self.pdbs = list(pdbs)
+            self.main(concur_req, window)
+
     def toFrame(self, suffix):
         files = getFiles(self.workdir, suffix+".json")
         dfrm = traversePDBeData(suffix, PDBeJsonDecoder, files)
@@ -200,10 +318,56 @@ class RetrieveEntryData(object):
             dfrm.to_csv(os.path.join(self.workdir, "%s.tsv" %
                                      suffix), sep="\t", index=False)
 
-    def toFrameAll(self):
-        with ProcessPoolExecutor() as executor:
-            # future_tasks = [executor.submit(self.toFrame, suffix) for suffix in API_LYST]
-            executor.map(self.toFrame, API_LYST)
+    def toFrameAll(self, shard_bytes=2**26, expansion=10, memory_fraction=0.5, max_workers=None):
+        '''
+        Decode the json files of all the apis shard by shard across the workers
+
+        * the files of an api are split into shards of about `shard_bytes`,
+          each shard is written to `{workdir}/{api}/part-{i}.tsv`
+        * a shard is expected to take `expansion` times its size of memory when decoded,
+          new shards would be submitted only while the expected memory of the running shards
+          stays within `memory_fraction` of the available memory
+        '''
+        budget = available_memory() * memory_fraction
+        parts = {api: [] for api in API_LYST}
+        counter = {api: 0 for api in API_LYST}
+        running = {}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            def collect(done):
+                for future in done:
+                    api, _ = running.pop(future)
+                    path = future.result()
+                    if path is not None:
+                        parts[api].append(path)
+
+            for api, files, size in yieldShards(self.workdir, shard_bytes):
+                while running and sum(cost for _, cost in running.values()) + size*expansion > budget:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done)
+                folder = os.path.join(self.workdir, api)
+                if counter[api] == 0:
+                    # clear the parts of the previous run
+                    os.makedirs(folder, exist_ok=True)
+                    for old in getFiles(folder, "part-"):
+                        os.remove(old)
+                path = os.path.join(folder, "part-{}.tsv".format(counter[api]))
+                counter[api] += 1
+                running[executor.submit(decodeShard, api, files, path)] = (api, size*expansion)
+            collect(wait(running).done)
+        return parts
+
+    def readFrame(self, api):
+        '''
+        Read the decoded table of an api: the parts `{workdir}/{api}/part-{i}.tsv` written by `toFrameAll`,
+        or `{workdir}/{api}.tsv` written by `toFrame` if there is no part
+        '''
+        folder = os.path.join(self.workdir, api)
+        paths = sorted(getFiles(folder, "part-"), key=lambda path: int(path[path.rindex("part-")+5:-4])) if os.path.isdir(folder) else []
+        if not paths and os.path.exists(os.path.join(self.workdir, "%s.tsv" % api)):
+            paths = [os.path.join(self.workdir, "%s.tsv" % api)]
+        if not paths:
+            return None
+        return pd.concat((pd.read_csv(path, sep="\t") for path in paths), ignore_index=True, sort=False)
 
 
 class PDBeJsonDecoder(object):
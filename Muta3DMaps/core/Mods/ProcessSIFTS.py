@@ -17,6 +17,10 @@ import functools
 from ..Utils.Logger import RunningLogger
 from ..Utils.FileIO import decompression, file_i, file_o
 from ..Utils.Tools import Gadget
+from ..ranges import RaggedRanges, classify_segments
+from ..pdbe.index import UniProtPDBIndex
+# SEG_SIFTS_MAP is kept importable from this module
+from ..pdbe.constants import RAW_SIFTS_COLUMNS, SEG_SIFTS_MAP
 
 
 SIFTS_URL = 'http://www.ebi.ac.uk/pdbe/api/mappings/all_isoforms/%s'
@@ -24,22 +28,6 @@ SIFTS_FILE_URL = {
     "uniprot_pdb": "ftp://ftp.ebi.ac.uk/pub/databases/msd/sifts/flatfiles/csv/uniprot_pdb.csv.gz"
 }
 PDB_ID = "pdb_id"
-RAW_SIFTS_COLUMNS = [
-    'pdb_id', 'chain_id', 'UniProt', 'identity', 'identifier', 'pdb_start',
-    'pdb_end', 'unp_start', 'unp_end', 'is_canonical', 'start', 'end',
-    'entity_id', 'struct_asym_id'
-]
-SEG_SIFTS_MAP = {
-      "SP_PRIMARY": "UniProt",  # (Canonical)
-      "RES_BEG": "pdb_start",
-      "RES_END": "pdb_end",
-      "PDB_BEG": "residue index(start) in pdb",
-      "PDB_END": "residue index(end) in pdb",
-      "SP_BEG": "unp_start",
-      "SP_END": "unp_end",
-      "PDB": 'pdb_id',
-      "CHAIN": 'chain_id',
-}
 
 
 class RetrieveSIFTS:
@@ -137,16 +125,8 @@ class RetrieveSIFTS:
 
             self.Logger.logger.info("Download File: %s" % filePath[:-3])
 
-        dfrm = pd.read_csv(filePath[:-3], sep=',', header=1)
-        pdb_list = []
-        if related_unp is not None:
-            dfrm = dfrm[dfrm['SP_PRIMARY'].isin(related_unp)]
-        for i in dfrm.index:
-            pdb_list.extend(dfrm.loc[i, 'PDB'].split(';'))
-        if related_pdb is not None:
-            return {'pdb_set': set(pdb_list) & set(related_pdb), 'unp_set': set(dfrm['SP_PRIMARY'])}
-        else:
-            return {'pdb_set': set(pdb_list), 'unp_set': set(dfrm['SP_PRIMARY'])}
+        pdb_set, unp_set = UniProtPDBIndex.from_file(filePath[:-3], sep=',').related(related_unp, related_pdb)
+        return {'pdb_set': pdb_set, 'unp_set': unp_set}
 
 
 def handle_SIFTS(filePath, skiprows=0, outputPath=None):
@@ -179,46 +159,18 @@ def handle_SIFTS(filePath, skiprows=0, outputPath=None):
 
 
 def deal_with_insertionDeletion_SIFTS(sifts_df=None, sifts_filePath=None, outputPath=None):
-    def get_gap_list(li):
-        gap_num = len(li) - 1
-        gap_list = []
-        for i in range(gap_num):
-            gap_list.append(li[i+1][0] - li[i][1] - 1)
-        return gap_list
-
-    def get_ran_var(li_a, li_b):
-        array_a = np.array([ran[1] - ran[0] + 1 for ran in li_a])
-        array_b = np.array([ran[1] - ran[0] + 1 for ran in li_b])
-        return (array_a - array_b).tolist()
-
-    def add_tage_to_range(df, tage_name):
-        # ADD TAGE FOR SIFTS
-        df[tage_name] = 'Safe'
-        # No Insertion But Deletion[Pure Deletion]
-        df.loc[(df[(df['group_info'] == 1) & (df['sifts_unp_pdb_var'] > 0)].index), tage_name] = 'Deletion'
-        # Insertion & No Deletion
-        df.loc[df[
-            (df['group_info'] != 1) &
-            (df['var_0_count'] == df['group_info']) &
-            (df['unp_GAP_0_count'] == (df['group_info'] -1))].index, tage_name] = 'Insertion'
-        # Insertion & Deletion
-        df.loc[df[
-            (df['group_info'] != 1) &
-            ((df['var_0_count'] != df['group_info']) |
-            (df['unp_GAP_0_count'] != (df['group_info'] - 1)))].index, tage_name] = 'Insertion & Deletion'
-
     dfrm = file_i(sifts_filePath, sifts_df, ('sifts_filePath', 'sifts_df'))
-    dfrm['pdb_GAP_list'] = dfrm.apply(lambda x: json.dumps(get_gap_list(json.loads(x['sifts_pdb_range']))), axis=1)
-    dfrm['unp_GAP_list'] = dfrm.apply(lambda x: json.dumps(get_gap_list(json.loads(x['sifts_unp_range']))), axis=1)
-    dfrm['var_list'] = dfrm.apply(lambda x: json.dumps(get_ran_var(json.loads(x['sifts_unp_range']), json.loads(x['sifts_pdb_range']))), axis=1)
-    dfrm['delete'] = dfrm.apply(lambda x: x['var_list'].find('-') != -1, axis=1)
-    dfrm['delete'] = dfrm.apply(lambda x: True if x['unp_GAP_list'].find('-') != -1 else x['delete'], axis=1)
-    dfrm['var_0_count'] = dfrm.apply(lambda x: json.loads(x['var_list']).count(0), axis=1)
-    dfrm['unp_GAP_0_count'] = dfrm.apply(lambda x: json.loads(x['unp_GAP_list']).count(0), axis=1)
-    dfrm['group_info'] = dfrm.apply(lambda x: len(json.loads(x['sifts_pdb_range'])), axis=1)
-    dfrm['sifts_unp_pdb_var'] = dfrm.apply(lambda x: json.loads(x['var_list'])[0], axis=1)
-
-    add_tage_to_range(dfrm, tage_name='sifts_range_tage')
+    res = classify_segments(
+        RaggedRanges.from_json(dfrm['sifts_pdb_range']),
+        RaggedRanges.from_json(dfrm['sifts_unp_range']),
+        index=dfrm.index, separator=', ')
+    res.rename(columns={
+        'pdb_gap_list': 'pdb_GAP_list', 'unp_gap_list': 'unp_GAP_list',
+        'unp_gap_0_count': 'unp_GAP_0_count', 'unp_pdb_var': 'sifts_unp_pdb_var',
+        'range_tag': 'sifts_range_tage'}, inplace=True)
+    for col in res.columns:
+        dfrm[col] = res[col]
+
     if outputPath is not None and os.path.exists(outputPath):
         header = False
     else:
@@ -293,54 +245,108 @@ def update_range_SIFTS(unp_fasta_files_path, new_range_cols=('new_sifts_unp_rang
     return new_sifts_df
 
 
+class SegmentMapper(object):
+    '''
+    Residue mapper of a (UniProt, pdb, chain) built from its aligned segments
+
+    * UniProt -> SEQRES: binary search over the (non-overlapping) UniProt segments for the position
+      of the site in the aligned residues, then over the PDB segments for the residue at that position
+    * SEQRES -> author numbering: the `_pdbx_poly_seq_scheme` columns are split once and indexed by `SEQRES - 1`
+    * a site out of the UniProt segments is `UNMAPPED` (`#`),
+      a site beyond the residues of the PDB segments is `OVERFLOW` (`$`)
+    * `from_row` shares one mapper between the rows with the same ranges and scheme (see `cached`)
+    '''
+
+    UNMAPPED: int = -1
+    OVERFLOW: int = -2
+    scheme_cols: tuple = (
+        '_pdbx_poly_seq_scheme.auth_seq_num', '_pdbx_poly_seq_scheme.pdb_seq_num',
+        '_pdbx_poly_seq_scheme.pdb_ins_code', '_pdbx_poly_seq_scheme.mon_id')
+
+    def __init__(self, unp_range, pdb_range, auth_seq_num=None, pdb_seq_num=None, pdb_ins_code=None, mon_id=None):
+        unp = np.asarray(json.loads(unp_range) if isinstance(unp_range, str) else unp_range, dtype=np.int64).reshape(-1, 2)
+        pdb = np.asarray(json.loads(pdb_range) if isinstance(pdb_range, str) else pdb_range, dtype=np.int64).reshape(-1, 2)
+        unp_offsets = np.concatenate(([0], np.cumsum(unp[:, 1] - unp[:, 0] + 1)))
+        order = np.argsort(unp[:, 0], kind='stable')
+        self.unp_starts, self.unp_ends, self.unp_offsets = unp[order, 0], unp[order, 1], unp_offsets[:-1][order]
+        self.pdb_starts = pdb[:, 0]
+        self.pdb_offsets = np.concatenate(([0], np.cumsum(pdb[:, 1] - pdb[:, 0] + 1)))
+        self.auth_seq_num = None if auth_seq_num is None else auth_seq_num.split(';')
+        self.pdb_seq_num = None if pdb_seq_num is None else pdb_seq_num.split(';')
+        self.pdb_ins_code = None if pdb_ins_code is None else pdb_ins_code.split(';')
+        self.mon_id = mon_id
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def cached(cls, unp_range, pdb_range, *scheme):
+        '''
+        Shared mapper of the same ranges and `_pdbx_poly_seq_scheme` columns (the mapper is never modified)
+        '''
+        return cls(unp_range, pdb_range, *scheme)
+
+    @classmethod
+    def from_row(cls, x, unp_range_col, pdb_range_col):
+        args = (x[unp_range_col], x[pdb_range_col], *(x[col] for col in cls.scheme_cols))
+        try:
+            return cls.cached(*args)
+        except TypeError:
+            # ranges given as lists are unhashable
+            return cls(*args)
+
+    def unp2seqres(self, sites) -> np.ndarray:
+        '''
+        SEQRES index of each UniProt site, `UNMAPPED` or `OVERFLOW` if it could not be mapped
+        '''
+        sites = np.asarray(sites, dtype=np.int64)
+        if not len(self.unp_starts):
+            return np.full(sites.shape, self.UNMAPPED, dtype=np.int64)
+        seg = np.searchsorted(self.unp_starts, sites, 'right') - 1
+        found = (seg >= 0) & (sites <= self.unp_ends[seg.clip(0)])
+        index = self.unp_offsets[seg.clip(0)] + sites - self.unp_starts[seg.clip(0)]
+        overflow = index >= self.pdb_offsets[-1]
+        pdb_seg = (np.searchsorted(self.pdb_offsets, index, 'right') - 1).clip(0, len(self.pdb_starts) - 1)
+        seqres = self.pdb_starts[pdb_seg] + index - self.pdb_offsets[pdb_seg] if len(self.pdb_starts) else index
+        return np.where(found, np.where(overflow, self.OVERFLOW, seqres), self.UNMAPPED)
+
+    def seqres2auth(self, seqres: int) -> str:
+        '''
+        Author residue number (with the insertion code) of a SEQRES index
+        '''
+        inscode = self.pdb_ins_code[seqres-1]
+        return self.pdb_seq_num[seqres-1] if inscode == '.' else '%s%s' % (self.pdb_seq_num[seqres-1], inscode)
+
+
 def map_muta_from_unp_to_pdb(x, muta_col, unp_range_col, pdb_range_col, error_li):
     sub_error_li = []
     muta_li = x[muta_col]
     if isinstance(muta_li, str):
         muta_li = json.loads(muta_li.replace('\'', '"'))
-    unp_range = json.loads(x[unp_range_col])
-    pdb_range = json.loads(x[pdb_range_col])
-
-    auth_seq_li = x['_pdbx_poly_seq_scheme.auth_seq_num'].split(';')
-    com_seq_li = x['_pdbx_poly_seq_scheme.pdb_seq_num'].split(';')
-    inscode_seq_li = x['_pdbx_poly_seq_scheme.pdb_ins_code'].split(';')
+    mapper = SegmentMapper.from_row(x, unp_range_col, pdb_range_col)
+    auth_seq_li, com_seq_li, inscode_seq_li = mapper.auth_seq_num, mapper.pdb_seq_num, mapper.pdb_ins_code
     found_muta_1 = x['mutation_content'].split(',')
     found_muta_2 = [i[1:-1] for i in found_muta_1]
 
-    pdb_li = []
-    unp_li = []
     new_muta_site = []
-    for ran in pdb_range:
-        pdb_li.extend(list(range(ran[0], ran[1]+1)))
-    for ran in unp_range:
-        unp_li.extend(list(range(ran[0], ran[1]+1)))
-
+    sites, mutaTypes = [], []
     for muta in muta_li:
         try:
             int(muta[0])
             site, mutaType = int(muta), False
         except ValueError:
             site, mutaType = int(muta[1:-1]), True
+        sites.append(site)
+        mutaTypes.append(mutaType)
 
-        try:
-            seqresSite = pdb_li[unp_li.index(site)]
-        except ValueError:
+    for muta, mutaType, seqresSite in zip(muta_li, mutaTypes, mapper.unp2seqres(sites).tolist()):
+        if seqresSite == mapper.UNMAPPED:
             new_muta_site.append('#')
             sub_error_li.append('Unmapped #: %s' % muta)
             continue
-        except IndexError:
+        elif seqresSite == mapper.OVERFLOW:
             new_muta_site.append('$')
             sub_error_li.append('Unmapped $: %s' % muta)
             continue
-        '''
-        try:
-            seq_aa = x['_pdbx_poly_seq_scheme.mon_id'][seqresSite-1]
-        except IndexError:
-            print(x['pdb_id'], x['UniProt'], x['new_sifts_pdb_range'], x['new_sifts_unp_range'])
-            print(x['_pdbx_poly_seq_scheme.mon_id'], seqresSite)
-            raise IndexError
-        '''
-        seq_aa = x['_pdbx_poly_seq_scheme.mon_id'][seqresSite-1]
+        seq_aa = mapper.mon_id[seqresSite-1]
         ref_aa = muta[0]
         inscode = inscode_seq_li[seqresSite-1]
 
@@ -367,15 +373,349 @@ def map_muta_from_unp_to_pdb(x, muta_col, unp_range_col, pdb_range_col, error_li
             sub_error_li.append('Safe')
 
         # Check inscode
-        if inscode != '.':
-            new_muta_site.append('%s%s' % (com_seq_li[seqresSite-1], inscode))
-        else:
-            new_muta_site.append(com_seq_li[seqresSite-1])
+        new_muta_site.append(mapper.seqres2auth(seqresSite))
 
     error_li.append(sub_error_li)
     return new_muta_site
 
 
+def split_flat(values, sep=';'):
+    '''
+    Split a column of delimited strings into one flat array with CSR offsets (`sep=''` splits into characters)
+    '''
+    values = [value if isinstance(value, str) else '' for value in values]
+    if not values:
+        return np.zeros(1, dtype=np.int64), np.array([], dtype=object)
+    if sep:
+        counts = np.fromiter((value.count(sep) + 1 for value in values), dtype=np.int64, count=len(values))
+        flat = np.array(sep.join(values).split(sep), dtype=object)
+    else:
+        counts = np.fromiter((len(value) for value in values), dtype=np.int64, count=len(values))
+        flat = np.array(list(''.join(values)), dtype=object)
+    return np.concatenate(([0], np.cumsum(counts))), flat
+
+
+def asof_join(seg_rows, seg_keys, rows, keys):
+    '''
+    Index of the segment with the largest `seg_keys <= keys` in the same row of each query, -1 if there is none
+    '''
+    if not len(seg_keys):
+        return np.full(len(keys), -1, dtype=np.int64)
+    base = min(seg_keys.min(), keys.min(initial=0))
+    stride = max(seg_keys.max(), keys.max(initial=0)) - base + 1
+    seg_codes = seg_rows*stride + seg_keys - base
+    order = np.argsort(seg_codes, kind='stable')
+    pos = np.searchsorted(seg_codes[order], rows*stride + keys - base, 'right') - 1
+    res = order[pos.clip(0)]
+    return np.where((pos >= 0) & (seg_rows[res] == rows), res, -1)
+
+
+def segments_before(ranges):
+    '''
+    Number of the residues of the previous segments in the same row, for each segment
+    '''
+    lengths = ranges.ends - ranges.starts + 1
+    before = np.cumsum(lengths) - lengths
+    return before - before[ranges.offsets[ranges.rows]]
+
+
+def map_muta_table(dfrm, muta_col, unp_range_col, pdb_range_col, key_cols=('UniProt', 'pdb_id', 'chain_id')):
+    '''
+    Vectorized `map_muta_from_unp_to_pdb` over a whole table
+
+    * the range columns could be JSON strings or `ranges` columns (see `RangesArray`)
+    * the mutations are exploded to one row per (mutation, mapping row)
+    * the sites are as-of joined to the UniProt segments sorted by (row, start)
+      and their aligned positions to the PDB segments sorted by (row, position)
+    * author numbering and the reference residue check index the `_pdbx_poly_seq_scheme`
+      columns split into flat arrays once
+
+    Return a tidy `DataFrame` with `index` (label of the row in `dfrm`), `key_cols`, `muta_col` (one mutation),
+    `site`, `seqres` (`SegmentMapper.UNMAPPED`/`OVERFLOW` if unmapped), `mutation_pdb` and `muta_map_info`,
+    the last two hold the same values as `map_muta_from_unp_to_pdb`
+    '''
+    key_cols = [col for col in key_cols if col in dfrm.columns]
+    mutas = dfrm[muta_col].map(lambda value: json.loads(value.replace('\'', '"')) if isinstance(value, str) else value)
+    mutas = mutas.reset_index(drop=True).explode().dropna()
+    rows = mutas.index.to_numpy(np.int64)
+    muta = mutas.astype(str).to_numpy(object)
+    res = pd.DataFrame({'index': dfrm.index.to_numpy()[rows]})
+    for col in key_cols:
+        res[col] = dfrm[col].to_numpy()[rows]
+    res[muta_col] = muta
+    mutaType = ~pd.Series(muta, dtype=object).str[0].str.isdigit().to_numpy(bool)
+    site = np.where(mutaType, pd.Series(muta, dtype=object).str[1:-1], muta).astype(np.int64)
+
+    # UniProt site -> position in the aligned residues -> SEQRES (the sentinel at the end is picked by -1)
+    unp = dfrm[unp_range_col].ranges.data
+    pdb = dfrm[pdb_range_col].ranges.data
+    unp_before, pdb_before = segments_before(unp), segments_before(pdb)
+    seg = asof_join(unp.rows, unp.starts, rows, site)
+    unp_starts, unp_ends, unp_before = (np.append(values, 0) for values in (unp.starts, unp.ends, unp_before))
+    found = (seg >= 0) & (site <= unp_ends[seg])
+    index = np.where(found, unp_before[seg] + site - unp_starts[seg], 0)
+    overflow = found & (index >= np.bincount(pdb.rows, pdb.ends - pdb.starts + 1, minlength=len(dfrm)).astype(np.int64)[rows])
+    mapped = found & ~overflow
+    pdb_seg = asof_join(pdb.rows, pdb_before, rows, index)
+    seqres = np.append(pdb.starts, 0)[pdb_seg] + index - np.append(pdb_before, 0)[pdb_seg]
+    res['site'] = site
+    res['seqres'] = np.where(found, np.where(overflow, SegmentMapper.OVERFLOW, seqres), SegmentMapper.UNMAPPED)
+
+    # SEQRES -> `_pdbx_poly_seq_scheme`, negative positions count from the end as in `map_muta_from_unp_to_pdb`
+    auth_seq_num, pdb_seq_num, pdb_ins_code, mon_id = (
+        split_flat(dfrm[col], '' if col.endswith('mon_id') else ';') for col in SegmentMapper.scheme_cols)
+    scheme = {}
+    for name, (offsets, flat) in zip(('auth', 'com', 'ins', 'seq_aa'), (auth_seq_num, pdb_seq_num, pdb_ins_code, mon_id)):
+        counts = (offsets[1:] - offsets[:-1])[rows]
+        pos = np.where(mapped, seqres - 1, 0)
+        pos = np.where(pos < 0, pos + counts, pos)
+        invalid = mapped & ((pos < 0) | (pos >= counts))
+        if invalid.any():
+            raise IndexError('SEQRES out of the _pdbx_poly_seq_scheme: %s' % res[invalid].head(3).to_dict('records'))
+        scheme[name] = np.where(mapped, np.append(flat, '')[np.where(mapped, offsets[:-1][rows] + pos, -1)], '')
+    ref_aa = pd.Series(muta, dtype=object).str[0].to_numpy(object)
+
+    # the mutation already found in the entity at the same residue (the first one in `mutation_content`)
+    offsets, tokens = split_flat(dfrm['mutation_content'], ',')
+    found_muta = pd.DataFrame({
+        'row': np.repeat(np.arange(len(dfrm)), offsets[1:] - offsets[:-1]),
+        'com': pd.Series(tokens, dtype=object).str[1:-1].to_numpy(object),
+        'found_muta': tokens}).drop_duplicates(['row', 'com'])
+    found_muta = pd.DataFrame({'row': rows, 'com': scheme['com']}).merge(found_muta, how='left').found_muta.fillna('').to_numpy(object)
+    entity = (found_muta != '') & (pd.Series(found_muta, dtype=object).str[:1].to_numpy(object) == ref_aa)
+    error_info = (
+        np.where(entity, 'EntityMutation: ' + found_muta + ',', '')
+        + np.where(scheme['seq_aa'] == 'X', 'ModifiedResidue: ', 'PossibleMutation: ')
+        + scheme['seq_aa'] + scheme['com'] + scheme['ins'])
+    res['mutation_pdb'] = np.select(
+        [~found, overflow],
+        ['#', '$'],
+        scheme['com'] + np.where(scheme['ins'] == '.', '', scheme['ins']))
+    res['muta_map_info'] = np.select(
+        [~found, overflow, (scheme['seq_aa'] != ref_aa) & mutaType, scheme['auth'] == '?'],
+        ['Unmapped #: ' + muta, 'Unmapped $: ' + muta, error_info, 'Missing'],
+        'Safe')
+    return res
+
+
+class ReverseMapper(object):
+    '''
+    Batch mapper from PDB author residues (`pdb_seq_num` + `pdb_ins_code`) to UniProt positions
+
+    * author residue -> SEQRES: the residues of the `_pdbx_poly_seq_scheme` columns of every row,
+      keyed by `chain_code << 32 | (pdb_seq_num + 2**23) << 8 | insertion code` and sorted
+    * SEQRES -> UniProt: as-of join to the PDB segments of the row for the position in the aligned residues,
+      then to the UniProt segments for the site at that position
+    * a chain mapped to several accessions has one row per accession, so a residue could get several hits
+    '''
+
+    num_shift: int = 2**23
+
+    def __init__(self, dfrm, unp_range_col='new_sifts_unp_range', pdb_range_col='new_sifts_pdb_range'):
+        dfrm = dfrm.reset_index(drop=True)
+        self.UniProt, self.pdb_id, self.chain_id = (dfrm[col].to_numpy(object) for col in ('UniProt', 'pdb_id', 'chain_id'))
+        self.chains, chain_codes = np.unique((dfrm['pdb_id'] + '\t' + dfrm['chain_id']).to_numpy(str), return_inverse=True)
+        self.row_chains = chain_codes.ravel().astype(np.int64)
+        self.unp = dfrm[unp_range_col].ranges.data
+        self.pdb = dfrm[pdb_range_col].ranges.data
+        self.unp_before, self.pdb_before = segments_before(self.unp), segments_before(self.pdb)
+        self.unp_total = np.bincount(self.unp.rows, self.unp.ends - self.unp.starts + 1, minlength=len(dfrm)).astype(np.int64)
+        offsets, nums = split_flat(dfrm['_pdbx_poly_seq_scheme.pdb_seq_num'])
+        _, ins_codes = split_flat(dfrm['_pdbx_poly_seq_scheme.pdb_ins_code'])
+        rows = np.repeat(np.arange(len(dfrm)), offsets[1:] - offsets[:-1])
+        seqres = np.arange(len(rows)) - offsets[rows] + 1
+        nums = pd.to_numeric(pd.Series(nums, dtype=object), errors='coerce').to_numpy(np.float64)
+        valid = ~np.isnan(nums)
+        keys = self.residue_keys(self.row_chains[rows], nums, ins_codes)
+        order = np.argsort(keys[valid], kind='stable')
+        self.keys = keys[valid][order]
+        self.key_rows = rows[valid][order]
+        self.key_seqres = seqres[valid][order]
+
+    def __repr__(self):
+        return f'ReverseMapper<chains:{len(self.chains)}, residues:{len(self.keys)}>'
+
+    @classmethod
+    def residue_keys(cls, chain_codes, nums, ins_codes):
+        ins = np.fromiter((
+            ord(code[0]) if isinstance(code, str) and code and code not in ('.', '?') else 0
+            for code in ins_codes), dtype=np.int64, count=len(ins_codes)) & 0xFF
+        return (chain_codes << 32) | ((np.nan_to_num(nums).astype(np.int64) + cls.num_shift) << 8) | ins
+
+    def query(self, pdb_ids, chain_ids, auth_seq_nums, ins_codes=None):
+        '''
+        Map a batch of author residues in one vectorized call
+
+        Return the hits as a `DataFrame`: `query` (position of the residue in the inputs), `pdb_id`, `chain_id`,
+        `UniProt`, `seqres` and `unp_site`, residues out of the aligned segments have no hit
+        '''
+        chains = (pd.Series(pdb_ids, dtype=str).reset_index(drop=True) + '\t'
+                  + pd.Series(chain_ids, dtype=str).reset_index(drop=True)).to_numpy(str)
+        nums = pd.to_numeric(pd.Series(auth_seq_nums).reset_index(drop=True), errors='coerce').to_numpy(np.float64)
+        ins_codes = [''] * len(chains) if ins_codes is None else list(ins_codes)
+        chain_codes = np.searchsorted(self.chains, chains)
+        chain_codes[chain_codes == len(self.chains)] = 0
+        found = (self.chains[chain_codes] == chains) & ~np.isnan(nums) if len(self.chains) else np.zeros(len(chains), dtype=bool)
+        keys = self.residue_keys(chain_codes.astype(np.int64), nums, ins_codes)
+        lo = np.searchsorted(self.keys, keys, 'left')
+        hi = np.searchsorted(self.keys, keys, 'right')
+        counts = np.where(found, hi - lo, 0)
+        query = np.repeat(np.arange(len(chains)), counts)
+        hits = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+        rows, seqres = self.key_rows[hits], self.key_seqres[hits]
+        # SEQRES -> position in the aligned residues -> UniProt site (the sentinel at the end is picked by -1)
+        seg = asof_join(self.pdb.rows, self.pdb.starts, rows, seqres)
+        mapped = (seg >= 0) & (seqres <= np.append(self.pdb.ends, 0)[seg])
+        index = np.where(mapped, np.append(self.pdb_before, 0)[seg] + seqres - np.append(self.pdb.starts, 0)[seg], 0)
+        mapped &= index < self.unp_total[rows]
+        unp_seg = asof_join(self.unp.rows, self.unp_before, rows, index)
+        unp_site = np.append(self.unp.starts, 0)[unp_seg] + index - np.append(self.unp_before, 0)[unp_seg]
+        rows = rows[mapped]
+        return pd.DataFrame({
+            'query': query[mapped], 'pdb_id': self.pdb_id[rows], 'chain_id': self.chain_id[rows],
+            'UniProt': self.UniProt[rows], 'seqres': seqres[mapped], 'unp_site': unp_site[mapped]})
+
+
+def expand_segments(ranges, limits):
+    '''
+    Residues of the segments of each row in order, at most `limits[row]` residues of a row
+
+    Return the row and the residue number of each residue
+    '''
+    lengths = ranges.ends - ranges.starts + 1
+    before = segments_before(ranges)
+    rows = np.repeat(ranges.rows, lengths)
+    rank = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    position = np.repeat(before, lengths) + rank
+    keep = position < limits[rows]
+    return rows[keep], (np.repeat(ranges.starts, lengths) + rank)[keep]
+
+
+class BestStructureIndex(object):
+    '''
+    Per-residue index of the structures covering each UniProt position, ranked best first
+
+    * the hits of the residue `site` of the i-th accession are `[offsets[base[i]+site]:offsets[base[i]+site+1]]`,
+      so that a lookup costs one binary search for the accession and O(1) for the residue
+    * a hit is the row of `rows.tsv` (pdb_id, chain_id, UniProt, resolution_score, method, identity),
+      the SEQRES index, the author residue number (`pdb_seq_num` + insertion code) and whether it is observed
+    * the hits are ranked with observed residues first, then by the chain rank of `Gadget.rankOrder`
+      (the one of `select_PDB_SIFTS`) on `rank_list`: lower `resolution_score`, the method order of `METHOD_RANK`
+      and higher `identity`
+    * the input table is taken as it is, filtering the chains is left to the caller (e.g. `Run.chain_filter`)
+    * the arrays are saved as `.npy` files and memory-mapped when loaded
+    '''
+
+    arrays: tuple = (
+        'unp_ids', 'base', 'offsets', 'hit_rows', 'hit_seqres',
+        'hit_author_num', 'hit_author_ins', 'hit_observed')
+    row_cols: tuple = ('pdb_id', 'chain_id', 'UniProt', 'resolution_score', 'method', 'identity')
+    rank_list: tuple = ('resolution_score', 'method', 'identity')
+    METHOD_RANK = {'X-RAY DIFFRACTION': 0, 'SOLUTION NMR': 1, 'ELECTRON MICROSCOPY': 2}
+    row_file: str = 'rows.tsv'
+
+    def __init__(self, folder, mmap_mode='r'):
+        self.folder = folder
+        for name in self.arrays:
+            setattr(self, name, np.load(os.path.join(folder, '%s.npy' % name), mmap_mode=mmap_mode))
+        self.rows = pd.read_csv(os.path.join(folder, self.row_file), sep='\t', dtype={'pdb_id': str, 'chain_id': str, 'UniProt': str})
+
+    def __repr__(self):
+        return 'BestStructureIndex<unp:%s, hits:%s>' % (len(self.unp_ids), len(self.hit_rows))
+
+    @classmethod
+    def build(cls, dfrm, folder, unp_range_col='new_sifts_unp_range', pdb_range_col='new_sifts_pdb_range'):
+        '''
+        Build the index from the (filtered) integrated SIFTS x mmCIF table (the output of `unp2PDB`)
+        '''
+        dfrm = dfrm[dfrm[unp_range_col].notna() & dfrm[pdb_range_col].notna()].reset_index(drop=True)
+        os.makedirs(folder, exist_ok=True)
+        unp = dfrm[unp_range_col].ranges.data
+        pdb = dfrm[pdb_range_col].ranges.data
+        # the aligned residues of a row are the first min(UniProt, PDB) residues of both segment lists
+        aligned = np.minimum(*(np.bincount(ranges.rows, ranges.ends - ranges.starts + 1, minlength=len(dfrm)) for ranges in (unp, pdb))).astype(np.int64)
+        rows, sites = expand_segments(unp, aligned)
+        _, seqres = expand_segments(pdb, aligned)
+        unp_ids, unp_codes = np.unique(dfrm['UniProt'].to_numpy(str), return_inverse=True)
+        unp_codes = unp_codes.ravel()[rows]
+
+        # SEQRES -> `_pdbx_poly_seq_scheme`, SEQRES out of the scheme is treated as unobserved
+        scheme = {}
+        for name, col in (('auth', '_pdbx_poly_seq_scheme.auth_seq_num'), ('num', '_pdbx_poly_seq_scheme.pdb_seq_num'), ('ins', '_pdbx_poly_seq_scheme.pdb_ins_code')):
+            offsets, flat = split_flat(dfrm[col])
+            valid = (seqres >= 1) & (seqres <= (offsets[1:] - offsets[:-1])[rows])
+            scheme[name] = np.where(valid, np.append(flat, '?')[np.where(valid, offsets[:-1][rows] + seqres - 1, -1)], '?')
+        observed = scheme['auth'] != '?'
+        author_num = pd.to_numeric(pd.Series(scheme['num'], dtype=object), errors='coerce').fillna(0).to_numpy(np.int32)
+        author_ins = np.fromiter((ord(code[0]) if code and code not in ('.', '?') else 0 for code in scheme['ins']), dtype=np.uint8, count=len(rows))
+
+        # rank the chains the way of `select_PDB_SIFTS` (larger is better), then the hits of each residue
+        scores = pd.DataFrame({
+            'resolution_score': -dfrm['resolution_score'].map(Gadget.handleResolution).astype(np.float64),
+            'method': -dfrm['method'].map(cls.METHOD_RANK).fillna(len(cls.METHOD_RANK)),
+            'identity': dfrm['identity'].astype(np.float64)})
+        chain_rank = np.empty(len(dfrm), dtype=np.int64)
+        chain_rank[Gadget.rankOrder(scores, list(cls.rank_list))] = np.arange(len(dfrm))
+        order = np.lexsort((chain_rank[rows], ~observed, sites, unp_codes))
+        length = np.zeros(len(unp_ids), dtype=np.int64)
+        np.maximum.at(length, unp_codes, sites)
+        base = np.concatenate(([0], np.cumsum(length + 1)))
+        counts = np.bincount(base[unp_codes] + sites, minlength=base[-1])
+        data = {
+            'unp_ids': unp_ids,
+            'base': base,
+            'offsets': np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            'hit_rows': rows[order].astype(np.int32),
+            'hit_seqres': seqres[order].astype(np.int32),
+            'hit_author_num': author_num[order],
+            'hit_author_ins': author_ins[order],
+            'hit_observed': observed[order]}
+        for name in cls.arrays:
+            np.save(os.path.join(folder, '%s.npy' % name), data[name])
+        # write the row table at last so that an interrupted build could not be loaded
+        dfrm.reindex(columns=cls.row_cols).to_csv(os.path.join(folder, cls.row_file), sep='\t', index=False)
+        return cls(folder)
+
+    def query(self, unps, sites, top=1):
+        '''
+        The `top` ranked structures (all of them if `top` is `None`) of a batch of (UniProt, site)
+
+        Return one row per hit with `query` (position in the inputs) and `rank` (0 for the best)
+        '''
+        unps = np.asarray(list(unps), dtype=str)
+        sites = np.asarray(list(sites), dtype=np.int64)
+        lo = counts = np.zeros(len(unps), dtype=np.int64)
+        if len(self.unp_ids):
+            codes = np.searchsorted(self.unp_ids, unps)
+            codes[codes == len(self.unp_ids)] = 0
+            found = (self.unp_ids[codes] == unps) & (sites >= 0) & (sites < self.base[codes+1] - self.base[codes])
+            position = np.where(found, self.base[codes] + sites, 0)
+            lo = self.offsets[position]
+            counts = np.where(found, self.offsets[position+1] - lo, 0)
+        if top is not None:
+            counts = np.minimum(counts, top)
+        query = np.repeat(np.arange(len(unps)), counts)
+        rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        hits = np.repeat(lo, counts) + rank
+        rows = np.asarray(self.hit_rows[hits], dtype=np.int64)
+        res = self.rows.iloc[rows].reset_index(drop=True)
+        res.insert(0, 'query', query)
+        res.insert(1, 'rank', rank)
+        res.insert(2, 'site', sites[query])
+        res['seqres'] = self.hit_seqres[hits]
+        res['author_residue'] = [
+            '%s%s' % (num, chr(ins) if ins else '') for num, ins in zip(self.hit_author_num[hits].tolist(), self.hit_author_ins[hits].tolist())]
+        res['observed'] = self.hit_observed[hits]
+        return res
+
+    def best(self, unp, site):
+        '''
+        The best structure of a residue as a `dict`, `None` if no structure covers it
+        '''
+        res = self.query([unp], [site])
+        return res.iloc[0].to_dict() if len(res) else None
+
+
 def select_PDB_SIFTS(groupby_list, select_col, rank_col, rank_list, rank_format, range_name, sifts_df=None, sifts_filePath=None, outputPath=None, r1_cutoff=0.3, r2_cutoff=0.2):
     sifts_dfrm = file_i(sifts_filePath, sifts_df, ('sifts_filePath', 'sifts_df'))
     sifts_dfrm[select_col] = False
@@ -5,6 +5,7 @@
 import pandas as pd
 import numpy as np
 import json
+from ..ranges import IntervalSet
 
 
 class Gadget:
@@ -150,6 +151,13 @@ class Gadget:
         else:
             return resolution
 
+    @staticmethod
+    def rankOrder(dfrm, rank_list):
+        '''
+        Index of the rows of `dfrm` ranked best first, the larger value of each column in `rank_list` is the better
+        '''
+        return dfrm.sort_values(by=rank_list, ascending=False).index
+
     @staticmethod
     def selectChain(grouped_df, df, rank_list, rankName, rankFormat, rangeName, selectName, r1_cutoff=0.3, r2_cutoff=0.2):
         '''
@@ -164,10 +172,7 @@ class Gadget:
         '''
         
         def getRange(li):
-            rangeSet = set()
-            for ran in li:
-                rangeSet = rangeSet | set(range(ran[0], ran[1] + 1))
-            return rangeSet
+            return IntervalSet.from_ranges(li)
         
         # overlap_list = []
         if len(grouped_df) > 1:
@@ -176,8 +181,7 @@ class Gadget:
             if rankName:
                 df.loc[rank_df.index, rankName] = rank_df.apply(
                     lambda x: rankFormat % tuple(x[ele] for ele in rank_list), axis=1)
-            index_list = grouped_df.sort_values(
-                by=rank_list, ascending=False).index
+            index_list = Gadget.rankOrder(grouped_df, rank_list)
             # FIRST
             repreSet = getRange(json.loads(
                 grouped_df.loc[index_list[0], rangeName]))
@@ -206,41 +210,7 @@ class Gadget:
         if rangeSet == '' or rangeSet == set() or rangeSet == [] or isinstance(rangeSet, float):
             return np.nan
         else:
-            start = []
-            interval_list = []
-            true_interval_list = []
-            maxRange = max(rangeSet)
-            minRange = min(rangeSet)
-            if len(rangeSet) == (maxRange + 1 - minRange):
-                true_interval_list.append([minRange, maxRange])
-            else:
-                rangeSet_list = list(rangeSet)
-                rangeSet_list.sort()
-                for j in rangeSet_list:
-                    if not start:
-                        i = j
-                        start.append(j)
-                        i += 1
-                    else:
-                        if (i != j) or (j == max(rangeSet_list)):
-                            if j == max(rangeSet_list):
-                                if (i != j):
-                                    interval_list.append(start)
-                                    interval_list.append([j])
-                                    break
-                                else:
-                                    start.append(j)
-                            interval_list.append(start)
-                            start = [j]
-                            i = j + 1
-                        else:
-                            start.append(j)
-                            i += 1
-                for li in interval_list:
-                    maxRange = max(li)
-                    minRange = min(li)
-                    true_interval_list.append([minRange, maxRange])
-            return true_interval_list
+            return IntervalSet.from_points(rangeSet).to_list()
 
     def set_lists(self, pdb_list, unp_list):
         self.unp_list = unp_list
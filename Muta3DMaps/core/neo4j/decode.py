@@ -17,6 +17,7 @@ from functools import lru_cache
 from textdistance import jaccard, overlap
 from Bio import Align
 from Bio.SubsMat import MatrixInfo as matlist
+from Muta3DMaps.core.ranges import IntervalSet, RaggedRanges, classify_segments, ragged_difference, ragged_intersection, ragged_lengths
 
 SEQ_DICT = {
     "GLY": "G", "ALA": "A", "SER": "S", "THR": "T", "CYS": "C", "VAL": "V", "LEU": "L",
@@ -41,52 +42,13 @@ def to_interval(lyst: Union[Iterable, Iterator]) -> Union[float, List]:
             else:
                 return True
     if not pass_check(lyst): return nan
-    else:
-        lyst = set(int(i) for i in lyst)
-        if not pass_check(lyst): return nan
-        start = []
-        interval_lyst = []
-        true_interval_lyst = []
-        max_edge = max(lyst)
-        min_edge = min(lyst)
-        if len(lyst) == (max_edge + 1 - min_edge):
-            true_interval_lyst.append((min_edge, max_edge))
-        else:
-            lyst_list = sorted(lyst)
-            for j in lyst_list:
-                if not start:
-                    i = j
-                    start.append(j)
-                    i += 1
-                else:
-                    if (i != j) or (j == max(lyst_list)):
-                        if j == max(lyst_list):
-                            if (i != j):
-                                interval_lyst.append(start)
-                                interval_lyst.append([j])
-                                break
-                            else:
-                                start.append(j)
-                        interval_lyst.append(start)
-                        start = [j]
-                        i = j + 1
-                    else:
-                        start.append(j)
-                        i += 1
-            for li in interval_lyst:
-                max_edge = max(li)
-                min_edge = min(li)
-                true_interval_lyst.append((min_edge, max_edge))
-        return true_interval_lyst
+    res = IntervalSet.from_points(lyst)
+    if not res: return nan
+    return res.to_tuples()
 
 
 def interval2set(lyst: Union[Iterable, Iterator, str]):
-    if isinstance(lyst, str):
-        lyst = json.loads(lyst)
-    range_set = set()
-    for left, right in lyst:
-        range_set = range_set | set(range(left, right+1))
-    return range_set
+    return set(IntervalSet.from_ranges(lyst))
 
 
 def lyst2range(lyst, add_end=1):
@@ -97,25 +59,22 @@ def lyst2range(lyst, add_end=1):
 def subtract_range(pdb_range: Union[str, Iterable], mis_range: Union[str, Iterable]) -> List:
     if isinstance(mis_range, float):
         return pdb_range
-    pdb_range_set = interval2set(pdb_range)
-    mis_range_set = interval2set(mis_range)
-    return to_interval(pdb_range_set - mis_range_set)
+    res = IntervalSet.from_ranges(pdb_range) - IntervalSet.from_ranges(mis_range)
+    return res.to_tuples() if res else nan
 
 
 def add_range(left: Union[str, Iterable], right: Union[str, Iterable]) -> List:
     if isinstance(right, float):
         return left
-    left_range_set = interval2set(left)
-    right_range_set = interval2set(right)
-    return to_interval(left_range_set | right_range_set)
+    res = IntervalSet.from_ranges(left) | IntervalSet.from_ranges(right)
+    return res.to_tuples() if res else nan
 
 
 def overlap_range(obs_range:Union[str, Iterable], unk_range: Union[str, Iterable]) -> List:
     if isinstance(unk_range, float):
         return nan
-    obs_range_set = interval2set(obs_range)
-    unk_range_set = interval2set(unk_range)
-    return to_interval(obs_range_set & unk_range_set)
+    res = IntervalSet.from_ranges(obs_range) & IntervalSet.from_ranges(unk_range)
+    return res.to_tuples() if res else nan
 
 
 def outside_range_len(pdb_range: str, seqres_len: int, omit: int = 5) -> int:
@@ -299,28 +258,37 @@ class Entry(object):
 
     @staticmethod
     def deal_seq_index(dfrm: pd.DataFrame) -> pd.DataFrame:
-        def index2range(lyst):
-            res = to_interval(int(i[0]) for i in lyst)
-            if isinstance(res, List):
-                return json.dumps(res)
-            else:
-                return res
-        
-        def get_obs_rel_count(seqres_count, mis_range, unk_range, non_range):
-            seq_range = [(1, seqres_count)]
-            obs_range = subtract_range(seq_range, mis_range)
-            obs_unk_range = overlap_range(obs_range, unk_range)
-            obs_pure_range = subtract_range(obs_range, non_range)
-            return range_len(obs_unk_range), range_len(obs_pure_range)
-
-        dfrm['UNK_COUNT'] = dfrm.UNK_INDEX.apply(len)
-        dfrm['PURE_SEQRES_COUNT'] = dfrm.SEQRES_COUNT - dfrm.NON_INDEX.apply(len)
-        dfrm['OBS_RECORD_COUNT'] = dfrm.SEQRES_COUNT - dfrm.MIS_INDEX.apply(len)
-        dfrm.NON_INDEX = dfrm.NON_INDEX.apply(index2range)
-        dfrm.UNK_INDEX = dfrm.UNK_INDEX.apply(index2range)
-        dfrm.MIS_INDEX = dfrm.MIS_INDEX.apply(index2range)
-        dfrm[['OBS_UNK_COUNT', 'ATOM_RECORD_COUNT']] = dfrm.apply(lambda x: get_obs_rel_count(
-            x['SEQRES_COUNT'], x['MIS_INDEX'], x['UNK_INDEX'], x['NON_INDEX']), axis=1, result_type='expand')
+        '''
+        Summarize the SEQRES/missing/UNK/non-standard residues of all the chains with batch interval kernels
+        '''
+        size = len(dfrm)
+        rows = np.arange(size)
+
+        def index2range(col):
+            counts = dfrm[col].apply(len).to_numpy()
+            points = np.fromiter((int(i[0]) for lyst in dfrm[col] for i in lyst), dtype=np.int64, count=counts.sum())
+            return counts, RaggedRanges.from_points(np.repeat(rows, counts), points, size)
+
+        def to_json(ranges):
+            return np.where(ranges.counts > 0, np.asarray(ranges.to_json(), dtype=object), nan)
+
+        non_count, non_range = index2range('NON_INDEX')
+        unk_count, unk_range = index2range('UNK_INDEX')
+        mis_count, mis_range = index2range('MIS_INDEX')
+        seqres_count = dfrm.SEQRES_COUNT.to_numpy(np.int64)
+        has_seq = seqres_count > 0
+        seq_range = RaggedRanges(
+            np.concatenate(([0], np.cumsum(has_seq))), np.ones(has_seq.sum(), dtype=np.int64), seqres_count[has_seq])
+        obs_range = ragged_difference(seq_range, mis_range)
+
+        dfrm['UNK_COUNT'] = unk_count
+        dfrm['PURE_SEQRES_COUNT'] = seqres_count - non_count
+        dfrm['OBS_RECORD_COUNT'] = seqres_count - mis_count
+        dfrm.NON_INDEX = to_json(non_range)
+        dfrm.UNK_INDEX = to_json(unk_range)
+        dfrm.MIS_INDEX = to_json(mis_range)
+        dfrm['OBS_UNK_COUNT'] = ragged_lengths(ragged_intersection(obs_range, unk_range))
+        dfrm['ATOM_RECORD_COUNT'] = ragged_lengths(ragged_difference(obs_range, non_range))
         return dfrm
 
     @classmethod
@@ -574,58 +542,24 @@ class SIFTS(Entry):
 
     @classmethod
     def deal_InDe(cls, dfrm: pd.DataFrame) -> pd.DataFrame:
-        def get_gap_list(li: List):
-            return [li[i+1][0] - li[i][1] - 1 for i in range(len(li)-1)]
-
-        def get_range_diff(lyst_a: List, lyst_b: List):
-            array_a = np.array([right - left + 1 for left, right in lyst_a])
-            array_b = np.array([right - left + 1 for left, right in lyst_b])
-            return (array_a - array_b).tolist()
-
-        def add_tage_to_range(df: pd.DataFrame, tage_name: str):
-            # ADD TAGE FOR SIFTS
-            df[tage_name] = 'Safe'
-            # No Insertion But Deletion[Pure Deletion]
-            df.loc[df[(df['group_info'] == 1) & (
-            df['unp_pdb_var'] > 0)].index, tage_name] = 'Deletion'
-            # Insertion & No Deletion
-            df.loc[df[
-                (df['group_info'] != 1) &
-                (df['var_0_count'] == df['group_info']) &
-                (df['unp_gap_0_count'] == (df['group_info'] - 1))].index, tage_name] = 'Insertion'
-            # Insertion & Deletion
-            df.loc[df[
-                (df['group_info'] != 1) &
-                ((df['var_0_count'] != df['group_info']) |
-                (df['unp_gap_0_count'] != (df['group_info'] - 1)))].index, tage_name] = 'Insertion & Deletion'
-
-        dfrm['group_info'] = dfrm.apply(lambda x: len(
-            x['pdb_range']), axis=1)
-        
-        focus_index = dfrm[dfrm.group_info.gt(1)].index
-        if len(focus_index) > 0: 
-            focus_df = dfrm.loc[focus_index].apply(lambda x: cls.sort_2_range(x['unp_range'], x['pdb_range']), axis=1, result_type='expand')
-            focus_df.index = focus_index
-            focus_df.columns = ['unp_range', 'pdb_range']
-            dfrm.loc[focus_index, ['unp_range', 'pdb_range']] = focus_df
-        
-        dfrm['pdb_gap_list'] = dfrm.apply(lambda x: json.dumps(
-            get_gap_list(x['pdb_range'])), axis=1)
-        dfrm['unp_gap_list'] = dfrm.apply(lambda x: json.dumps(
-            get_gap_list(x['unp_range'])), axis=1)
-        dfrm['var_list'] = dfrm.apply(lambda x: json.dumps(get_range_diff(
-            x['unp_range'], x['pdb_range'])), axis=1)
-        dfrm['repeated'] = dfrm.apply(
-            lambda x: '-' in x['var_list'], axis=1)
-        dfrm['repeated'] = dfrm.apply(
-            lambda x: True if '-' in x['unp_gap_list'] else x['repeated'], axis=1)
-        dfrm['var_0_count'] = dfrm.apply(
-            lambda x: json.loads(x['var_list']).count(0), axis=1)
-        dfrm['unp_gap_0_count'] = dfrm.apply(
-            lambda x: json.loads(x['unp_gap_list']).count(0), axis=1)
-        dfrm['unp_pdb_var'] = dfrm.apply(
-            lambda x: json.loads(x['var_list'])[0], axis=1)
-        add_tage_to_range(dfrm, tage_name='sifts_range_tag')
+        unp_ranges = RaggedRanges.from_lists(dfrm['unp_range'])
+        pdb_ranges = RaggedRanges.from_lists(dfrm['pdb_range'])
+        # sort the segments of the rows with several segments by unp start (as `sort_2_range`), other rows are kept as they are
+        order = np.lexsort((unp_ranges.starts, unp_ranges.rows))
+        unp_ranges, pdb_ranges = unp_ranges.reorder(order), pdb_ranges.reorder(order)
+        focus = unp_ranges.counts > 1
+        if focus.any():
+            index = np.flatnonzero(focus)
+            for col, ranges in (('unp_range', unp_ranges), ('pdb_range', pdb_ranges)):
+                values = dfrm[col].to_numpy(dtype=object, copy=True)
+                for row, value in zip(index.tolist(), ranges.take(index).to_lists()):
+                    values[row] = tuple(value)
+                dfrm[col] = pd.Series(values, index=dfrm.index, dtype=object)
+        res = classify_segments(pdb_ranges, unp_ranges, index=dfrm.index)
+        res.rename(columns={'delete': 'repeated', 'range_tag': 'sifts_range_tag'}, inplace=True)
+        for col in ('group_info', 'pdb_gap_list', 'unp_gap_list', 'var_list', 'repeated',
+                    'var_0_count', 'unp_gap_0_count', 'unp_pdb_var', 'sifts_range_tag'):
+            dfrm[col] = res[col]
         return dfrm
 
     @classmethod
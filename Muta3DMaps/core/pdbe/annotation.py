@@ -0,0 +1,132 @@
+# @Created Date: 2020-04-16 03:12:40 pm
+# @Filename: annotation.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-16 03:12:44 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import json
+import numpy as np
+import pandas as pd
+from typing import Union, Optional, Iterable, List
+
+
+def chain_keys(pdb_ids: Iterable, entity_ids: Iterable, chain_ids: Iterable) -> np.ndarray:
+    return (pd.Series(pdb_ids, dtype=str).reset_index(drop=True) + '\t'
+            + pd.Series(entity_ids).astype(int).astype(str).reset_index(drop=True) + '\t'
+            + pd.Series(chain_ids, dtype=str).reset_index(drop=True)).to_numpy(str)
+
+
+def residue_number(residue: Union[str, dict]) -> int:
+    '''
+    `residue_number` of a residue record, either decoded or serialized by the traversal of the decoder
+    '''
+    return (json.loads(residue) if isinstance(residue, str) else residue)['residue_number']
+
+
+class AnnotationIndex(object):
+    '''
+    Sorted interval arrays of residue-level annotations (in `residue_number`) for each chain
+
+    * the intervals are sorted by (chain, start), so that the candidates of a point are
+      the intervals of the chain with `point - max_length[chain] <= start <= point`
+    * `table` holds the labels of the intervals: `annotation`, `name`, `start`, `end`
+      and the (pdb_id, entity_id, chain_id) of the chain
+
+    Build from the decoded outputs of `secondary_structure`, `binding_sites` and `modified_AA_or_NA`
+    '''
+
+    def __init__(self, keys: Iterable, table: pd.DataFrame):
+        self.keys, codes = np.unique(np.asarray(keys, dtype=str), return_inverse=True)
+        codes = codes.ravel()
+        order = np.lexsort((table.start.to_numpy(), codes))
+        self.table = table.iloc[order].reset_index(drop=True)
+        self.codes = codes[order].astype(np.int64)
+        self.starts = self.table.start.to_numpy(np.int64)
+        self.ends = self.table.end.to_numpy(np.int64)
+        self.max_length = np.zeros(len(self.keys), dtype=np.int64)
+        np.maximum.at(self.max_length, self.codes, self.ends - self.starts)
+        # shift the starts of each chain apart so that one sorted array covers all the chains,
+        # `origin` keeps the negative numbering of a chain inside its own stride
+        self.origin = int(min(self.starts.min(initial=0), 0))
+        self.stride = int(self.ends.max(initial=0) - self.origin + self.max_length.max(initial=0) + 2)
+        self.coordinates = self.codes*self.stride + self.starts - self.origin
+
+    def __len__(self):
+        return len(self.table)
+
+    def __repr__(self):
+        return f'AnnotationIndex<chains:{len(self.keys)}, intervals:{len(self)}>'
+
+    @staticmethod
+    def from_secondary_structure(dfrm: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Helices and strands, with `start`/`end` taken from the `residue_number` of the residue records
+        '''
+        return pd.DataFrame({
+            'pdb_id': dfrm.pdb_id, 'entity_id': dfrm.entity_id, 'chain_id': dfrm.chain_id,
+            'annotation': 'secondary_structure', 'name': dfrm.secondary_structure,
+            'start': dfrm.start.map(residue_number), 'end': dfrm.end.map(residue_number)})
+
+    @staticmethod
+    def from_binding_sites(dfrm: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Site residues of the binding sites, named by `site_id`
+        '''
+        dfrm = dfrm[dfrm.residues_type.eq('site_residues')]
+        return pd.DataFrame({
+            'pdb_id': dfrm.pdb_id, 'entity_id': dfrm.entity_id, 'chain_id': dfrm.chain_id,
+            'annotation': 'binding_site', 'name': dfrm.site_id,
+            'start': dfrm.residue_number, 'end': dfrm.residue_number})
+
+    @staticmethod
+    def from_modified_residues(dfrm: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Modified residues, named by `chem_comp_id`
+        '''
+        return pd.DataFrame({
+            'pdb_id': dfrm.pdb_id, 'entity_id': dfrm.entity_id, 'chain_id': dfrm.chain_id,
+            'annotation': 'modified_residue', 'name': dfrm.chem_comp_id,
+            'start': dfrm.residue_number, 'end': dfrm.residue_number})
+
+    @classmethod
+    def build(cls, secondary_structure: Optional[pd.DataFrame] = None, binding_sites: Optional[pd.DataFrame] = None, modified_AA_or_NA: Optional[pd.DataFrame] = None):
+        '''
+        Build the index from the decoded tables of the endpoints (any of them could be `None`)
+        '''
+        tables = [func(dfrm) for func, dfrm in (
+            (cls.from_secondary_structure, secondary_structure),
+            (cls.from_binding_sites, binding_sites),
+            (cls.from_modified_residues, modified_AA_or_NA)) if dfrm is not None]
+        if not tables:
+            raise ValueError('At least one of the tables should be given')
+        table = pd.concat(tables, sort=False, ignore_index=True)
+        table['start'] = table.start.astype(np.int64)
+        table['end'] = table.end.astype(np.int64)
+        return cls(chain_keys(table.pdb_id, table.entity_id, table.chain_id), table)
+
+    def query(self, pdb_ids: Iterable, entity_ids: Iterable, chain_ids: Iterable, residue_numbers: Iterable) -> pd.DataFrame:
+        '''
+        Annotate a batch of points in one vectorized call
+
+        Return the (`query`, interval) pairs where `query` is the position of the point in the inputs
+        and the interval of the chain covers the point, followed by the columns of `table`
+        '''
+        points = np.asarray(residue_numbers, dtype=np.int64)
+        keys = chain_keys(pdb_ids, entity_ids, chain_ids)
+        codes = np.searchsorted(self.keys, keys)
+        codes[codes == len(self.keys)] = 0
+        found = self.keys[codes] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        shifted = points - self.origin
+        found &= (shifted >= 0) & (shifted < self.stride)
+        query = np.flatnonzero(found)
+        codes, points, shifted = codes[query], points[query], shifted[query]
+        base = codes*self.stride
+        lo = np.searchsorted(self.coordinates, base + np.maximum(shifted - self.max_length[codes], 0), 'left')
+        hi = np.searchsorted(self.coordinates, base + shifted, 'right')
+        counts = hi - lo
+        query = np.repeat(query, counts)
+        candidates = np.arange(counts.sum()) + np.repeat(lo - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        covered = self.ends[candidates] >= np.repeat(points, counts)
+        res = self.table.iloc[candidates[covered]].reset_index(drop=True)
+        res.insert(0, 'query', query[covered])
+        return res
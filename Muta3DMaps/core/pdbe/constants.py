@@ -0,0 +1,30 @@
+# @Created Date: 2020-04-20 11:32:08 am
+# @Filename: constants.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-20 11:32:12 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+from typing import List, Dict, Tuple
+
+# columns of the reformatted SIFTS table
+RAW_SIFTS_COLUMNS: List = [
+    'pdb_id', 'chain_id', 'UniProt', 'identity', 'identifier', 'pdb_start',
+    'pdb_end', 'unp_start', 'unp_end', 'is_canonical', 'start', 'end',
+    'entity_id', 'struct_asym_id'
+]
+
+# headers of the SIFTS segment flatfiles and their columns in the reformatted SIFTS table
+SEG_SIFTS_MAP: Dict = {
+      "SP_PRIMARY": "UniProt",  # (Canonical)
+      "RES_BEG": "pdb_start",
+      "RES_END": "pdb_end",
+      "PDB_BEG": "residue index(start) in pdb",
+      "PDB_END": "residue index(end) in pdb",
+      "SP_BEG": "unp_start",
+      "SP_END": "unp_end",
+      "PDB": 'pdb_id',
+      "CHAIN": 'chain_id',
+}
+
+# columns of the segment flatfiles read by `ProcessSIFTS.yieldFlatfile`
+SEG_SIFTS_COLUMNS: Tuple = ('pdb_id', 'chain_id', 'UniProt', 'pdb_start', 'pdb_end', 'unp_start', 'unp_end')
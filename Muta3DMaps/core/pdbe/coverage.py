@@ -0,0 +1,164 @@
+# @Created Date: 2020-04-17 10:08:51 am
+# @Filename: coverage.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-17 10:08:55 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Union, Optional, Iterable, List, Tuple
+from Muta3DMaps.core.ranges import RaggedRanges
+
+# count of the set bits of each byte value
+POPCOUNT: np.ndarray = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def fill_bits(bases: np.ndarray, rows: np.ndarray, ranges: RaggedRanges, nbytes: int, chunk: int = 4096) -> np.ndarray:
+    '''
+    Packed bitmap of `nbytes` bytes with the residues `[start, end]` of each segment set at bit `bases[row] + residue - 1`
+
+    * the bit runs are set in place on the uint8 buffer, `chunk` segments at a time, so no temporary scales with
+      the total bit count: the partial first/last bytes of a run are OR-ed with masks, the bytes in between set to 0xFF
+    '''
+    res = np.zeros(nbytes, dtype=np.uint8)
+    first = bases[rows] + ranges.starts - 1
+    last = bases[rows] + ranges.ends - 1
+    for lo in range(0, len(first), chunk):
+        head, tail = first[lo:lo+chunk], last[lo:lo+chunk]
+        head_byte, tail_byte = head // 8, tail // 8
+        head_mask = (0xFF >> (head % 8)).astype(np.uint8)
+        tail_mask = ((0xFF << (7 - tail % 8)) & 0xFF).astype(np.uint8)
+        same = head_byte == tail_byte
+        np.bitwise_or.at(res, head_byte[same], head_mask[same] & tail_mask[same])
+        np.bitwise_or.at(res, head_byte[~same], head_mask[~same])
+        np.bitwise_or.at(res, tail_byte[~same], tail_mask[~same])
+        counts = np.maximum(tail_byte - head_byte - 1, 0)
+        if counts.any():
+            starts = np.repeat(head_byte + 1 - np.cumsum(counts) + counts, counts)
+            res[starts + np.arange(counts.sum())] = 0xFF
+    return res
+
+
+class CoverageIndex(object):
+    '''
+    Residue-coverage bitmaps of the UniProt accessions and of their mapped chains
+
+    * bit `i` of a bitmap stands for residue `i+1` of the UniProt sequence
+    * the bitmaps are bit-packed with `np.packbits` (one bit per residue), not compressed: every bitmap of an
+      accession takes `ceil(length/8)` bytes whatever the coverage is
+    * the bitmaps are concatenated in flat uint8 buffers indexed by byte offsets
+      (`unp_offsets` for the accessions, `chain_offsets` for the chains)
+    * `covered` comes from the SIFTS ranges, `observed` from the observed ranges (in UniProt numbering) if given
+    '''
+
+    arrays: Tuple = (
+        'unp_ids', 'unp_length', 'unp_offsets', 'chain_unp', 'chain_offsets',
+        'covered', 'observed', 'chain_covered', 'chain_observed')
+
+    def __init__(self, chains: pd.DataFrame, **arrays):
+        self.chains = chains
+        for name in self.arrays:
+            setattr(self, name, arrays[name])
+
+    def __repr__(self):
+        return f'CoverageIndex<unp:{len(self.unp_ids)}, chains:{len(self.chains)}>'
+
+    @classmethod
+    def build(cls, dfrm: pd.DataFrame, range_col: str = 'sifts_unp_range', observed_col: Optional[str] = None, unp_col: str = 'UniProt', chain_cols: Iterable = ('pdb_id', 'chain_id')):
+        '''
+        Build from a SIFTS table with ranges in UniProt numbering, as JSON strings or `ranges` columns
+        '''
+        chain_cols = list(chain_cols)
+        dfrm = dfrm.sort_values(unp_col, kind='stable').reset_index(drop=True)
+        covered = dfrm[range_col].ranges.data
+        observed = covered if observed_col is None else dfrm[observed_col].ranges.data
+        unp_ids, chain_unp = np.unique(dfrm[unp_col].to_numpy(str), return_inverse=True)
+        chain_unp = chain_unp.ravel()
+        unp_length = np.zeros(len(unp_ids), dtype=np.int64)
+        for ranges in (covered, observed):
+            np.maximum.at(unp_length, chain_unp[ranges.rows], ranges.ends)
+        unp_bytes = (unp_length + 7) // 8
+        unp_offsets = np.concatenate(([0], np.cumsum(unp_bytes)))
+        chain_offsets = np.concatenate(([0], np.cumsum(unp_bytes[chain_unp])))
+        data = {
+            'unp_ids': unp_ids, 'unp_length': unp_length, 'unp_offsets': unp_offsets,
+            'chain_unp': chain_unp, 'chain_offsets': chain_offsets}
+        for name, ranges in (('covered', covered), ('observed', observed)):
+            data[name] = fill_bits(unp_offsets*8, chain_unp[ranges.rows], ranges, unp_offsets[-1])
+            data[f'chain_{name}'] = fill_bits(chain_offsets*8, ranges.rows, ranges, chain_offsets[-1])
+        return cls(dfrm[chain_cols + [unp_col]], **data)
+
+    def save(self, folder: Union[str, Path]):
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        for name in self.arrays:
+            np.save(folder/f'{name}.npy', getattr(self, name))
+        self.chains.to_csv(folder/'chains.tsv', sep='\t', index=False)
+
+    @classmethod
+    def load(cls, folder: Union[str, Path], mmap_mode: Optional[str] = 'r'):
+        folder = Path(folder)
+        chains = pd.read_csv(folder/'chains.tsv', sep='\t', dtype=str, keep_default_na=False)
+        return cls(chains, **dict((name, np.load(folder/f'{name}.npy', mmap_mode=mmap_mode)) for name in cls.arrays))
+
+    def unp_index(self, unp: str) -> int:
+        index = np.searchsorted(self.unp_ids, unp)
+        if index < len(self.unp_ids) and self.unp_ids[index] == unp:
+            return int(index)
+        raise KeyError(unp)
+
+    def unp_bitmap(self, unp: str, kind: str = 'covered') -> np.ndarray:
+        index = self.unp_index(unp)
+        return getattr(self, kind)[self.unp_offsets[index]:self.unp_offsets[index+1]]
+
+    def chain_bitmaps(self, indices: Iterable, kind: str = 'covered') -> np.ndarray:
+        '''
+        Bitmaps of the chains (rows of `chains`) as a 2-D array, the chains should belong to the same accession
+        '''
+        indices = np.asarray(list(indices), dtype=np.int64)
+        if not len(indices):
+            raise ValueError('No chain is given')
+        if len(np.unique(self.chain_unp[indices])) > 1:
+            raise ValueError('The chains should belong to the same UniProt accession')
+        buffer = getattr(self, f'chain_{kind}')
+        return np.stack([buffer[self.chain_offsets[i]:self.chain_offsets[i+1]] for i in indices])
+
+    def union(self, indices: Iterable, kind: str = 'covered') -> np.ndarray:
+        return np.bitwise_or.reduce(self.chain_bitmaps(indices, kind), axis=0)
+
+    def intersection(self, indices: Iterable, kind: str = 'covered') -> np.ndarray:
+        return np.bitwise_and.reduce(self.chain_bitmaps(indices, kind), axis=0)
+
+    @staticmethod
+    def to_ranges(bitmap: np.ndarray) -> List:
+        '''
+        Residue ranges `[[start, end], ...]` of a bitmap
+        '''
+        bits = np.concatenate(([0], np.unpackbits(bitmap), [0])).astype(np.int8)
+        edges = np.flatnonzero(np.diff(bits))
+        return (edges.reshape(-1, 2) + [1, 0]).tolist()
+
+    def contains(self, unps: Iterable, positions: Iterable, kind: str = 'covered') -> np.ndarray:
+        '''
+        Whether each (UniProt accession, residue) is covered/observed, unknown accessions are treated as not covered
+        '''
+        unps = np.asarray(list(unps), dtype=str)
+        positions = np.asarray(list(positions), dtype=np.int64)
+        index = np.searchsorted(self.unp_ids, unps)
+        index[index == len(self.unp_ids)] = 0
+        valid = (self.unp_ids[index] == unps) & (positions >= 1) & (positions <= self.unp_length[index])
+        bits = np.where(valid, positions - 1, 0)
+        byte = getattr(self, kind)[np.where(valid, self.unp_offsets[index] + bits // 8, 0)]
+        return valid & (((byte >> (7 - bits % 8)) & 1) == 1)
+
+    def report(self) -> pd.DataFrame:
+        '''
+        Length, covered/observed residue count and chain count of each accession
+        '''
+        res = pd.DataFrame({'UniProt': self.unp_ids, 'length': self.unp_length})
+        for kind in ('covered', 'observed'):
+            counts = POPCOUNT[getattr(self, kind)]
+            res[f'{kind}_count'] = np.add.reduceat(counts, self.unp_offsets[:-1], dtype=np.int64) if len(counts) else 0
+        res['chain_count'] = np.bincount(self.chain_unp, minlength=len(self.unp_ids))
+        return res
@@ -5,6 +5,7 @@
 # @Last Modified: 2020-02-11 04:22:22 pm
 # @Copyright (c) 2020 MinghuiGroup, Soochow University
 import os
+import asyncio
 import numpy as np
 import pandas as pd
 import pyexcel as pe
@@ -16,14 +17,17 @@ import ujson as json
 import time
 from pathlib import Path
 from logging import Logger
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, deque
 from unsync import unsync, Unfuture
 from Bio import Align, SeqIO
 from Bio.SubsMat import MatrixInfo as matlist
-from functools import lru_cache
-from Muta3DMaps.core.utils import decompression, related_dataframe
+from functools import lru_cache, partial
+from Muta3DMaps.core.utils import decompression, related_dataframe, read_frames
 from Muta3DMaps.core.log import Abclog
+from Muta3DMaps.core.ranges import RaggedRanges, aggregate_segments, classify_segments
 from Muta3DMaps.core.retrieve.fetchFiles import UnsyncFetch
+from Muta3DMaps.core.pdbe.index import UniProtPDBIndex
+from Muta3DMaps.core.pdbe.constants import SEG_SIFTS_MAP, RAW_SIFTS_COLUMNS, SEG_SIFTS_COLUMNS
 
 API_LYST: List = sorted(['summary', 'molecules', 'experiment', 'ligand_monomers',
                    'modified_AA_or_NA', 'mutated_AA_or_NA', 'status',
@@ -38,6 +42,27 @@ FTP_URL: str = 'ftp://ftp.ebi.ac.uk/'
 
 FTP_DEFAULT_PATH: str = 'pub/databases/msd/sifts/flatfiles/tsv/uniprot_pdb.tsv.gz'
 
+FTP_SEG_PATH: str = 'pub/databases/msd/sifts/flatfiles/tsv/pdb_chain_uniprot.tsv.gz'
+
+# capability of the endpoints: whether it accepts a batch of ids by POST and the initial batch size
+ENDPOINTS: Dict[str, Dict] = dict(
+    [(f'pdb/entry/{api}/', {'post': True, 'chunksize': 100}) for api in (
+        'status', 'summary', 'experiment', 'molecules', 'ligand_monomers',
+        'modified_AA_or_NA', 'mutated_AA_or_NA', 'cofactor', 'drugbank',
+        'related_experiment_data', 'electron_density_statistics', 'files')] +
+    [(f'pdb/entry/{api}/', {'post': True, 'chunksize': 20}) for api in (
+        'secondary_structure', 'binding_sites', 'assembly', 'observed_residues_ratio')] +
+    [(f'pdb/entry/{api}/', {'post': False}) for api in ('residue_listing', 'polymer_coverage')] +
+    [('mappings/all_isoforms/', {'post': False})])
+
+# endpoints with a flat list of records for each entry
+COMMON_API: Set = {
+    'pdb/entry/status/', 'pdb/entry/summary/', 'pdb/entry/modified_AA_or_NA/',
+    'pdb/entry/mutated_AA_or_NA/', 'pdb/entry/cofactor/', 'pdb/entry/molecules/',
+    'pdb/entry/ligand_monomers/', 'pdb/entry/experiment/',
+    'pdb/entry/electron_density_statistics/',
+    'pdb/entry/related_experiment_data/', 'pdb/entry/drugbank/'}
+
 FUNCS = list()
 
 def dispatch_on_set(keys: Set):
@@ -50,6 +75,13 @@ def dispatch_on_set(keys: Set):
     return register
 
 
+def selected(key: str, columns: Optional[Set] = None) -> bool:
+    '''
+    Whether the field would be kept, the traversal functions only serialize the nested values of the selected fields
+    '''
+    return columns is None or key in columns
+
+
 def traversePDBeData(query: Any, *args):
     for func, keySet in FUNCS:
         if query in keySet:
@@ -163,6 +195,39 @@ class SeqPairwiseAlign(object):
         return segments1, segments2
 
 
+class BatchTuner(object):
+    '''
+    Adapt the POST batch size of an endpoint so that
+    the response size and latency of a batch stay within the targets
+
+    * grow at most `grow` times after a fast and small response
+    * shrink in proportion after a slow or large response
+    * after a failure, shrink to half of the failed batch at most,
+      so that the concurrent failures of batches of the same size only halve it once
+    '''
+
+    def __init__(self, size: int = 20, min_size: int = 1, max_size: int = 1000, target_bytes: int = 2**23, target_seconds: float = 20.0, grow: float = 2.0):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.grow = grow
+
+    def __repr__(self):
+        return f'BatchTuner<size:{self.size}>'
+
+    def clip(self, size: float) -> int:
+        return int(min(self.max_size, max(self.min_size, size)))
+
+    def update(self, count: int, nbytes: int, elapsed: float):
+        ratio = min(self.target_bytes/max(nbytes, 1), self.target_seconds/max(elapsed, 1e-3), self.grow)
+        self.size = self.clip(count*ratio)
+
+    def shrink(self, count: int):
+        self.size = self.clip(min(self.size, count//2))
+
+
 class ProcessPDBe(Abclog):
 
     converters = {
@@ -175,7 +240,7 @@ class ProcessPDBe(Abclog):
         'author_insertion_code': str}
 
     @staticmethod
-    def yieldTasks(pdbs: Union[Iterable, Iterator], suffix: str, method: str, folder: str, chunksize: int = 25, task_id: int = 0) -> Generator:
+    def yieldTasks(pdbs: Union[Iterable, Iterator], suffix: str, method: str, folder: str, chunksize: int = 25, task_id: int = 0, lower: bool = True) -> Generator:
         file_prefix = suffix.replace('/', '%')
         method = method.lower()
         if method == 'post':
@@ -185,27 +250,114 @@ class ProcessPDBe(Abclog):
                 yield method, params, os.path.join(folder, f'{file_prefix}+{task_id}+{i}.json')
         elif method == 'get':
             for pdb in pdbs:
-                pdb = pdb.lower()
+                if lower:
+                    pdb = pdb.lower()
                 yield method, {'url': f'{BASE_URL}{suffix}{pdb}'}, os.path.join(folder, f'{file_prefix}+{pdb}.json')
         else:
             raise ValueError(f'Invalid method: {method}, method should either be "get" or "post"')
 
     @classmethod
-    def retrieve(cls, pdbs: Union[Iterable, Iterator], suffix: str, method: str, folder: str, chunksize: int = 20, concur_req: int = 20, rate: float = 1.5, task_id: int = 0, **kwargs):
-        t0 = time.perf_counter()
-        res = UnsyncFetch.multi_tasks(
-            cls.yieldTasks(pdbs, suffix, method, folder, chunksize, task_id), 
-            cls.process, 
+    def fetch(cls, pdbs: Union[Iterable, Iterator], suffix: str, method: str, folder: str, chunksize: int = 20, concur_req: int = 20, rate: float = 1.5, task_id: int = 0, lower: bool = True, columns: Optional[Iterable] = None, semaphore: Optional[asyncio.Semaphore] = None, **kwargs) -> Unfuture:
+        '''
+        Non-blocking version of `retrieve`, return an `Unfuture` of the decoded file paths
+        so that several endpoints can be fetched at the same time
+
+        * `semaphore`: shared by the endpoints fetched at the same time (see `UnsyncFetch.init_semaphore`)
+          to keep their total concurrency within its limit, otherwise `concur_req` is for this endpoint alone
+        '''
+        return UnsyncFetch.multi_tasks(
+            cls.yieldTasks(pdbs, suffix, method, folder, chunksize, task_id, lower), 
+            cls.process if columns is None else partial(cls.process, columns=columns), 
             concur_req=concur_req, 
             rate=rate, 
-            logger=cls.logger).result()
+            logger=cls.logger,
+            semaphore=semaphore)
+
+    @classmethod
+    def retrieve(cls, pdbs: Union[Iterable, Iterator], suffix: str, method: str, folder: str, chunksize: int = 20, concur_req: int = 20, rate: float = 1.5, task_id: int = 0, lower: bool = True, columns: Optional[Iterable] = None, **kwargs):
+        t0 = time.perf_counter()
+        res = cls.fetch(pdbs, suffix, method, folder, chunksize, concur_req, rate, task_id, lower, columns).result()
         elapsed = time.perf_counter() - t0
         cls.logger.info('{} ids downloaded in {:.2f}s'.format(len(res), elapsed))
         return res
+
+    @classmethod
+    @unsync
+    async def adaptive_fetch(cls, pdbs: Iterable, suffix: str, folder: str, concur_req: int = 20, rate: float = 1.5, task_id: int = 0, timeout: float = 60, tuner: Optional[BatchTuner] = None, columns: Optional[Iterable] = None, semaphore: Optional[asyncio.Semaphore] = None) -> List:
+        '''
+        POST `pdbs` in batches sized by `tuner`
+
+        * the batches are posted under `semaphore` (a new one of `concur_req` if not given)
+          and keep it for `rate` seconds after a response, the same as `UnsyncFetch.fetch_file`
+        * the size of the next batch follows the response size and latency of the finished ones
+        * a batch that failed (including the retries) or timed out is split into halves and posted again,
+          a single id that still fails is logged and skipped
+        * a batch without response (404/405, i.e. none of the ids is available) is logged and skipped
+        '''
+        if tuner is None:
+            tuner = BatchTuner(ENDPOINTS.get(suffix, {}).get('chunksize', 20))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(concur_req)
+        UnsyncFetch.init_logger('UnsyncFetch', cls.logger)
+        UnsyncFetch.init_retry()
+        url = f'{BASE_URL}{suffix}'
+        file_prefix = suffix.replace('/', '%')
+        remain, retried, res = deque(pdbs), deque(), []
+        count = 0
+
+        async def worker():
+            nonlocal count
+            while retried or remain:
+                if retried:
+                    batch = retried.popleft()
+                else:
+                    batch = [remain.popleft() for _ in range(min(tuner.size, len(remain)))]
+                path = os.path.join(folder, f'{file_prefix}+{task_id}+{count}.json')
+                count += 1
+                try:
+                    async with semaphore:
+                        t0 = time.perf_counter()
+                        path = await asyncio.wait_for(
+                            UnsyncFetch.http_download('post', {'url': url, 'data': ','.join(batch)}, path), timeout)
+                        elapsed = time.perf_counter() - t0
+                        if path is not None:
+                            await asyncio.sleep(rate)
+                except Exception as e:
+                    tuner.shrink(len(batch))
+                    if len(batch) > 1:
+                        cls.logger.warning(f'Split the batch of {len(batch)} ids for {suffix}: {e!r}')
+                        half = len(batch)//2
+                        retried.extend((batch[:half], batch[half:]))
+                    else:
+                        cls.logger.error(f'Failed to fetch {batch} for {suffix}: {e!r}')
+                    continue
+                if path is None:
+                    cls.logger.warning(f'No response of {len(batch)} ids for {suffix}: {batch}')
+                    continue
+                tuner.update(len(batch), os.path.getsize(path), elapsed)
+                res.append(await cls.process(path, columns))
+
+        await asyncio.gather(*(worker() for _ in range(concur_req)))
+        cls.logger.debug(f'Batch size of {suffix} tuned to {tuner.size}')
+        return res
+
+    @classmethod
+    def fetch_endpoint(cls, pdbs: Iterable, suffix: str, folder: str, concur_req: int = 20, rate: float = 1.5, task_id: int = 0, columns: Optional[Iterable] = None, semaphore: Optional[asyncio.Semaphore] = None, **kwargs) -> Unfuture:
+        '''
+        Fetch an endpoint in the way recorded in `ENDPOINTS`:
+        adaptive POST batches for the batchable endpoints, otherwise GET for each id
+        '''
+        if ENDPOINTS.get(suffix, {}).get('post', False):
+            return cls.adaptive_fetch(pdbs, suffix, folder, concur_req, rate, task_id, columns=columns, semaphore=semaphore, **kwargs)
+        else:
+            return cls.fetch(pdbs, suffix, 'get', folder, concur_req=concur_req, rate=rate, task_id=task_id, columns=columns, semaphore=semaphore)
     
     @classmethod
     @unsync
-    def process(cls, path: Union[str, Path, Unfuture]):
+    def process(cls, path: Union[str, Path, Unfuture], columns: Optional[Iterable] = None):
+        '''
+        Decode the saved json file into a TSV file, only `columns` would be written if it is given
+        '''
         cls.logger.debug('Start to decode')
         if not isinstance(path, (str, Path)):
             path = path.result()
@@ -219,6 +371,7 @@ class ProcessPDBe(Abclog):
         PDBeDecoder.pyexcel_io(
             suffix=suffix,
             data=data,
+            columns=columns,
             filename=new_path,
             delimiter='\t')
         cls.logger.debug(f'Decoded file in {new_path}')
@@ -226,8 +379,11 @@ class ProcessPDBe(Abclog):
 
 
 class ProcessSIFTS(ProcessPDBe):
+
+    suffix: str = 'mappings/all_isoforms/'
+
     @classmethod
-    def related_UNP_PDB(cls, filePath: Union[str, Path], related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None):
+    def uniprot_pdb_index(cls, filePath: Union[str, Path]) -> UniProtPDBIndex:
         '''
         Reference
         
@@ -245,79 +401,142 @@ class ProcessSIFTS(ProcessPDBe):
             filePath = str(filePath)
         else:
             raise ValueError('Invalid value for filePath')
+        return UniProtPDBIndex.from_file(filePath)
 
-        dfrm = pd.read_csv(filePath, sep='\t', header=1)
-        pdb_list = list()
-        if related_unp is not None:
-            dfrm = dfrm[dfrm['SP_PRIMARY'].isin(related_unp)]
-        for i in dfrm.index:
-            pdb_list.extend(dfrm.loc[i, 'PDB'].split(';'))
-        if related_pdb is not None:
-            return set(pdb_list) & set(related_pdb), set(dfrm['SP_PRIMARY'])
-        else:
-            return set(pdb_list), set(dfrm['SP_PRIMARY'])
+    @classmethod
+    def related_UNP_PDB(cls, filePath: Union[str, Path], related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None):
+        return cls.uniprot_pdb_index(filePath).related(related_unp, related_pdb)
+
+    @classmethod
+    def plan(cls, filePath: Union[str, Path], folder: str, related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None, mode: str = 'auto') -> Dict[str, List]:
+        '''
+        Plan the SIFTS requests for the related (UniProt, PDB) pairs
+
+        * `mode`: `auto` (fewest requests), `unp` (UniProt-centric) or `pdb` (PDB-centric),
+          see `UniProtPDBIndex.plan_requests`
+        * ids whose responses have already been saved in `folder` are moved into `cached` as file paths
+        * `saved`: the requests saved against `baseline`, the cheaper single direction (before the cache)
+        '''
+        plan = cls.uniprot_pdb_index(filePath).plan_requests(related_unp, related_pdb, mode)
+        plan['saved'] = plan['baseline'] - len(plan['unp']) - len(plan['pdb'])
+        file_prefix = cls.suffix.replace('/', '%')
+        plan['cached'] = []
+        for key, lower in (('unp', False), ('pdb', True)):
+            todo = []
+            for identifier in plan[key]:
+                path = os.path.join(folder, f'{file_prefix}+{identifier.lower() if lower else identifier}.json')
+                if os.path.exists(path):
+                    plan['cached'].append(path)
+                else:
+                    todo.append(identifier)
+            plan[key] = todo
+        cls.logger.info('Planned {} requests: {} UniProt-centric, {} PDB-centric ({} cached, {} saved)'.format(
+            len(plan['unp']) + len(plan['pdb']), len(plan['unp']), len(plan['pdb']), len(plan['cached']), plan['saved']))
+        return plan
 
     @classmethod
     def reformat(cls, path: str) -> pd.DataFrame:
-        dfrm = pd.read_csv(path, sep='\t', converters=cls.converters)
-        group_info_col = ['pdb_id', 'chain_id', 'UniProt']
-        range_info_col = ['pdb_start', 'pdb_end', 'unp_start', 'unp_end']
-        reader = SeqRangeReader(group_info_col)
-        dfrm[['sifts_pdb_range', 'sifts_unp_range']] = pd.DataFrame(dfrm.apply(
-            lambda x: reader.check(tuple(x[i] for i in group_info_col), tuple(
-                x[i] for i in range_info_col)),
-            axis=1).values.tolist(), index=dfrm.index)
-        dfrm = dfrm.drop(columns=range_info_col).drop_duplicates(
-            subset=group_info_col, keep='last').reset_index(drop=True)
-        dfrm["Entry"] = dfrm["UniProt"].apply(lambda x: x.split('-')[0])
+        dfrm = read_frames([path], dtype=cls.converters)
+        return cls.aggregate(dfrm)
+
+    @classmethod
+    def yieldFlatfile(cls, path: Union[str, Path], chunksize: int = 500000, is_canonical: bool = True) -> Generator:
+        '''
+        Stream a segment-level SIFTS flatfile (e.g. `pdb_chain_uniprot.tsv.gz`) in the columns of `reformat`
+
+        * the rows are read in chunks and the segments of each chunk are aggregated in one pass
+        * the rows of the last PDB entry in a chunk are carried over to the next one
+          so that a (pdb_id, chain_id, UniProt) group is never split across chunks,
+          hence the rows of each PDB entry should be contiguous (as in the EBI flatfiles),
+          otherwise a `ValueError` is raised
+        * the flatfiles only carry `SEG_SIFTS_COLUMNS`, the other columns of `RAW_SIFTS_COLUMNS`
+          (`identity`, `identifier`, `entity_id`, `struct_asym_id`, `start`, `end`) are filled with NaN
+          and `is_canonical` with the value given
+        '''
+        usecols = [col for col, new_col in SEG_SIFTS_MAP.items() if new_col in SEG_SIFTS_COLUMNS]
+        reader = pd.read_csv(
+            path, sep='\t', header=1, usecols=usecols, chunksize=chunksize,
+            dtype=dict((col, str if SEG_SIFTS_MAP[col] in ('pdb_id', 'chain_id', 'UniProt') else np.int64) for col in usecols),
+            keep_default_na=False)
+        rest, seen = None, set()
+
+        def reindex(dfrm: pd.DataFrame) -> pd.DataFrame:
+            pdbs = set(dfrm.pdb_id.unique())
+            if not seen.isdisjoint(pdbs):
+                raise ValueError(f'The rows of each PDB entry in {path} should be contiguous: {sorted(seen & pdbs)[:5]}')
+            seen.update(pdbs)
+            dfrm = dfrm.reindex(columns=RAW_SIFTS_COLUMNS)
+            dfrm['is_canonical'] = is_canonical
+            return cls.aggregate(dfrm)
+
+        for chunk in reader:
+            chunk = chunk.rename(columns=SEG_SIFTS_MAP)[list(SEG_SIFTS_COLUMNS)]
+            if rest is not None:
+                chunk = pd.concat((rest, chunk), ignore_index=True)
+            carry = chunk.pdb_id.eq(chunk.pdb_id.iloc[-1]).to_numpy()
+            rest = chunk[carry]
+            if not carry.all():
+                yield reindex(chunk[~carry])
+        if rest is not None and len(rest):
+            yield reindex(rest)
+
+    @staticmethod
+    def aggregate(dfrm: pd.DataFrame) -> pd.DataFrame:
+        dfrm = aggregate_segments(
+            dfrm,
+            ['pdb_id', 'chain_id', 'UniProt'],
+            {'sifts_pdb_range': ('pdb_start', 'pdb_end'), 'sifts_unp_range': ('unp_start', 'unp_end')})
+        dfrm["Entry"] = dfrm["UniProt"].str.split('-').str[0]
         return dfrm
 
+    @classmethod
+    def from_flatfile(cls, filePath: Union[str, Path], isoformPath: Union[str, Path, None] = None, outputPath: Union[str, Path, None] = None, chunksize: int = 500000, InDe: bool = True) -> Optional[pd.DataFrame]:
+        '''
+        Offline alternative of `main`: build the SIFTS table from the bulk segment flatfiles
+
+        * `filePath`: the canonical segment flatfile, or a folder to download `pdb_chain_uniprot.tsv.gz` into
+        * `isoformPath`: optional segment flatfile of the UniProt isoforms with the same columns,
+          its rows are tagged with `is_canonical` False
+        * the columns are those of `reformat`, but the ones absent from the flatfiles are NaN, see `yieldFlatfile`
+        * `InDe`: also tag the insertions and deletions with `dealWithInDe`
+        * if `outputPath` is given, the chunks are appended to it as TSV and `None` is returned
+        '''
+        filePath = Path(filePath)
+        if filePath.is_dir():
+            task = ('ftp', {'url': FTP_URL+FTP_SEG_PATH}, str(filePath))
+            filePath = UnsyncFetch.multi_tasks([task]).result()[0]
+        elif not filePath.is_file():
+            raise ValueError('Invalid value for filePath')
+        t0 = time.perf_counter()
+        res = []
+        header = True
+        for path, is_canonical in ((filePath, True), (isoformPath, False)):
+            if path is None:
+                continue
+            for dfrm in cls.yieldFlatfile(path, chunksize, is_canonical):
+                if InDe:
+                    dfrm = cls.dealWithInDe(dfrm)
+                if outputPath is None:
+                    res.append(dfrm)
+                else:
+                    dfrm.to_csv(outputPath, sep='\t', index=False, header=header, mode='w' if header else 'a')
+                    header = False
+        cls.logger.info(f'Ingested SIFTS flatfiles in {time.perf_counter() - t0:.2f} s')
+        if outputPath is None and res:
+            return pd.concat(res, sort=False, ignore_index=True)
+
     @staticmethod
     def dealWithInDe(dfrm: pd.DataFrame) -> pd.DataFrame:
-        def get_gap_list(li: List):
-            return [li[i+1][0] - li[i][1] - 1 for i in range(len(li)-1)]
-
-        def get_range_diff(lyst_a: List, lyst_b: List):
-            array_a = np.array([ran[1] - ran[0] + 1 for ran in lyst_a])
-            array_b = np.array([ran[1] - ran[0] + 1 for ran in lyst_b])
-            return (array_a - array_b).tolist()
-
-        def add_tage_to_range(df: pd.DataFrame, tage_name: str):
-            # ADD TAGE FOR SIFTS
-            df[tage_name] = 'Safe'
-            # No Insertion But Deletion[Pure Deletion]
-            df.loc[df[(df['group_info'] == 1) & (
-                df['sifts_unp_pdb_var'] > 0)].index, tage_name] = 'Deletion'
-            # Insertion & No Deletion
-            df.loc[df[
-                (df['group_info'] != 1) &
-                (df['var_0_count'] == df['group_info']) &
-                (df['unp_GAP_0_count'] == (df['group_info'] - 1))].index, tage_name] = 'Insertion'
-            # Insertion & Deletion
-            df.loc[df[
-                (df['group_info'] != 1) &
-                ((df['var_0_count'] != df['group_info']) |
-                 (df['unp_GAP_0_count'] != (df['group_info'] - 1)))].index, tage_name] = 'Insertion & Deletion'
-
-        dfrm['pdb_GAP_list'] = dfrm.apply(lambda x: json.dumps(
-            get_gap_list(json.loads(x['sifts_pdb_range']))), axis=1)
-        dfrm['unp_GAP_list'] = dfrm.apply(lambda x: json.dumps(
-            get_gap_list(json.loads(x['sifts_unp_range']))), axis=1)
-        dfrm['var_list'] = dfrm.apply(lambda x: json.dumps(get_range_diff(
-            json.loads(x['sifts_unp_range']), json.loads(x['sifts_pdb_range']))), axis=1)
-        dfrm['delete'] = dfrm.apply(
-            lambda x: '-' in x['var_list'], axis=1)
-        dfrm['delete'] = dfrm.apply(
-            lambda x: True if '-' in x['unp_GAP_list'] else x['delete'], axis=1)
-        dfrm['var_0_count'] = dfrm.apply(
-            lambda x: json.loads(x['var_list']).count(0), axis=1)
-        dfrm['unp_GAP_0_count'] = dfrm.apply(
-            lambda x: json.loads(x['unp_GAP_list']).count(0), axis=1)
-        dfrm['group_info'] = dfrm.apply(lambda x: len(
-            json.loads(x['sifts_pdb_range'])), axis=1)
-        dfrm['sifts_unp_pdb_var'] = dfrm.apply(
-            lambda x: json.loads(x['var_list'])[0], axis=1)
-        add_tage_to_range(dfrm, tage_name='sifts_range_tage')
+        res = classify_segments(
+            RaggedRanges.from_json(dfrm['sifts_pdb_range']),
+            RaggedRanges.from_json(dfrm['sifts_unp_range']),
+            index=dfrm.index)
+        res.rename(columns={
+            'pdb_gap_list': 'pdb_GAP_list', 'unp_gap_list': 'unp_GAP_list',
+            'unp_gap_0_count': 'unp_GAP_0_count', 'unp_pdb_var': 'sifts_unp_pdb_var',
+            'range_tag': 'sifts_range_tage'}, inplace=True)
+        for col in res.columns:
+            dfrm[col] = res[col]
         return dfrm
 
     @staticmethod
@@ -368,14 +587,32 @@ class ProcessSIFTS(ProcessPDBe):
         return dfrm
 
     @classmethod
-    def main(cls, filePath: Union[str, Path], folder: str, related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None):
-        pdbs, _ = cls.related_UNP_PDB(filePath, related_unp, related_pdb)
-        res = cls.retrieve(pdbs, 'mappings/all_isoforms/', 'get', folder)
+    def main(cls, filePath: Union[str, Path], folder: str, related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None, mode: str = 'auto'):
+        plan = cls.plan(filePath, folder, related_unp, related_pdb, mode)
+        res = [task.result() for task in [cls.process(path) for path in plan['cached']]]
+        for key, lower in (('unp', False), ('pdb', True)):
+            if plan[key]:
+                res.extend(cls.retrieve(plan[key], cls.suffix, 'get', folder, lower=lower))
         # return pd.concat((cls.dealWithInDe(cls.reformat(route)) for route in res if route is not None), sort=False, ignore_index=True)
         return res
 
 
 class ProcessEntryData(ProcessPDBe):
+
+    pipeline_tasks: Tuple = (
+        'pdb/entry/molecules/',
+        'pdb/entry/residue_listing/',
+        'pdb/entry/modified_AA_or_NA/')
+
+    pipeline_columns: Dict = {
+        'pdb/entry/molecules/': ('pdb_id', 'entity_id', 'molecule_type'),
+        'pdb/entry/status/': ('pdb_id', 'status_code'),
+        'pdb/entry/summary/': ('pdb_id', 'revision_date')}
+
+    state_columns: Tuple = ('pdb_id', 'status_code', 'revision_date')
+    # status of the entries missing from the status response
+    missing_status: str = 'WDRN'
+
     @staticmethod
     def related_PDB(pdb_col: str, **kwargs) -> pd.Series:
         dfrm = related_dataframe(**kwargs)
@@ -386,10 +623,7 @@ class ProcessEntryData(ProcessPDBe):
         pdbs = cls.related_PDB(**kwargs)
         if len(pdbs) > 0:
             res = cls.retrieve(pdbs, **kwargs)
-            try:
-                return pd.concat((pd.read_csv(route, sep=kwargs.get('sep', '\t'), converters=cls.converters) for route in res if route is not None), sort=False, ignore_index=True)
-            except ValueError:
-                cls.logger.error('Non-value to concat')
+            return cls.concat(res, kwargs.get('sep', '\t'))
         else:
             return None
 
@@ -397,76 +631,154 @@ class ProcessEntryData(ProcessPDBe):
     def unit(cls, pdbs, **kwargs):
         if len(pdbs) > 0:
             res = cls.retrieve(pdbs, **kwargs)
-            try:
-                return pd.concat((pd.read_csv(route, sep=kwargs.get('sep', '\t'), converters=cls.converters) for route in res if route is not None), sort=False, ignore_index=True)
-            except ValueError:
-                cls.logger.warning('Non-value to concat')
+            return cls.concat(res, kwargs.get('sep', '\t'))
         else:
             return None
 
+    @classmethod
+    def concat(cls, res: Iterable, sep: str = '\t', iterator: bool = False) -> Union[pd.DataFrame, Iterator[pd.DataFrame], None]:
+        dfrm = read_frames(res, sep, cls.converters, iterator=iterator)
+        if dfrm is None:
+            cls.logger.warning('Non-value to concat')
+        return dfrm
+
     @staticmethod
-    def yieldObserved(dfrm: pd.DataFrame) -> Generator:
-        groups = dfrm.groupby(['pdb_id', 'entity_id', 'chain_id'])
-        for i, j in groups:
-            mod = j.dropna(subset=['chem_comp_id'])
-            yield i, len(j[j.observed_ratio.gt(0)]), len(mod[mod.observed_ratio.gt(0)])
+    def observed_statistic(dfrm: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Count the observed residues and the observed modified residues of each chain
+        '''
+        observed = dfrm.observed_ratio.gt(0)
+        return dfrm[['pdb_id', 'entity_id', 'chain_id']].assign(
+            ob_res=observed,
+            ob_moded_res=observed & dfrm.chem_comp_id.notna()
+        ).groupby(['pdb_id', 'entity_id', 'chain_id'], sort=False).sum().astype(int).reset_index()
 
     @staticmethod
-    def traverse(data: Dict, cols: Tuple, cutoff=50):
+    def clean_statistic(chain_dfrm: pd.DataFrame, cutoff: int = 50) -> pd.DataFrame:
         '''
-        temp
+        Count the chains of each PDB and the chains to be cleaned,
+        i.e. chains with less than `cutoff` observed standard residues
         '''
-        observed_res_count, observed_modified_res_count = cols
-        for pdb in data:
-            count = 0
-            cleaned = 0
-            for entity in data[pdb].values():
-                for chain in entity.values():
-                    if chain[observed_res_count] - chain[observed_modified_res_count] < cutoff:
-                        cleaned += 1
-                    count += 1
-            yield pdb, count, cleaned
+        cleaned = (chain_dfrm.ob_res - chain_dfrm.ob_moded_res).lt(cutoff)
+        return chain_dfrm[['pdb_id']].assign(
+            chain_count=1,
+            cleaned_chain_count=cleaned.astype(int)
+        ).groupby('pdb_id', sort=False).sum().reset_index()
+
+    @classmethod
+    def fetch_chunk(cls, pdbs: Iterable, folder: str, task_id: int, semaphore: Optional[asyncio.Semaphore] = None, rate: float = 1.5) -> Dict[str, Unfuture]:
+        '''
+        Start to fetch all the endpoints of `pipeline_tasks` for a chunk of PDBs concurrently, under the shared `semaphore`
+        '''
+        return dict((suffix, cls.fetch_endpoint(pdbs, suffix=suffix, folder=folder, rate=rate, task_id=task_id, columns=cls.pipeline_columns.get(suffix), semaphore=semaphore)) for suffix in cls.pipeline_tasks)
+
+    @classmethod
+    def summary_chunk(cls, folder: str, task_id: int, tasks: Dict[str, Unfuture]):
+        molecules_dfrm, res_listing_dfrm, modified_AA_dfrm = (
+            cls.concat(tasks[suffix].result()) for suffix in cls.pipeline_tasks)
+        if modified_AA_dfrm is not None:
+            res_listing_dfrm.drop(columns=['author_insertion_code'], inplace=True)
+            modified_AA_dfrm.drop(columns=['author_insertion_code'], inplace=True)
+            res_listing_mod_dfrm = pd.merge(res_listing_dfrm, modified_AA_dfrm, how='left')
+        else:
+            res_listing_mod_dfrm = res_listing_dfrm
+            res_listing_mod_dfrm['chem_comp_id'] = np.nan
+        pro_dfrm = molecules_dfrm[molecules_dfrm.molecule_type.isin(['polypeptide(L)', 'polypeptide(D)'])][['pdb_id', 'entity_id']].reset_index(drop=True)
+        pro_res_listing_mod_dfrm = pd.merge(res_listing_mod_dfrm, pro_dfrm)
+        chain_dfrm = cls.observed_statistic(pro_res_listing_mod_dfrm)
+        chain_dfrm.to_csv(Path(folder, f'chain_observed_statistic+{task_id}.tsv'), sep='\t', index=False)
+        cls.clean_statistic(chain_dfrm).to_csv(Path(folder, f'clean_pdb_statistic+{task_id}.tsv'), sep='\t', index=False)
 
     @classmethod
-    def pipeline(cls, pdbs: Iterable, folder: str, chunksize: int = 1000):
+    def pipeline(cls, pdbs: Iterable, folder: str, chunksize: int = 1000, depth: int = 2, tag: str = '', concur_req: int = 20, rate: float = 1.5):
+        '''
+        Fetch the endpoints of `pipeline_tasks` chunk by chunk and summarize the observed residues
+
+        * all the endpoints of a chunk are fetched concurrently
+        * up to `depth` chunks are downloading at the same time,
+          so that the downloads of the next chunks overlap the merge and statistics of the current one
+        * all the requests of the chunks share one semaphore of `concur_req`,
+          so the load on PDBe stays the same as fetching a single endpoint with `concur_req` and `rate`
+        * `tag` is prefixed to the task id of each chunk to keep the outputs of different runs apart
+        '''
+        if depth < 1:
+            raise ValueError(f'Invalid depth: {depth}, depth should be a positive integer')
+        semaphore = UnsyncFetch.init_semaphore(concur_req).result()
+        pending = deque()
         for i in range(0, len(pdbs), chunksize):
-            related_pdbs = pdbs[i:i+chunksize]
-            molecules_dfrm = ProcessEntryData.unit(
-                related_pdbs,
-                suffix='pdb/entry/molecules/',
-                method='post',
-                folder=folder,
-                task_id=i)
-            res_listing_dfrm = ProcessEntryData.unit(
-                related_pdbs,
-                suffix='pdb/entry/residue_listing/',
-                method='get',
-                folder=folder,
-                task_id=i)
-            modified_AA_dfrm = ProcessEntryData.unit(
-                related_pdbs,
-                suffix='pdb/entry/modified_AA_or_NA/',
-                method='post',
-                folder=folder,
-                task_id=i)
-            if modified_AA_dfrm is not None:
-                res_listing_dfrm.drop(columns=['author_insertion_code'], inplace=True)
-                modified_AA_dfrm.drop(columns=['author_insertion_code'], inplace=True)
-                res_listing_mod_dfrm = pd.merge(res_listing_dfrm, modified_AA_dfrm, how='left')
-            else:
-                res_listing_mod_dfrm = res_listing_dfrm
-                res_listing_mod_dfrm['chem_comp_id'] = np.nan
-            pro_dfrm = molecules_dfrm[molecules_dfrm.molecule_type.isin(['polypeptide(L)', 'polypeptide(D)'])][['pdb_id', 'entity_id']].reset_index(drop=True)
-            pro_res_listing_mod_dfrm = pd.merge(res_listing_mod_dfrm, pro_dfrm)
-            data = defaultdict(lambda: defaultdict(lambda: defaultdict(dict)))
-            for (pdb_id, entity_id, chain_id), observed_res_count, observed_modified_res_count in cls.yieldObserved(pro_res_listing_mod_dfrm):
-                data[pdb_id][entity_id][chain_id]['ob_res'] = observed_res_count
-                data[pdb_id][entity_id][chain_id]['ob_moded_res'] = observed_modified_res_count
-            with Path(folder, f'clean_pdb_statistic+{i}.tsv').open(mode='w+') as outFile:
-                for tup in cls.traverse(data, ('ob_res', 'ob_moded_res')):
-                    outFile.write('%s\t%s\t%s\n' % tup)
-            with Path(folder, f'clean_pdb_statistic+{i}.json').open(mode='w+') as outFile:
-                json.dump(data, outFile)
+            pending.append((f'{tag}{i}', cls.fetch_chunk(pdbs[i:i+chunksize], folder, f'{tag}{i}', semaphore, rate)))
+            if len(pending) >= depth:
+                cls.summary_chunk(folder, *pending.popleft())
+        while pending:
+            cls.summary_chunk(folder, *pending.popleft())
+
+    @classmethod
+    def revision_state(cls, pdbs: Iterable, folder: str, concur_req: int = 20) -> pd.DataFrame:
+        '''
+        Fetch `status` and `summary` in bulk POST batches (sharing one semaphore of `concur_req`)
+        and collect the state of each entry, i.e. `state_columns`
+        '''
+        semaphore = UnsyncFetch.init_semaphore(concur_req).result()
+        tasks = dict((suffix, cls.fetch_endpoint(pdbs, suffix=suffix, folder=folder, task_id='state', columns=cls.pipeline_columns[suffix], semaphore=semaphore))
+                     for suffix in ('pdb/entry/status/', 'pdb/entry/summary/'))
+        status_dfrm, summary_dfrm = (cls.concat(task.result()) for task in tasks.values())
+        if status_dfrm is None:
+            return pd.DataFrame(columns=cls.state_columns)
+        state = status_dfrm[['pdb_id', 'status_code']].drop_duplicates('pdb_id')
+        if summary_dfrm is not None:
+            state = pd.merge(state, summary_dfrm[['pdb_id', 'revision_date']].drop_duplicates('pdb_id'), how='left')
+        else:
+            state['revision_date'] = np.nan
+        return state.astype(str)[list(cls.state_columns)]
+
+    @classmethod
+    def delta(cls, state: pd.DataFrame, stateFile: Union[str, Path], pdbs: Optional[Iterable] = None) -> Tuple[pd.DataFrame, List, List]:
+        '''
+        Compare the current `state` with the state table saved in `stateFile`
+
+        Return the updated state table, the released entries that are new
+        or whose status/revision date have changed since the last run,
+        and the entries released in the last run that are no longer released (e.g. superseded)
+
+        * `pdbs`: the entries queried for `state`, those of the saved state that are absent from `state`
+          are treated as withdrawn (status `missing_status`) and logged, the entries not queried are kept as they are
+        '''
+        if os.path.exists(stateFile):
+            old_state = pd.read_csv(stateFile, sep='\t', dtype=str, keep_default_na=False)
+        else:
+            old_state = pd.DataFrame(columns=cls.state_columns)
+        if pdbs is not None:
+            missing = old_state[old_state.pdb_id.isin(list(pdbs)) & ~old_state.pdb_id.isin(state.pdb_id) & old_state.status_code.ne(cls.missing_status)]
+            if len(missing):
+                cls.logger.warning(f'{len(missing)} entries are missing from the status response and treated as withdrawn: {missing.pdb_id.tolist()}')
+                state = pd.concat((state, missing.assign(status_code=cls.missing_status)[list(cls.state_columns)]), sort=False, ignore_index=True)
+        merged = pd.merge(state, old_state, on='pdb_id', how='left', suffixes=('', '_old'))
+        changed = merged.status_code_old.isna() | merged.status_code.ne(merged.status_code_old) | merged.revision_date.ne(merged.revision_date_old)
+        pdbs = merged.pdb_id[changed & merged.status_code.eq('REL')].tolist()
+        withdrawn = merged.pdb_id[merged.status_code_old.eq('REL') & merged.status_code.ne('REL')].tolist()
+        new_state = pd.concat((old_state[~old_state.pdb_id.isin(state.pdb_id)], state), sort=False, ignore_index=True)
+        return new_state, pdbs, withdrawn
+
+    @classmethod
+    def incremental(cls, pdbs: Iterable, folder: str, stateFile: Union[str, Path, None] = None, chunksize: int = 1000, depth: int = 2, refresh: Optional[Callable] = None) -> List:
+        '''
+        Delta version of `pipeline`: only the entries revised, superseded or released since the last run would be fetched again
+
+        * the state table (`state_columns`) is saved in `stateFile` (default: `entry_state.tsv` in `folder`)
+          after the pipeline finished, so that an interrupted run would be redone next time
+        * the outputs are tagged with the date of the run
+        * `refresh`: called with the changed and the withdrawn entries to bring the other outputs up to date as well,
+          e.g. `RetrieveEntryData.refresh` for the per-entry files of all the endpoints
+        '''
+        stateFile = Path(folder, 'entry_state.tsv') if stateFile is None else stateFile
+        new_state, changed, withdrawn = cls.delta(cls.revision_state(pdbs, folder), stateFile, pdbs)
+        cls.logger.info(f'{len(changed)} of {len(pdbs)} entries changed and {len(withdrawn)} withdrawn since the last run')
+        if changed:
+            cls.pipeline(changed, folder, chunksize, depth, tag=time.strftime('delta%Y%m%d-'))
+        if refresh is not None and (changed or withdrawn):
+            refresh(changed, withdrawn)
+        new_state.to_csv(stateFile, sep='\t', index=False)
+        return changed
 
 class PDBeDecoder(object):
     @staticmethod
@@ -479,10 +791,27 @@ class PDBeDecoder(object):
             sheet.column += pe.Sheet(append_data)
         return sheet
 
+    @staticmethod
+    def project(res: Tuple, columns: Optional[Iterable] = None) -> Tuple:
+        '''
+        Keep only `columns` of the records and the appended values yielded by the traversal
+        '''
+        if columns is None:
+            return res
+        records, *remain = res
+        append = dict(zip(*remain)) if len(remain) > 1 else {}
+        return [dict((col, append[col] if col in append else record.get(col)) for col in columns) for record in records],
+
     @classmethod
-    def pyexcel_io(cls, suffix: str, data: Dict, **kwargs) -> pe.Sheet:
+    def pyexcel_io(cls, suffix: str, data: Dict, columns: Optional[Iterable] = None, **kwargs) -> pe.Sheet:
+        '''
+        Flatten `data` of the endpoint into a sheet, only `columns` would be kept if it is given
+
+        The nested values of the other fields are never serialized, see `selected`
+        '''
         cur_sheet = None
-        for res in traversePDBeData(suffix, data):
+        for res in traversePDBeData(suffix, data, None if columns is None else set(columns)):
+            res = cls.project(res, columns)
             try:
                 cur_sheet.row += cls.sync_with_pyexcel(*res)
             except AttributeError:
@@ -518,23 +847,20 @@ class PDBeDecoder(object):
         return cur_ob
 
     @staticmethod
-    @dispatch_on_set({'pdb/entry/status/', 'pdb/entry/summary/', 'pdb/entry/modified_AA_or_NA/',
-                      'pdb/entry/mutated_AA_or_NA/', 'pdb/entry/cofactor/', 'pdb/entry/molecules/',
-                      'pdb/entry/ligand_monomers/', 'pdb/entry/experiment/',
-                      'pdb/entry/electron_density_statistics/',
-                      'pdb/entry/related_experiment_data/', 'pdb/entry/drugbank/'})
-    def yieldCommon(data: Dict) -> Generator:
+    @dispatch_on_set(COMMON_API)
+    def yieldCommon(data: Dict, columns: Optional[Set] = None) -> Generator:
         for pdb in data:
             values = data[pdb]
             for value in values:
                 for key in value:
-                    if isinstance(value[key], (Dict, List)):
+                    if isinstance(value[key], (Dict, List)) and selected(key, columns):
                         value[key] = json.dumps(value[key])
             yield values, ('pdb_id',), (pdb,)
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/polymer_coverage/'})
-    def yieldPolymerCoverage(data: Dict) -> Generator:
+    def yieldPolymerCoverage(data: Dict, columns: Optional[Set] = None) -> Generator:
+        keys = [key for key in ('start', 'end') if selected(key, columns)]
         for pdb in data:
             molecules = data[pdb]['molecules']
             for entity in molecules:
@@ -542,20 +868,21 @@ class PDBeDecoder(object):
                 for chain in chains:
                     observed = chain['observed']
                     for fragement in observed:
-                        for key in ('start', 'end'):
+                        for key in keys:
                             fragement[key] = json.dumps(fragement[key])
                     yield observed, ('chain_id', 'struct_asym_id', 'entity_id', 'pdb_id'), (chain['chain_id'], chain['struct_asym_id'], entity['entity_id'], pdb)
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/observed_residues_ratio/'})
-    def yieldObservedResiduesRatio(data: Dict) -> Generator:
+    def yieldObservedResiduesRatio(data: Dict, columns: Optional[Set] = None) -> Generator:
         for pdb in data:
             for entity_id, entity in data[pdb].items():
                 yield entity, ('entity_id', 'pdb_id'), (entity_id, pdb)
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/residue_listing/'})
-    def yieldResidues(data: Dict) -> Generator:
+    def yieldResidues(data: Dict, columns: Optional[Set] = None) -> Generator:
+        conformers = selected('multiple_conformers', columns)
         for pdb in data:
             molecules = data[pdb]['molecules']
             for entity in molecules:
@@ -565,13 +892,13 @@ class PDBeDecoder(object):
                     for res in residues:
                         if 'multiple_conformers' not in res:
                             res['multiple_conformers'] = None
-                        else:
+                        elif conformers:
                             res['multiple_conformers'] = json.dumps(res['multiple_conformers'])
                     yield residues, ('chain_id', 'struct_asym_id', 'entity_id', 'pdb_id'), (chain['chain_id'], chain['struct_asym_id'], entity['entity_id'], pdb)
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/secondary_structure/'})
-    def yieldSecondaryStructure(data: Dict) -> Generator:
+    def yieldSecondaryStructure(data: Dict, columns: Optional[Set] = None) -> Generator:
         for pdb in data:
             molecules = data[pdb]['molecules']
             for entity in molecules:
@@ -582,7 +909,7 @@ class PDBeDecoder(object):
                         fragment = secondary_structure[name]
                         for record in fragment:
                             for key in record:
-                                if isinstance(record[key], (Dict, List)):
+                                if isinstance(record[key], (Dict, List)) and selected(key, columns):
                                     record[key] = json.dumps(record[key])
                             if 'sheet_id' not in record:
                                 record['sheet_id'] = None
@@ -590,7 +917,7 @@ class PDBeDecoder(object):
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/binding_sites/'})
-    def yieldBindingSites(data: Dict) -> Generator:
+    def yieldBindingSites(data: Dict, columns: Optional[Set] = None) -> Generator:
         for pdb in data:
             for site in data[pdb]:
                 for tage in ('site_residues', 'ligand_residues'):
@@ -602,13 +929,13 @@ class PDBeDecoder(object):
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/assembly/'})
-    def yieldAssembly(data: Dict) -> Generator:
+    def yieldAssembly(data: Dict, columns: Optional[Set] = None) -> Generator:
         for pdb in data:
             for biounit in data[pdb]:
                 entities = biounit['entities']
                 for entity in entities:
                     for key in entity:
-                        if isinstance(entity[key], (Dict, List)):
+                        if isinstance(entity[key], (Dict, List)) and selected(key, columns):
                             entity[key] = json.dumps(entity[key])
                 keys = list(biounit)
                 keys.remove('entities')
@@ -616,7 +943,7 @@ class PDBeDecoder(object):
 
     @staticmethod
     @dispatch_on_set({'pdb/entry/files/'})
-    def yieldAssociatedFiles(data: Dict) -> Generator:
+    def yieldAssociatedFiles(data: Dict, columns: Optional[Set] = None) -> Generator:
         for pdb in data:
             for key in data[pdb]:
                 for innerKey in data[pdb][key]:
@@ -628,12 +955,13 @@ class PDBeDecoder(object):
 
     @staticmethod
     @dispatch_on_set({'mappings/all_isoforms/'})
-    def yieldSIFTSRange(data: Dict) -> Generator:
+    def yieldSIFTSRange(data: Dict, columns: Optional[Set] = None) -> Generator:
         top_root = next(iter(data))  # PDB_ID or UniProt Isoform ID
         sec_root = next(iter(data[top_root]))  # 'UniProt' or 'PDB'
         child = data[top_root][sec_root]
         thi_root = next(iter(child))
         test_value = child[thi_root]
+        keys = [key for key in ('start', 'end') if selected(key, columns)]
         # from PDB to UniProt
         if isinstance(test_value, Dict) and sec_root == 'UniProt':
             for uniprot in child:
@@ -641,8 +969,8 @@ class PDBeDecoder(object):
                 identifier = child[uniprot]['identifier']
                 chains = child[uniprot]['mappings']
                 for chain in chains:
-                    chain['start'] = json.dumps(chain['start'])
-                    chain['end'] = json.dumps(chain['end'])
+                    for key in keys:
+                        chain[key] = json.dumps(chain[key])
                     chain['pdb_id'] = top_root
                     chain[sec_root] = uniprot
                     chain['identifier'] = identifier
@@ -653,8 +981,8 @@ class PDBeDecoder(object):
             for pdb in child:
                 chains = child[pdb]
                 for chain in chains:
-                    chain['start'] = json.dumps(chain['start'])
-                    chain['end'] = json.dumps(chain['end'])
+                    for key in keys:
+                        chain[key] = json.dumps(chain[key])
                 yield chains, ('pdb_id', 'UniProt'), (pdb, top_root)
         else:
             raise ValueError(f'Unexpected data structure for inputted data: {data}')
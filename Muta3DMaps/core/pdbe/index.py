@@ -0,0 +1,248 @@
+# @Created Date: 2020-04-13 10:12:45 am
+# @Filename: index.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-13 10:12:49 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import os
+import numpy as np
+import pandas as pd
+import ujson as json
+from pathlib import Path
+from collections import deque
+from typing import Union, Optional, Iterable, Set, Tuple, List, Dict
+
+
+def gather(offsets: np.ndarray, values: np.ndarray, index: np.ndarray) -> np.ndarray:
+    '''
+    Concatenate `values[offsets[i]:offsets[i+1]]` of each `i` in `index` without a Python loop
+    '''
+    starts = offsets[index]
+    counts = offsets[index+1] - starts
+    shift = np.repeat(starts - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+    return values[np.arange(counts.sum()) + shift]
+
+
+def lookup(ids: np.ndarray, query: Iterable) -> np.ndarray:
+    '''
+    Positions of `query` in the sorted `ids`, unknown ids are dropped
+    '''
+    query = np.asarray(list(query), dtype=str)
+    index = np.searchsorted(ids, query)
+    index[index == len(ids)] = 0
+    return index[ids[index] == query] if len(ids) else index[:0]
+
+
+def min_vertex_cover(adjacency: List[List[int]], right_size: int) -> Tuple[List[int], List[int]]:
+    '''
+    Minimum vertex cover of a bipartite graph (König's theorem on a Hopcroft-Karp maximum matching)
+
+    :param adjacency: right vertices adjacent to each left vertex
+    :return: left vertices and right vertices of the cover
+    '''
+    left_size = len(adjacency)
+    match_left, match_right = [-1]*left_size, [-1]*right_size
+    while True:
+        dist = [-1]*left_size
+        queue = deque(u for u in range(left_size) if match_left[u] == -1)
+        for u in queue:
+            dist[u] = 0
+        found = False
+        while queue:
+            u = queue.popleft()
+            for v in adjacency[u]:
+                w = match_right[v]
+                if w == -1:
+                    found = True
+                elif dist[w] == -1:
+                    dist[w] = dist[u] + 1
+                    queue.append(w)
+        if not found:
+            break
+        pointer = [0]*left_size
+        for root in range(left_size):
+            if match_left[root] != -1:
+                continue
+            stack, via = [root], [None]
+            while stack:
+                u = stack[-1]
+                if pointer[u] < len(adjacency[u]):
+                    v = adjacency[u][pointer[u]]
+                    pointer[u] += 1
+                    w = match_right[v]
+                    if w == -1:
+                        # augment along the current path
+                        for uu, vv in zip(stack, via[1:] + [v]):
+                            match_left[uu], match_right[vv] = vv, uu
+                        break
+                    elif dist[w] == dist[u] + 1:
+                        stack.append(w)
+                        via.append(v)
+                else:
+                    dist[u] = -1
+                    stack.pop()
+                    via.pop()
+    # alternating search from the unmatched left vertices
+    visited_left, visited_right = [False]*left_size, [False]*right_size
+    queue = deque(u for u in range(left_size) if match_left[u] == -1)
+    for u in queue:
+        visited_left[u] = True
+    while queue:
+        u = queue.popleft()
+        for v in adjacency[u]:
+            if not visited_right[v]:
+                visited_right[v] = True
+                w = match_right[v]
+                if w != -1 and not visited_left[w]:
+                    visited_left[w] = True
+                    queue.append(w)
+    return ([u for u in range(left_size) if not visited_left[u]],
+            [v for v in range(right_size) if visited_right[v]])
+
+
+class UniProtPDBIndex(object):
+    '''
+    Bidirectional UniProt <-> PDB index built from the SIFTS `uniprot_pdb` flatfile
+
+    * UniProt -> PDB and PDB -> UniProt are stored as CSR-style offset arrays
+    * the arrays are saved as `.npy` files in `{source}.index` and memory-mapped when loaded
+    * the index would be rebuilt only when the size or modified time of the source file changes
+
+    Reference
+
+        * http://www.ebi.ac.uk/pdbe/docs/sifts/quick.html
+        * A summary of the UniProt to PDB mappings showing the UniProt accession
+          followed by a semicolon-separated list of PDB four letter codes.
+    '''
+
+    arrays: Tuple = ('unp_ids', 'pdb_ids', 'unp_offsets', 'unp_pdb', 'pdb_offsets', 'pdb_unp')
+    meta_file: str = 'source.json'
+
+    def __init__(self, folder: Union[str, Path], mmap_mode: Optional[str] = 'r'):
+        self.folder = Path(folder)
+        for name in self.arrays:
+            setattr(self, name, np.load(self.folder/f'{name}.npy', mmap_mode=mmap_mode))
+
+    def __repr__(self):
+        return f'UniProtPDBIndex<unp:{len(self.unp_ids)}, pdb:{len(self.pdb_ids)}, pairs:{len(self.unp_pdb)}>'
+
+    @staticmethod
+    def source_stat(path: Union[str, Path]) -> dict:
+        stat = os.stat(path)
+        return {'path': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    @staticmethod
+    def default_folder(path: Union[str, Path]) -> Path:
+        return Path(f'{path}.index')
+
+    @classmethod
+    def build(cls, path: Union[str, Path], sep: str = '\t', folder: Union[str, Path, None] = None):
+        folder = cls.default_folder(path) if folder is None else Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        dfrm = pd.read_csv(path, sep=sep, header=1, usecols=['SP_PRIMARY', 'PDB'], dtype=str).dropna()
+        pairs = dfrm.assign(PDB=dfrm.PDB.str.split(';')).explode('PDB').drop_duplicates()
+        unp_ids, unp_codes = np.unique(pairs.SP_PRIMARY.to_numpy(str), return_inverse=True)
+        pdb_ids, pdb_codes = np.unique(pairs.PDB.to_numpy(str), return_inverse=True)
+        unp_codes, pdb_codes = unp_codes.ravel(), pdb_codes.ravel()
+        data = {'unp_ids': unp_ids, 'pdb_ids': pdb_ids}
+        for name, key, value, size in (('unp', unp_codes, pdb_codes, len(unp_ids)), ('pdb', pdb_codes, unp_codes, len(pdb_ids))):
+            order = np.lexsort((value, key))
+            data[f'{name}_offsets'] = np.concatenate(([0], np.cumsum(np.bincount(key, minlength=size)))).astype(np.int64)
+            data[f'{name}_{"pdb" if name == "unp" else "unp"}'] = value[order].astype(np.int32)
+        for name in cls.arrays:
+            np.save(folder/f'{name}.npy', data[name])
+        # write the meta file at last so that an interrupted build would be treated as stale
+        with (folder/cls.meta_file).open('w') as outFile:
+            json.dump(cls.source_stat(path), outFile)
+        return cls(folder)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path], sep: str = '\t', folder: Union[str, Path, None] = None):
+        '''
+        Load the index of the flatfile, (re)build it if it is missing or out of date
+        '''
+        folder = cls.default_folder(path) if folder is None else Path(folder)
+        try:
+            with (folder/cls.meta_file).open() as inFile:
+                meta = json.load(inFile)
+            stat = cls.source_stat(path)
+            if meta['size'] == stat['size'] and meta['mtime_ns'] == stat['mtime_ns']:
+                return cls(folder)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return cls.build(path, sep, folder)
+
+    def unp_index(self, unps: Iterable) -> np.ndarray:
+        return lookup(self.unp_ids, unps)
+
+    def pdb_index(self, pdbs: Iterable) -> np.ndarray:
+        return lookup(self.pdb_ids, pdbs)
+
+    def unp2pdb(self, unps: Optional[Iterable] = None) -> np.ndarray:
+        '''
+        PDB ids related to `unps` (all the PDB ids if `unps` is `None`)
+        '''
+        if unps is None:
+            return np.asarray(self.pdb_ids)
+        return self.pdb_ids[np.unique(gather(self.unp_offsets, self.unp_pdb, self.unp_index(unps)))]
+
+    def pdb2unp(self, pdbs: Optional[Iterable] = None) -> np.ndarray:
+        '''
+        UniProt accessions related to `pdbs` (all the accessions if `pdbs` is `None`)
+        '''
+        if pdbs is None:
+            return np.asarray(self.unp_ids)
+        return self.unp_ids[np.unique(gather(self.pdb_offsets, self.pdb_unp, self.pdb_index(pdbs)))]
+
+    def related(self, related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None) -> Tuple[Set, Set]:
+        '''
+        Same as filtering the flatfile by `related_unp`:
+        return the related PDB ids (intersected with `related_pdb`) and the matched UniProt accessions
+        '''
+        if related_unp is None:
+            unps = self.unp_ids
+            pdbs = self.pdb_ids
+        else:
+            unps = self.unp_ids[np.unique(self.unp_index(related_unp))]
+            pdbs = self.unp2pdb(unps)
+        pdb_set = set(pdbs.tolist())
+        if related_pdb is not None:
+            pdb_set &= set(related_pdb)
+        return pdb_set, set(unps.tolist())
+
+    def plan_requests(self, related_unp: Optional[Iterable] = None, related_pdb: Optional[Iterable] = None, mode: str = 'auto') -> Dict[str, List]:
+        '''
+        Choose the UniProt ids and PDB ids to query so that every related (UniProt, PDB) pair is covered
+
+        * `pdb`: one PDB-centric request per related PDB
+        * `unp`: one UniProt-centric request per related UniProt accession
+        * `auto`: the mix of both directions with the fewest requests (a minimum vertex cover of the relation)
+
+        Return the ids to query (`unp`, `pdb`), along with `baseline`: the requests of the cheaper single direction
+        '''
+        unp_index = np.arange(len(self.unp_ids)) if related_unp is None else np.unique(self.unp_index(related_unp))
+        offsets = np.asarray(self.unp_offsets)
+        counts = offsets[unp_index+1] - offsets[unp_index]
+        left = np.repeat(np.arange(len(unp_index)), counts)
+        right = gather(offsets, self.unp_pdb, unp_index)
+        if related_pdb is not None:
+            mask = np.isin(right, self.pdb_index(related_pdb))
+            left, right = left[mask], right[mask]
+        unp_codes, left = np.unique(unp_index[left], return_inverse=True)
+        pdb_codes, right = np.unique(right, return_inverse=True)
+        mode = mode.lower()
+        if mode == 'pdb':
+            unp_cover, pdb_cover = [], np.arange(len(pdb_codes))
+        elif mode == 'unp':
+            unp_cover, pdb_cover = np.arange(len(unp_codes)), []
+        elif mode == 'auto':
+            adjacency = [[] for _ in range(len(unp_codes))]
+            for u, v in zip(left.ravel().tolist(), right.ravel().tolist()):
+                adjacency[u].append(v)
+            unp_cover, pdb_cover = min_vertex_cover(adjacency, len(pdb_codes))
+        else:
+            raise ValueError(f'Invalid mode: {mode}, mode should be "auto", "unp" or "pdb"')
+        return {
+            'unp': self.unp_ids[unp_codes[np.asarray(unp_cover, dtype=np.int64)]].tolist(),
+            'pdb': self.pdb_ids[pdb_codes[np.asarray(pdb_cover, dtype=np.int64)]].tolist(),
+            'baseline': min(len(unp_codes), len(pdb_codes))}
@@ -4,87 +4,340 @@
 # @Author: ZeFeng Zhu
 # @Last Modified: 2020-02-29 10:37:06 pm
 # @Copyright (c) 2020 MinghuiGroup, Soochow University
+import numpy as np
+import pandas as pd
 import ujson as json
-from collections import defaultdict
-from itertools import product, combinations, combinations_with_replacement
-from typing import Dict, Iterable, Union, Set, List
+from typing import Dict, Iterable, Union, List, Tuple, Optional, Generator
+from Muta3DMaps.core.ranges import IntervalSet, RaggedRanges, ragged_lengths
 
+LEVELS: Tuple = ('pdb_id', 'entry_id', 'entity_id', 'chain_id', 'UniProt')
 
-def validateSIFTS(data: Dict):
+
+def groupPairs(groups: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Row pairs `i < j` within the same group (rows sorted by group), in row-major order
+    '''
+    rows = np.arange(len(groups))
+    counts = offsets[groups+1] - rows - 1
+    left = np.repeat(rows, counts)
+    right = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + left + 1
+    return left, right
+
+
+def pairOverlap(ranges: RaggedRanges, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    '''
+    Number of residues shared by the rows of each pair, over all the segment pairs at once
+    '''
+    counts = ranges.counts
+    size = counts[left]*counts[right]
+    pairs = np.repeat(np.arange(len(left)), size)
+    rank = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+    seg_l = ranges.offsets[left][pairs] + rank // counts[right][pairs]
+    seg_r = ranges.offsets[right][pairs] + rank % counts[right][pairs]
+    overlap = np.minimum(ranges.ends[seg_l], ranges.ends[seg_r]) - np.maximum(ranges.starts[seg_l], ranges.starts[seg_r]) + 1
+    return np.bincount(pairs, np.clip(overlap, 0, None), minlength=len(left)).astype(np.int64)
+
+
+class UnitTable(object):
+    '''
+    Columnar form of the `{pdb_id: {entry_id: {entity_id: {chain_id: {isoform: {...}}}}}}` hierarchy
+
+    * one row per (pdb, entry, entity, chain, isoform) unit, `codes[level]` are the integer codes of the values
+    * the rows are sorted by group, with the groups of each level in the order of first appearance
+      (the same order as walking the nested dict)
+    * `offsets[level]` are the CSR group offsets of the rows and `groups[level]` the group index of each row,
+      for the prefixes of `LEVELS` ending at `pdb_id`, `entry_id`, `entity_id` and `chain_id`
+    * `ranges` holds the parsed `sifts_unp_range` of the rows
+    '''
+
+    def __init__(self, dfrm: pd.DataFrame, range_col: str = 'sifts_unp_range', levels: Iterable = LEVELS):
+        self.levels = tuple(levels)
+        dfrm = dfrm.drop_duplicates(list(self.levels)).reset_index(drop=True)
+        # groups of each prefix of the levels, numbered by first appearance
+        prefixes = [dfrm.groupby(list(self.levels[:depth]), sort=False).ngroup().to_numpy() for depth in range(1, len(self.levels))]
+        order = np.lexsort(prefixes[::-1])
+        self.table = dfrm[list(self.levels)].iloc[order].reset_index(drop=True)
+        self.codes = dict((level, pd.factorize(self.table[level])[0]) for level in self.levels)
+        self.ranges = dfrm[range_col].iloc[order].ranges.data
+        self.groups, self.offsets = {}, {}
+        for level, prefix in zip(self.levels, prefixes):
+            prefix = prefix[order]
+            groups = np.cumsum(np.concatenate(([False], prefix[1:] != prefix[:-1])))
+            self.groups[level] = groups
+            self.offsets[level] = np.concatenate(([0], np.cumsum(np.bincount(groups)))).astype(np.int64)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __repr__(self):
+        return f'UnitTable<pdb:{len(self.offsets[self.levels[0]]) - 1}, units:{len(self)}>'
+
+    @classmethod
+    def from_dict(cls, data: Dict, range_col: str = 'sifts_unp_range'):
+        rows = [
+            (pdb_id, entry_id, entity_id, chain_id, isoform_id, unit[range_col] if isinstance(unit[range_col], str) else json.dumps(unit[range_col]))
+            for pdb_id, entries in data.items()
+            for entry_id, entities in entries.items()
+            for entity_id, chains in entities.items()
+            for chain_id, isoforms in chains.items()
+            for isoform_id, unit in isoforms.items()]
+        return cls(pd.DataFrame(rows, columns=LEVELS + (range_col,)), range_col)
+
+    def iterPDB(self) -> Generator:
+        '''
+        Stream `(pdb_id, units, ranges)` of each PDB, the units are `(entry_id, entity_id, chain_id, isoform_id)`
+        in the order of the rows
+        '''
+        offsets = self.offsets[self.levels[0]]
+        units = list(self.table[list(self.levels[1:])].itertuples(index=False, name=None))
+        pdb_ids = self.table[self.levels[0]].to_numpy()[offsets[:-1]].tolist()
+        for pdb_id, start, stop in zip(pdb_ids, offsets[:-1], offsets[1:]):
+            yield pdb_id, units[start:stop], self.ranges.take(np.arange(start, stop))
+
+    def invalid(self) -> pd.DataFrame:
+        '''
+        Entities whose chains do not share the same isoforms
+
+        An entity is valid iff each of its isoforms occurs in every chain of it,
+        i.e. the count of every (entity, isoform) equals the number of chains of the entity
+        '''
+        pdb_id, entry_id, entity_id, chain_id, isoform_id = self.levels
+        entity = self.groups[entity_id]
+        chain_counts = np.bincount(entity[self.offsets[chain_id][:-1]], minlength=len(self.offsets[entity_id]) - 1)
+        isoform_keys = entity*(self.codes[isoform_id].max(initial=0)+1) + self.codes[isoform_id]
+        _, isoform_index, isoform_counts = np.unique(isoform_keys, return_inverse=True, return_counts=True)
+        bad = np.zeros(len(chain_counts), dtype=bool)
+        np.logical_or.at(bad, entity, isoform_counts[isoform_index.ravel()] != chain_counts[entity])
+        return self.table.iloc[self.offsets[entity_id][:-1][bad], :3].reset_index(drop=True)
+
+    def validate(self):
+        '''
+        验证同一Entry下, 每个Entity每条链下的Isoform情况相同
+        '''
+        invalid = self.invalid()
+        if len(invalid):
+            pdb_id, entry_id, entity_id = invalid.iloc[0]
+            chains = self.table[(self.table.iloc[:, 0] == pdb_id) & (self.table.iloc[:, 1] == entry_id) & (self.table.iloc[:, 2] == entity_id)]
+            isoformSet = set(tuple(isoforms) for _, isoforms in chains.groupby(self.levels[3], sort=False)[self.levels[4]])
+            raise ValueError(f'{pdb_id}_{entry_id}_{entity_id}: {isoformSet}')
+
+    def jaccard(self, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+        overlap = pairOverlap(self.ranges, left, right)
+        lengths = ragged_lengths(self.ranges)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return overlap / (lengths[left] + lengths[right] - overlap)
+
+    def he(self, threshold: Optional[float] = None) -> pd.DataFrame:
+        '''
+        Pairs of units of different entries within the same PDB,
+        Jaccard index of the `sifts_unp_range` for the same entity otherwise 0
+
+        The pairs of the whole table are scored at once and ordered row-major over the units (by PDB, then by the left unit),
+        not in the order of `yieldHe`; `value` is a float column
+        '''
+        pdb_id, entry_id, entity_id, chain_id, isoform_id = self.levels
+        left, right = groupPairs(self.groups[pdb_id], self.offsets[pdb_id])
+        keep = self.groups[entry_id][left] != self.groups[entry_id][right]
+        left, right = left[keep], right[keep]
+        same_entity = self.table[entity_id].to_numpy()[left] == self.table[entity_id].to_numpy()[right]
+        value = np.zeros(len(left))
+        value[same_entity] = self.jaccard(left[same_entity], right[same_entity])
+        if threshold is not None:
+            keep = value >= threshold
+            left, right, value = left[keep], right[keep], value[keep]
+        res = self.pairFrame(left, right, (entry_id, entity_id, chain_id, isoform_id))
+        res['value'] = value
+        return res
+
+    def ho(self, threshold: Optional[float] = None) -> pd.DataFrame:
+        '''
+        Pairs of chains within the same entry:
+        units of different entities with the same isoform (`same_entity` is `False`, Jaccard index of the ranges)
+        and chains of the same entity (`same_entity` is `True`, value 1),
+        ordered by entry, `same_entity` then row-major over the units, not in the order of `yieldHo`;
+        unlike `yieldHo`, the isoforms of the chains are not asserted to be the same
+        '''
+        pdb_id, entry_id, entity_id, chain_id, isoform_id = self.levels
+        left, right = groupPairs(self.groups[entry_id], self.offsets[entry_id])
+        keep = (self.groups[entity_id][left] != self.groups[entity_id][right]) & (self.codes[isoform_id][left] == self.codes[isoform_id][right])
+        left, right = left[keep], right[keep]
+        value = self.jaccard(left, right)
+        if threshold is not None:
+            keep = value >= threshold
+            left, right, value = left[keep], right[keep], value[keep]
+        # the first unit of each chain stands for the chain
+        chains = self.offsets[chain_id][:-1]
+        same_l, same_r = groupPairs(self.groups[entity_id][chains], np.searchsorted(chains, self.offsets[entity_id]))
+        same_l, same_r = chains[same_l], chains[same_r]
+        left, right = np.concatenate((left, same_l)), np.concatenate((right, same_r))
+        same_entity = np.repeat([False, True], (len(value), len(same_l)))
+        order = np.lexsort((same_entity, self.groups[entry_id][left]))
+        res = self.pairFrame(left[order], right[order], (chain_id,), (pdb_id, entry_id))
+        res.insert(2, 'same_entity', same_entity[order])
+        res['value'] = np.concatenate((value, np.ones(len(same_l))))[order]
+        return res
+
+    def pairFrame(self, left: np.ndarray, right: np.ndarray, pair_cols: Tuple, key_cols: Tuple = ()) -> pd.DataFrame:
+        key_cols = key_cols or self.levels[:1]
+        res = self.table.iloc[left][list(key_cols)].reset_index(drop=True)
+        for col in pair_cols:
+            res[f'{col}_l'] = self.table[col].to_numpy()[left]
+            res[f'{col}_r'] = self.table[col].to_numpy()[right]
+        return res
+
+
+def validateSIFTS(data: Union[Dict, UnitTable]):
     '''
     验证同一Entry下, 每个Entity每条链下的Isoform情况相同
     '''
-    for pdb_id, entries in data.items():
-        for entry_id, entities in entries.items():
-            for entity_id, chains in entities.items():
-                isoformSet = set(tuple(isoforms.keys()) for chain_id, isoforms in chains.items())
-                if len(isoformSet) > 1:
-                    raise ValueError(f'{pdb_id}_{entry_id}_{entity_id}: {isoformSet}')
+    (data if isinstance(data, UnitTable) else UnitTable.from_dict(data)).validate()
 
 
 def range2Set(rangeLyst: Iterable):
-    rangeSet = set()
-    for res in rangeLyst:
-        rangeSet = rangeSet | set(range(res[0], res[1]+1))
-    return rangeSet
+    return set(IntervalSet.from_ranges(rangeLyst))
 
 
 def jaccardIndex(range_a: Union[str, Iterable], range_b: [str, Iterable]):
-    if isinstance(range_a, str):
-        range_a = range2Set(json.loads(range_a))
-    if isinstance(range_b, str):
-        range_b = range2Set(json.loads(range_b))
-    elif isinstance(range_a, Set):
-        pass
-    elif isinstance(range_b, Set):
-        pass
-    elif isinstance(range_a, Iterable):
-        range_a = range2Set(range_a)
-    elif isinstance(range_b, Iterable):
-        range_b = range2Set(range_b)
-    
+    range_a, range_b = IntervalSet.from_ranges(range_a), IntervalSet.from_ranges(range_b)
     return len(range_a & range_b)/len(range_a | range_b)
 
 
-def yieldHe(data: Dict):
-    for pdb_id, entries in data.items():
-        if len(entries) == 1:
+def overlapMatrix(ranges: RaggedRanges) -> np.ndarray:
+    '''
+    Number of residues shared by every pair of rows
+    (the segments within a row should not overlap each other)
+
+    * the segments are sorted by start, the ones intersecting a segment are those starting within it,
+      so only the intersecting segment pairs are materialized instead of all the segment pairs
+    '''
+    size = len(ranges)
+    order = np.argsort(ranges.starts, kind='stable')
+    starts, ends, rows = ranges.starts[order], ranges.ends[order], ranges.rows[order]
+    index = np.arange(len(starts))
+    counts = np.searchsorted(starts, ends, side='right') - index - 1
+    left = np.repeat(index, counts)
+    right = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + left + 1
+    overlap = np.minimum(ends[left], ends[right]) - starts[right] + 1
+    res = np.bincount(rows[left]*size + rows[right], overlap, minlength=size*size).reshape(size, size)
+    res += res.T
+    res[np.diag_indices(size)] += np.bincount(rows, ends - starts + 1, minlength=size)
+    return res.astype(np.int64)
+
+
+def jaccardMatrix(ranges: RaggedRanges) -> np.ndarray:
+    overlap = overlapMatrix(ranges)
+    lengths = np.diag(overlap)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return overlap / (lengths[:, None] + lengths[None, :] - overlap)
+
+
+def flattenUnits(entries: Dict) -> Tuple[List, RaggedRanges]:
+    '''
+    (entry_id, entity_id, chain_id, isoform_id) of every chain-isoform unit of a PDB and their parsed `sifts_unp_range`
+    '''
+    units, ranges = [], []
+    for entry_id, entities in entries.items():
+        for entity_id, chains in entities.items():
+            for chain_id, isoforms in chains.items():
+                for isoform_id, unit in isoforms.items():
+                    units.append((entry_id, entity_id, chain_id, isoform_id))
+                    unp_range = unit['sifts_unp_range']
+                    ranges.append(unp_range if isinstance(unp_range, str) else json.dumps(unp_range))
+    return units, RaggedRanges.from_json(ranges)
+
+
+def runGroups(units: List, depth: int) -> np.ndarray:
+    '''
+    Group index of the `depth`-prefix of each unit, the units being in nested order so that every group is a run
+    '''
+    codes, prev = np.empty(len(units), dtype=np.int64), None
+    code = -1
+    for index, unit in enumerate(units):
+        key = unit[:depth]
+        if key != prev:
+            code, prev = code + 1, key
+        codes[index] = code
+    return codes
+
+
+def valueCodes(values: Iterable) -> np.ndarray:
+    codes = {}
+    return np.array([codes.setdefault(value, len(codes)) for value in values], dtype=np.int64)
+
+
+def iterUnits(data: Union[Dict, UnitTable]) -> Generator:
+    '''
+    Stream `(pdb_id, units, ranges)` PDB by PDB, from either the nested dict or a `UnitTable`
+    '''
+    if isinstance(data, UnitTable):
+        yield from data.iterPDB()
+    else:
+        for pdb_id, entries in data.items():
+            yield (pdb_id, *flattenUnits(entries))
+
+
+def yieldHe(data: Union[Dict, UnitTable], threshold: Optional[float] = None):
+    '''
+    Pairs of chains of different entries within the same PDB,
+    Jaccard index of the `sifts_unp_range` is computed for the same entity otherwise it is 0
+
+    * PDB by PDB, the ranges are parsed once and the Jaccard matrix of the units is computed in one pass
+    * the candidate pairs are taken from the unit-pair matrix with `np.nonzero`, pairs below `threshold` are dropped there
+    * pairs are yielded in the order of entry pair, entity product, chain product then isoform product
+    '''
+    for pdb_id, units, ranges in iterUnits(data):
+        entry, entity, chain = (runGroups(units, depth) for depth in (1, 2, 3))
+        if not len(units) or entry[-1] == 0:
             continue
-        else:
-            for entry_l, entry_r in combinations(entries, 2):
-                eitities_l, eitities_r = entries[entry_l], entries[entry_r]
-                for entity_id_l, entity_id_r in product(eitities_l, eitities_r):
-                    chains_l, chains_r = eitities_l[entity_id_l], eitities_r[entity_id_r]
-                    for chain_id_l, chain_id_r in product(chains_l, chains_r):
-                        isoforms_l, isoforms_r = chains_l[chain_id_l], chains_r[chain_id_r]
-                        for isoform_id_l, isoform_id_r in product(isoforms_l, isoforms_r):
-                            unit_l, unit_r = isoforms_l[isoform_id_l], isoforms_r[isoform_id_r]
-                            if entity_id_l == entity_id_r:
-                                jaccard = jaccardIndex(
-                                    unit_l['sifts_unp_range'], unit_r['sifts_unp_range'])
-                            else:
-                                jaccard = 0
-                            yield pdb_id, (entry_l, entry_r), (entity_id_l, entity_id_r), (chain_id_l, chain_id_r), (isoform_id_l, isoform_id_r), jaccard
-
-
-def yieldHo(data):
+        entity_code = valueCodes(unit[1] for unit in units)
+        candidate = entry[:, None] < entry[None, :]
+        same_entity = candidate & (entity_code[:, None] == entity_code[None, :])
+        value = np.zeros((len(units), len(units)))
+        if same_entity.any():
+            value[same_entity] = jaccardMatrix(ranges)[same_entity]
+        if threshold is not None:
+            candidate &= value >= threshold
+        left, right = np.nonzero(candidate)
+        order = np.lexsort((right, left, chain[right], chain[left], entity[right], entity[left], entry[right], entry[left]))
+        left, right = left[order], right[order]
+        for index_l, index_r, same, jaccard in zip(left.tolist(), right.tolist(), same_entity[left, right].tolist(), value[left, right].tolist()):
+            (entry_l, entity_id_l, chain_id_l, isoform_id_l), (entry_r, entity_id_r, chain_id_r, isoform_id_r) = units[index_l], units[index_r]
+            yield pdb_id, (entry_l, entry_r), (entity_id_l, entity_id_r), (chain_id_l, chain_id_r), (isoform_id_l, isoform_id_r), jaccard if same else 0
+
+
+def yieldHo(data: Union[Dict, UnitTable], threshold: Optional[float] = None):
     '''
     同一PDB下, 内任意两条链是否属于同一蛋白, 且覆盖范围是否相似
     还需验证，不同Entry下对应的entity不同
+
+    * chains of different entities are compared by the Jaccard matrix of the same isoform,
+      the candidate pairs are taken with `np.nonzero` and pairs below `threshold` are dropped there
+    * chains of the same entity are reported with 1
+    * pairs are yielded in the order of entry, entity pair, chain product then isoform
     '''
-    for pdb_id, entries in data.items():
-        for entry_id, entities in entries.items():
-            for entity_id_l, entity_id_r in combinations_with_replacement(entities.keys(), 2):
-                if entity_id_l != entity_id_r:
-                    chains_l, chains_r = entities[entity_id_l], entities[entity_id_r]
-                    chain_ids_l, chain_ids_r = chains_l.keys(), chains_r.keys()
-                    for chain_id_l, chain_id_r in product(chain_ids_l, chain_ids_r):
-                        chain_l, chain_r = chains_l[chain_id_l], chains_r[chain_id_r]
-                        isoform_ids_l, isoform_ids_r = chain_l.keys(), chain_r.keys()
-                        assert isoform_ids_l == isoform_ids_r
-                        for isoform_id in isoform_ids_l:
-                            yield pdb_id, entry_id, 'ho', False, (chain_id_l, chain_id_r), jaccardIndex(chain_l[isoform_id]['sifts_unp_range'], chain_r[isoform_id]['sifts_unp_range'])
-                else:
-                    chain_ids = entities[entity_id_l].keys()
-                    for res in combinations(chain_ids, 2):
-                        yield pdb_id, entry_id, 'ho', True, res, 1
+    for pdb_id, units, ranges in iterUnits(data):
+        if not len(units):
+            continue
+        entry, entity, chain = (runGroups(units, depth) for depth in (1, 2, 3))
+        isoform = valueCodes(unit[3] for unit in units)
+        # the chains of an entry with several entities should share the same isoforms:
+        # every chain holds all the distinct isoforms of its entry
+        first = np.flatnonzero(np.diff(chain, prepend=-1))
+        multiple = np.bincount(entry[np.flatnonzero(np.diff(entity, prepend=-1))]) > 1
+        isoform_count = np.bincount(np.unique(entry*len(units) + isoform) // len(units), minlength=len(multiple))
+        assert not (multiple & (np.bincount(entry, minlength=len(multiple)) != np.bincount(entry[first], minlength=len(multiple))*isoform_count)).any()
+        candidate = (entry[:, None] == entry[None, :]) & (entity[:, None] < entity[None, :]) & (isoform[:, None] == isoform[None, :])
+        value = np.zeros((len(units), len(units)))
+        if candidate.any():
+            value[candidate] = jaccardMatrix(ranges)[candidate]
+            if threshold is not None:
+                candidate &= value >= threshold
+        left, right = np.nonzero(candidate)
+        # the first unit of each chain stands for the chain
+        same_l, same_r = np.nonzero((entity[first][:, None] == entity[first][None, :]) & np.triu(np.ones((len(first), len(first)), dtype=bool), 1))
+        same_l, same_r = first[same_l], first[same_r]
+        same_entity = np.repeat([False, True], (len(left), len(same_l)))
+        left, right = np.concatenate((left, same_l)), np.concatenate((right, same_r))
+        order = np.lexsort((left, chain[right], chain[left], entity[right], entity[left], entry[left]))
+        for index_l, index_r, same in zip(left[order].tolist(), right[order].tolist(), same_entity[order].tolist()):
+            yield pdb_id, units[index_l][0], 'ho', same, (units[index_l][2], units[index_r][2]), 1 if same else value[index_l, index_r].item()
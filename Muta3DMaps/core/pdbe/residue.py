@@ -0,0 +1,169 @@
+# @Created Date: 2020-04-16 09:35:12 am
+# @Filename: residue.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-16 09:35:17 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import os
+import numpy as np
+import pandas as pd
+import ujson as json
+from pathlib import Path
+from typing import Union, Optional, Iterable, Dict, List, Tuple
+from Muta3DMaps.core.utils import read_frames
+
+ENTITY_BITS: int = 20
+CHAIN_BITS: int = 20
+
+
+def encode_insertion_codes(codes: pd.Series) -> np.ndarray:
+    '''
+    One byte per insertion code, `0` for an empty code
+    '''
+    codes = codes.fillna('').astype(str).str[:1].str.pad(1, fillchar='\0')
+    return np.frombuffer(''.join(codes.tolist()).encode('latin-1'), dtype=np.uint8)
+
+
+def decode_insertion_codes(codes: np.ndarray) -> List:
+    return [chr(code) if code else '' for code in np.asarray(codes).tolist()]
+
+
+class ResidueStore(object):
+    '''
+    Struct-of-arrays store of the decoded `residue_listing` tables
+
+    * residues are sorted by (pdb_id, entity_id, chain_id, residue_number),
+      the residues of the i-th chain are `[offsets[i]:offsets[i+1]]`
+    * `residue_number`/`author_residue_number` as int32, `author_insertion_code` as uint8 and `observed_ratio` as float16
+    * pdb ids and chain ids are dictionary-encoded, a chain is keyed by
+      `pdb_code << (ENTITY_BITS+CHAIN_BITS) | entity_id << CHAIN_BITS | chain_code`
+    * the arrays are saved as `.npy` files and memory-mapped when loaded,
+      so that slicing a chain would not copy the data
+    '''
+
+    arrays: Tuple = (
+        'pdb_ids', 'chain_ids', 'keys', 'offsets', 'residue_number',
+        'author_residue_number', 'author_insertion_code', 'observed_ratio')
+    columns: Dict = {
+        'pdb_id': str,
+        'entity_id': int,
+        'chain_id': str,
+        'residue_number': int,
+        'author_residue_number': int,
+        'author_insertion_code': str,
+        'observed_ratio': float}
+    meta_file: str = 'source.json'
+
+    def __init__(self, folder: Union[str, Path], mmap_mode: Optional[str] = 'r'):
+        self.folder = Path(folder)
+        for name in self.arrays:
+            setattr(self, name, np.load(self.folder/f'{name}.npy', mmap_mode=mmap_mode))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f'ResidueStore<chains:{len(self)}, residues:{len(self.residue_number)}>'
+
+    @staticmethod
+    def source_stat(paths: Iterable) -> List:
+        stats = [os.stat(path) for path in paths]
+        return [[stat.st_size, stat.st_mtime_ns] for stat in stats]
+
+    @staticmethod
+    def folder_stat(paths: Iterable) -> Dict:
+        return dict((folder, os.stat(folder).st_mtime_ns) for folder in sorted(set(os.path.dirname(os.path.abspath(path)) for path in paths)))
+
+    @classmethod
+    def manifest(cls, paths: List) -> Dict:
+        return {'paths': [str(path) for path in paths], 'stat': cls.source_stat(paths), 'folders': cls.folder_stat(paths)}
+
+    @classmethod
+    def build(cls, paths: Iterable, folder: Union[str, Path], sep: str = '\t'):
+        '''
+        Build the store from the decoded `residue_listing` files
+        '''
+        paths = [path for path in paths if path is not None]
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        dfrm = read_frames(paths, sep, cls.columns, usecols=list(cls.columns))
+        pdb_ids, pdb_codes = np.unique(dfrm.pdb_id.to_numpy(str), return_inverse=True)
+        chain_ids, chain_codes = np.unique(dfrm.chain_id.to_numpy(str), return_inverse=True)
+        keys = (pdb_codes.ravel().astype(np.int64) << (ENTITY_BITS+CHAIN_BITS)) | (dfrm.entity_id.to_numpy(np.int64) << CHAIN_BITS) | chain_codes.ravel()
+        residue_number = dfrm.residue_number.to_numpy(np.int64)
+        order = np.lexsort((residue_number, keys))
+        keys = keys[order]
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        data = {
+            'pdb_ids': pdb_ids,
+            'chain_ids': chain_ids,
+            'keys': unique_keys,
+            'offsets': np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            'residue_number': residue_number[order].astype(np.int32),
+            'author_residue_number': dfrm.author_residue_number.to_numpy(np.int64)[order].astype(np.int32),
+            'author_insertion_code': encode_insertion_codes(dfrm.author_insertion_code)[order],
+            'observed_ratio': dfrm.observed_ratio.to_numpy(np.float64)[order].astype(np.float16)}
+        for name in cls.arrays:
+            np.save(folder/f'{name}.npy', data[name])
+        # write the meta file at last so that an interrupted build would be treated as stale
+        with (folder/cls.meta_file).open('w') as outFile:
+            json.dump(cls.manifest(paths), outFile)
+        return cls(folder)
+
+    @classmethod
+    def from_files(cls, paths: Iterable, folder: Union[str, Path], sep: str = '\t', verify: bool = False):
+        '''
+        Load the store in `folder`, (re)build it if it is missing or the files have changed
+
+        * the paths are checked against the manifest saved with the store and only their folders are stat-ed,
+          a file added to, removed from or replaced in a folder changes the folder's mtime
+        * a file rewritten in place keeps the folder's mtime, set `verify` to stat every file as well
+        '''
+        paths = [path for path in paths if path is not None]
+        try:
+            with (Path(folder)/cls.meta_file).open() as inFile:
+                meta = json.load(inFile)
+            if (meta['paths'] == [str(path) for path in paths]
+                    and meta['folders'] == cls.folder_stat(paths)
+                    and (not verify or meta['stat'] == cls.source_stat(paths))):
+                return cls(folder)
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            pass
+        return cls.build(paths, folder, sep)
+
+    def locate(self, pdb_id: str, entity_id: int, chain_id: str) -> int:
+        '''
+        Index of the chain, raise `KeyError` if it is not in the store
+        '''
+        pdb_code = np.searchsorted(self.pdb_ids, pdb_id)
+        chain_code = np.searchsorted(self.chain_ids, chain_id)
+        if pdb_code < len(self.pdb_ids) and self.pdb_ids[pdb_code] == pdb_id and chain_code < len(self.chain_ids) and self.chain_ids[chain_code] == chain_id:
+            key = (int(pdb_code) << (ENTITY_BITS+CHAIN_BITS)) | (int(entity_id) << CHAIN_BITS) | int(chain_code)
+            index = np.searchsorted(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                return int(index)
+        raise KeyError((pdb_id, entity_id, chain_id))
+
+    def chain(self, pdb_id: str, entity_id: int, chain_id: str) -> Dict[str, np.ndarray]:
+        '''
+        Residue arrays of a chain, as views of the memory-mapped arrays
+        '''
+        index = self.locate(pdb_id, entity_id, chain_id)
+        left, right = self.offsets[index], self.offsets[index+1]
+        return dict((name, getattr(self, name)[left:right]) for name in (
+            'residue_number', 'author_residue_number', 'author_insertion_code', 'observed_ratio'))
+
+    def chain_frame(self, pdb_id: str, entity_id: int, chain_id: str) -> pd.DataFrame:
+        dfrm = pd.DataFrame(self.chain(pdb_id, entity_id, chain_id))
+        dfrm['author_insertion_code'] = decode_insertion_codes(dfrm.author_insertion_code)
+        return dfrm
+
+    def chain_keys(self) -> pd.DataFrame:
+        '''
+        (pdb_id, entity_id, chain_id) of the chains in the order of the store
+        '''
+        keys = np.asarray(self.keys)
+        return pd.DataFrame({
+            'pdb_id': self.pdb_ids[keys >> (ENTITY_BITS+CHAIN_BITS)],
+            'entity_id': (keys >> CHAIN_BITS) & ((1 << ENTITY_BITS) - 1),
+            'chain_id': self.chain_ids[keys & ((1 << CHAIN_BITS) - 1)]})
@@ -0,0 +1,643 @@
+# @Created Date: 2020-04-12 03:21:08 pm
+# @Filename: ranges.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-12 03:21:12 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import numpy as np
+import pandas as pd
+from itertools import chain
+from typing import Union, Optional, Iterable, Dict, List, Tuple
+from pandas.api.extensions import (
+    ExtensionArray, ExtensionDtype, register_extension_dtype, register_series_accessor)
+
+_BRACKETS = str.maketrans('[](),', '     ')
+
+INDE_COLUMNS: Tuple = (
+    'pdb_gap_list', 'unp_gap_list', 'var_list', 'delete', 'var_0_count',
+    'unp_gap_0_count', 'group_info', 'unp_pdb_var', 'range_tag')
+
+
+def ragged_to_json(offsets: np.ndarray, values: np.ndarray, separator: str = ',') -> List:
+    '''
+    Serialize ragged scalar values into JSON list strings, e.g. `[0,-2]`
+    '''
+    values = np.asarray(values).astype(str).tolist()
+    offsets = np.asarray(offsets).tolist()
+    return [f'[{separator.join(values[left:right])}]' for left, right in zip(offsets[:-1], offsets[1:])]
+
+
+class IntervalSet(object):
+    '''
+    Set of integers stored as sorted, disjoint and non-adjacent closed intervals `[starts[i], ends[i]]`
+
+    * union (`|`), intersection (`&`), difference (`-`) and `len` run in O(segments)
+      instead of expanding every range into a Python `set`
+    * accept the JSON range strings like `[[1, 10], [15, 20]]`, lists of pairs and sets of integers
+    '''
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, starts: Iterable = (), ends: Iterable = (), normalized: bool = False):
+        starts = np.asarray(starts, dtype=np.int64).ravel()
+        ends = np.asarray(ends, dtype=np.int64).ravel()
+        if not normalized and len(starts):
+            order = np.lexsort((ends, starts))
+            starts, ends = starts[order], ends[order]
+            reach = np.maximum.accumulate(ends)
+            # a new interval begins where the start goes beyond the reach of the previous ones
+            begin = np.flatnonzero(np.concatenate(([True], starts[1:] > reach[:-1] + 1)))
+            starts, ends = starts[begin], np.maximum.reduceat(ends, begin)
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_points(cls, points: Iterable):
+        points = np.unique(np.fromiter((int(i) for i in points), dtype=np.int64))
+        if not len(points):
+            return cls()
+        begin = np.flatnonzero(np.diff(points, prepend=points[0] - 2) != 1)
+        end = np.concatenate((begin[1:], [len(points)])) - 1
+        return cls(points[begin], points[end], normalized=True)
+
+    @classmethod
+    def from_ranges(cls, value):
+        '''
+        Build from a JSON range string, an iterable of `(start, end)`, a set of integers or another `IntervalSet`;
+        null values are treated as empty sets
+        '''
+        if isinstance(value, cls):
+            return value
+        elif isinstance(value, str):
+            flat = np.array(value.translate(_BRACKETS).split(), dtype=np.int64)
+            return cls(flat[0::2], flat[1::2])
+        elif isinstance(value, (set, frozenset)):
+            return cls.from_points(value)
+        elif value is None or isinstance(value, float):
+            return cls()
+        pairs = [tuple(pair) for pair in value]
+        return cls([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+
+    def __len__(self):
+        return int((self.ends - self.starts + 1).sum())
+
+    def __bool__(self):
+        return len(self.starts) > 0
+
+    def __iter__(self):
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield from range(start, end+1)
+
+    def __contains__(self, point):
+        index = np.searchsorted(self.starts, point, 'right') - 1
+        return bool(index >= 0 and self.ends[index] >= point)
+
+    def __eq__(self, other):
+        other = self.from_ranges(other)
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.ends, other.ends)
+
+    def __repr__(self):
+        return f'IntervalSet{self.to_list()}'
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __le__(self, other):
+        return self.issubset(other)
+
+    def union(self, other):
+        other = self.from_ranges(other)
+        return self.__class__(np.concatenate((self.starts, other.starts)), np.concatenate((self.ends, other.ends)))
+
+    def intersection(self, other):
+        other = self.from_ranges(other)
+        # the intervals of `other` that overlap each interval of `self`
+        lo = np.searchsorted(other.ends, self.starts, 'left')
+        hi = np.searchsorted(other.starts, self.ends, 'right')
+        counts = np.maximum(hi - lo, 0)
+        left = np.repeat(np.arange(len(self.starts)), counts)
+        right = np.arange(counts.sum()) + np.repeat(lo - np.concatenate(([0], np.cumsum(counts)[:-1])), counts)
+        return self.__class__(
+            np.maximum(self.starts[left], other.starts[right]),
+            np.minimum(self.ends[left], other.ends[right]),
+            normalized=True)
+
+    def complement(self, lower: int, upper: int):
+        '''
+        The integers within `[lower, upper]` that are not in the set
+        '''
+        starts = np.concatenate(([lower], self.ends + 1))
+        ends = np.concatenate((self.starts - 1, [upper]))
+        starts, ends = np.maximum(starts, lower), np.minimum(ends, upper)
+        keep = starts <= ends
+        return self.__class__(starts[keep], ends[keep], normalized=True)
+
+    def difference(self, other):
+        other = self.from_ranges(other)
+        if not self or not other:
+            return self
+        return self.intersection(other.complement(self.starts[0], self.ends[-1]))
+
+    def issubset(self, other) -> bool:
+        return not self.difference(other)
+
+    def to_list(self) -> List:
+        return [[start, end] for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+
+    def to_tuples(self) -> List:
+        return list(zip(self.starts.tolist(), self.ends.tolist()))
+
+    def to_json(self, separator: str = ', ') -> str:
+        return '[{}]'.format(separator.join(f'[{start}{separator}{end}]' for start, end in zip(self.starts.tolist(), self.ends.tolist())))
+
+
+class RaggedRanges(object):
+    '''
+    Ragged lists of ranges stored as flat arrays
+
+    * the ranges of the i-th row are `starts[offsets[i]:offsets[i+1]]` and `ends[offsets[i]:offsets[i+1]]`
+    * equivalent to a column of JSON strings like `[[1, 10], [15, 20]]`, without parsing per row
+    '''
+
+    def __init__(self, offsets: Iterable, starts: Iterable, ends: Iterable):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return f'RaggedRanges<rows:{len(self)}, segments:{len(self.starts)}>'
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def rows(self) -> np.ndarray:
+        '''
+        Row index of each segment
+        '''
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    @classmethod
+    def from_json(cls, values: Iterable):
+        '''
+        Parse a column of JSON range strings in one pass, null values are treated as empty rows
+        '''
+        texts = ['[]' if not isinstance(value, str) else value for value in values]
+        counts = np.fromiter((text.count('[') - 1 for text in texts), dtype=np.int64, count=len(texts))
+        flat = np.array(' '.join(texts).translate(_BRACKETS).split(), dtype=np.int64)
+        if len(flat) != 2*counts.sum():
+            raise ValueError('Each range should be a pair of [start, end]')
+        return cls(np.concatenate(([0], np.cumsum(counts))), flat[0::2], flat[1::2])
+
+    @classmethod
+    def from_lists(cls, values: Iterable):
+        '''
+        Collect rows of `[[start, end], ...]`, null values are treated as empty rows
+        '''
+        values = [value if isinstance(value, (List, Tuple)) else () for value in values]
+        counts = np.fromiter((len(value) for value in values), dtype=np.int64, count=len(values))
+        flat = np.fromiter(chain.from_iterable(chain.from_iterable(values)), dtype=np.int64, count=2*counts.sum())
+        return cls(np.concatenate(([0], np.cumsum(counts))), flat[0::2], flat[1::2])
+
+    @classmethod
+    def from_groups(cls, codes: Iterable, starts: Iterable, ends: Iterable, size: Optional[int] = None):
+        '''
+        Collect segments into rows by their (non-negative) group codes, keeping the original order within a group
+        '''
+        codes = np.asarray(codes, dtype=np.int64)
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=0 if size is None else size)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(offsets, np.asarray(starts)[order], np.asarray(ends)[order])
+
+    @classmethod
+    def from_points(cls, rows: Iterable, points: Iterable, size: Optional[int] = None):
+        '''
+        Collect the points of each row into runs of consecutive integers, e.g. `1,2,3,5` -> `[[1,3],[5,5]]`
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        points = np.asarray(points, dtype=np.int64)
+        size = (rows.max() + 1 if len(rows) else 0) if size is None else size
+        order = np.lexsort((points, rows))
+        rows, points = rows[order], points[order]
+        keep = np.concatenate(([True], (rows[1:] != rows[:-1]) | (points[1:] != points[:-1])))
+        rows, points = rows[keep], points[keep]
+        begin = np.flatnonzero(np.concatenate(([True], (rows[1:] != rows[:-1]) | (points[1:] != points[:-1] + 1))))
+        end = np.concatenate((begin[1:], [len(points)])) - 1
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(rows[begin], minlength=size))))
+        return cls(offsets, points[begin], points[end])
+
+    def take(self, index: Iterable):
+        '''
+        Rows `index` of the ranges, without a Python loop
+        '''
+        index = np.asarray(index, dtype=np.int64)
+        starts = self.offsets[index]
+        counts = self.offsets[index+1] - starts
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        segments = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], counts)
+        return self.__class__(offsets, self.starts[segments], self.ends[segments])
+
+    def reorder(self, order: np.ndarray):
+        '''
+        Rearrange the segments by `order` (which should not move segments across rows)
+        '''
+        return self.__class__(self.offsets, self.starts[order], self.ends[order])
+
+    def to_lists(self) -> List:
+        segments = [[start, end] for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+        offsets = self.offsets.tolist()
+        return [segments[left:right] for left, right in zip(offsets[:-1], offsets[1:])]
+
+    def to_json(self, separator: str = ',') -> List:
+        '''
+        Serialize each row into the same JSON string as `json.dumps(lyst)`,
+        set `separator` to `', '` for the output of the standard `json` module
+        '''
+        segments = [f'[{start}{separator}{end}]' for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+        offsets = self.offsets.tolist()
+        return [f"[{separator.join(segments[left:right])}]" for left, right in zip(offsets[:-1], offsets[1:])]
+
+
+def _shift(ranges: RaggedRanges, base: int, stride: int) -> IntervalSet:
+    shift = ranges.rows*stride - base
+    return IntervalSet(ranges.starts + shift, ranges.ends + shift)
+
+
+def _unshift(res: IntervalSet, base: int, stride: int, size: int) -> RaggedRanges:
+    rows = res.starts // stride
+    shift = rows*stride - base
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=size))))
+    return RaggedRanges(offsets, res.starts - shift, res.ends - shift)
+
+
+def ragged_operation(left: RaggedRanges, right: RaggedRanges, operation: str) -> RaggedRanges:
+    '''
+    Apply `union`, `intersection` or `difference` of `IntervalSet` to every pair of rows in one pass
+
+    The rows are moved apart by a stride larger than the span of all the ranges,
+    so that the operation over the whole flat arrays never mixes segments of different rows
+    '''
+    if len(left) != len(right):
+        raise ValueError(f'Unmatched number of rows: {len(left)} != {len(right)}')
+    size = len(left)
+    values = np.concatenate((left.starts, left.ends, right.starts, right.ends))
+    if not len(values):
+        return RaggedRanges(np.zeros(size+1, dtype=np.int64), [], [])
+    base = int(values.min())
+    stride = int(values.max()) - base + 3
+    res = getattr(_shift(left, base, stride), operation)(_shift(right, base, stride))
+    return _unshift(res, base, stride, size)
+
+
+def ragged_union(left: RaggedRanges, right: RaggedRanges) -> RaggedRanges:
+    return ragged_operation(left, right, 'union')
+
+
+def ragged_intersection(left: RaggedRanges, right: RaggedRanges) -> RaggedRanges:
+    return ragged_operation(left, right, 'intersection')
+
+
+def ragged_difference(left: RaggedRanges, right: RaggedRanges) -> RaggedRanges:
+    return ragged_operation(left, right, 'difference')
+
+
+def ragged_lengths(ranges: RaggedRanges) -> np.ndarray:
+    '''
+    Number of integers covered by each row, overlapping segments are counted once
+    '''
+    ranges = ragged_union(ranges, RaggedRanges(np.zeros(len(ranges)+1, dtype=np.int64), [], []))
+    return np.bincount(ranges.rows, ranges.ends - ranges.starts + 1, minlength=len(ranges)).astype(np.int64)
+
+
+@register_extension_dtype
+class RangesDtype(ExtensionDtype):
+    '''
+    Dtype of `RangesArray`, use `'ranges'` in `astype` or the `dtype` of `read_csv`
+    '''
+
+    name: str = 'ranges'
+    type = tuple
+    kind: str = 'O'
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls):
+        return RangesArray
+
+    def __from_arrow__(self, array):
+        '''
+        Convert an Arrow `list<struct<start, end>>` (chunked) array, requires `pyarrow`
+        '''
+        arrays = [RangesArray(RaggedRanges([0], [], []))]
+        for chunk in (array.chunks if hasattr(array, 'chunks') else [array]):
+            offsets = chunk.offsets.to_numpy().astype(np.int64)
+            values = chunk.values.slice(offsets[0], offsets[-1] - offsets[0])
+            arrays.append(RangesArray(*_empty_rows(
+                RaggedRanges(
+                    offsets - offsets[0],
+                    values.field('start').to_numpy(zero_copy_only=False),
+                    values.field('end').to_numpy(zero_copy_only=False)),
+                chunk.is_null().to_numpy(zero_copy_only=False))))
+        return RangesArray._concat_same_type(arrays)
+
+
+def _empty_rows(data: RaggedRanges, mask: np.ndarray) -> Tuple[RaggedRanges, np.ndarray]:
+    '''
+    Drop the segments of the null rows, so that a null element always holds an empty row
+    '''
+    keep = ~np.repeat(mask, data.counts)
+    counts = np.where(mask, 0, data.counts)
+    return RaggedRanges(np.concatenate(([0], np.cumsum(counts))), data.starts[keep], data.ends[keep]), mask
+
+
+def _is_ranges_scalar(value) -> bool:
+    '''
+    Whether `value` is a single element (null, JSON string or list of `[start, end]`) rather than an array of elements
+    '''
+    if pd.api.types.is_scalar(value):
+        return True
+    return isinstance(value, (List, Tuple)) and all(
+        isinstance(segment, (List, Tuple)) and len(segment) == 2 and all(pd.api.types.is_integer(pos) for pos in segment)
+        for segment in value)
+
+
+class RangesArray(ExtensionArray):
+    '''
+    Pandas extension array of range lists backed by a `RaggedRanges`
+
+    * an element is a tuple of `(start, end)` tuples, a null element is `nan` (an empty row in `data`)
+    * the string form of an element (`astype(str)`, `np.asarray`, `to_csv`) is the JSON string, e.g. `[[1,10],[15,20]]`,
+      so that the column round-trips through TSV (`read_csv(..., dtype={col: 'ranges'})`)
+    * converted to an Arrow `list<struct<start: int64, end: int64>>` for Parquet if `pyarrow` is installed
+    '''
+
+    def __init__(self, data: RaggedRanges, mask: Optional[np.ndarray] = None):
+        self.data = data
+        self.mask = np.zeros(len(data), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+    @property
+    def dtype(self) -> RangesDtype:
+        return RangesDtype()
+
+    @classmethod
+    def _from_sequence(cls, scalars, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        scalars = [None if isinstance(value, str) and not value else value for value in scalars]
+        mask = np.fromiter((not isinstance(value, (str, List, Tuple)) for value in scalars), dtype=bool, count=len(scalars))
+        if all(isinstance(value, str) for value, null in zip(scalars, mask) if not null):
+            return cls(RaggedRanges.from_json(scalars), mask)
+        return cls(RaggedRanges.from_lists([
+            RaggedRanges.from_json([value]).to_lists()[0] if isinstance(value, str) else value for value in scalars]), mask)
+
+    @classmethod
+    def _from_sequence_of_strings(cls, strings, dtype=None, copy=False):
+        strings = [value if isinstance(value, str) and value else None for value in strings]
+        return cls(RaggedRanges.from_json(strings), np.fromiter((value is None for value in strings), dtype=bool, count=len(strings)))
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls._from_sequence(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        to_concat = list(to_concat)
+        offsets = [to_concat[0].data.offsets[:1]]
+        shift = 0
+        for array in to_concat:
+            offsets.append(array.data.offsets[1:] + shift)
+            shift += array.data.offsets[-1]
+        return cls(RaggedRanges(
+            np.concatenate(offsets),
+            np.concatenate([array.data.starts for array in to_concat]),
+            np.concatenate([array.data.ends for array in to_concat])),
+            np.concatenate([array.mask for array in to_concat]))
+
+    def __len__(self):
+        return len(self.mask)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            item = item + len(self) if item < 0 else item
+            if self.mask[item]:
+                return np.nan
+            left, right = self.data.offsets[item], self.data.offsets[item+1]
+            return tuple(zip(self.data.starts[left:right].tolist(), self.data.ends[left:right].tolist()))
+        index = np.arange(len(self))[pd.api.indexers.check_array_indexer(self, item) if not isinstance(item, slice) else item]
+        return self.__class__(self.data.take(index), self.mask[index])
+
+    def __setitem__(self, key, value):
+        '''
+        Set a scalar (JSON string, list of `[start, end]` or null) or an array-like of them,
+        the values are validated by converting them to a `RangesArray`
+        '''
+        if isinstance(key, (int, np.integer)):
+            index = np.array([key + len(self) if key < 0 else key])
+            if not 0 <= index[0] < len(self):
+                raise IndexError(f'index {key} is out of bounds for size {len(self)}')
+        else:
+            key = pd.api.indexers.check_array_indexer(self, key) if not isinstance(key, slice) else key
+            index = np.arange(len(self))[key]
+        scalar = _is_ranges_scalar(value)
+        try:
+            values = self._from_sequence([value] if scalar else value)
+        except (TypeError, ValueError) as error:
+            raise ValueError(f'Invalid value for a ranges column: {value!r}') from error
+        if not scalar and len(values) != len(index):
+            raise ValueError(f'Length of values ({len(values)}) does not match length of indexer ({len(index)})')
+        take = np.arange(len(self))
+        take[index] = len(self) + (0 if scalar else np.arange(len(index)))
+        res = self._concat_same_type([self, values]).take(take)
+        self.data, self.mask = res.data, res.mask
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.astype(object)
+
+    def __eq__(self, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        if not isinstance(other, RangesArray):
+            other = RangesArray._from_sequence([other]*len(self) if isinstance(other, (str, Tuple)) else other)
+        return (np.asarray(self.to_json(), dtype=object) == np.asarray(other.to_json(), dtype=object)) & ~self.mask & ~other.mask
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.offsets.nbytes + self.data.starts.nbytes + self.data.ends.nbytes + self.mask.nbytes
+
+    def isna(self) -> np.ndarray:
+        return self.mask.copy()
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        indices = np.asarray(indices, dtype=np.int64)
+        if allow_fill:
+            if (indices < -1).any():
+                raise ValueError('Invalid indices for take with allow_fill')
+            if fill_value is not None and not pd.isna(fill_value):
+                raise ValueError('Only null could be the fill_value of RangesArray')
+            fill = indices == -1
+            if not len(self):
+                return self.__class__(RaggedRanges(np.zeros(len(indices)+1, dtype=np.int64), [], []), fill)
+            indices = np.where(fill, 0, indices)
+            return self.__class__(*_empty_rows(self.data.take(indices), self.mask[indices] | fill))
+        indices = np.where(indices < 0, indices + len(self), indices)
+        return self.__class__(self.data.take(indices), self.mask[indices])
+
+    def copy(self):
+        return self.__class__(RaggedRanges(self.data.offsets.copy(), self.data.starts.copy(), self.data.ends.copy()), self.mask.copy())
+
+    def to_json(self, separator: str = ',') -> List:
+        return [np.nan if null else text for text, null in zip(self.data.to_json(separator), self.mask.tolist())]
+
+    def astype(self, dtype, copy=True):
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if isinstance(dtype, RangesDtype):
+            return self.copy() if copy else self
+        if pd.api.types.is_string_dtype(dtype) and not pd.api.types.is_object_dtype(dtype):
+            return pd.array(self.to_json(), dtype=dtype)
+        if pd.api.types.is_object_dtype(dtype):
+            return np.array(self.to_json(), dtype=object)
+        raise TypeError(f'Cannot convert RangesArray to {dtype}')
+
+    def _formatter(self, boxed=False):
+        return lambda value: '[{}]'.format(','.join(f'[{start},{end}]' for start, end in value)) if isinstance(value, tuple) else str(value)
+
+    def _values_for_factorize(self):
+        return np.array(self.to_json(), dtype=object), np.nan
+
+    def __arrow_array__(self, type=None):
+        import pyarrow as pa
+        values = pa.StructArray.from_arrays([pa.array(self.data.starts), pa.array(self.data.ends)], ['start', 'end'])
+        offsets = pa.array(self.data.offsets.astype(np.int32), mask=np.append(self.mask, False))
+        return pa.ListArray.from_arrays(offsets, values)
+
+
+@register_series_accessor('ranges')
+class RangesAccessor(object):
+    '''
+    Vectorized operations on a column of range lists,
+    either a `ranges` column or a column of JSON strings (parsed once)
+    '''
+
+    def __init__(self, series: pd.Series):
+        self._series = series
+        values = series.array
+        self._values = values if isinstance(values, RangesArray) else RangesArray._from_sequence(values)
+
+    @property
+    def data(self) -> RaggedRanges:
+        return self._values.data
+
+    def _wrap(self, values: np.ndarray) -> pd.Series:
+        return pd.Series(values, index=self._series.index, name=self._series.name)
+
+    def count(self) -> pd.Series:
+        '''
+        Number of segments of each row
+        '''
+        return self._wrap(self.data.counts)
+
+    def length(self) -> pd.Series:
+        '''
+        Number of residues covered by each row, overlapping segments are counted once
+        '''
+        return self._wrap(ragged_lengths(self.data))
+
+    def contains(self, pos: Union[int, Iterable]) -> pd.Series:
+        '''
+        Whether each row covers `pos` (a scalar or a position per row)
+        '''
+        pos = np.broadcast_to(np.asarray(pos, dtype=np.int64), (len(self._series),))
+        rows = self.data.rows
+        hit = (self.data.starts <= pos[rows]) & (self.data.ends >= pos[rows])
+        return self._wrap(np.bincount(rows, hit, minlength=len(self._series)) > 0)
+
+    def to_json(self, separator: str = ',') -> pd.Series:
+        return self._wrap(self._values.to_json(separator))
+
+
+def aggregate_segments(dfrm: pd.DataFrame, group_cols: List, range_cols: Dict[str, Tuple[str, str]]) -> pd.DataFrame:
+    '''
+    Collect the segments of each group into JSON range strings in one pass
+
+    :param group_cols: columns that identify a group, e.g. `['pdb_id', 'chain_id', 'UniProt']`
+    :param range_cols: `{new_col: (start_col, end_col)}`, the start/end columns would be dropped
+
+    Other columns keep the value of the last row of each group and
+    the groups are ordered by their last rows, the same as `drop_duplicates(keep='last')`
+    '''
+    dfrm = dfrm.reset_index(drop=True)
+    codes = dfrm.groupby(group_cols, sort=False).ngroup().to_numpy()
+    size = codes.max() + 1 if len(codes) else 0
+    last = np.full(size, -1, dtype=np.int64)
+    last[codes] = np.arange(len(codes))
+    order = np.sort(last)
+    res = dfrm.iloc[order].reset_index(drop=True)
+    rank = np.empty(size, dtype=np.int64)
+    rank[codes[order]] = np.arange(size)
+    drop_cols = []
+    for new_col, (start_col, end_col) in range_cols.items():
+        ranges = RaggedRanges.from_groups(
+            rank[codes], dfrm[start_col].to_numpy(np.int64), dfrm[end_col].to_numpy(np.int64), size)
+        res[new_col] = ranges.to_json()
+        drop_cols.extend((start_col, end_col))
+    return res.drop(columns=drop_cols)
+
+
+def classify_segments(pdb_ranges: RaggedRanges, unp_ranges: RaggedRanges, index: Optional[Iterable] = None, separator: str = ',') -> pd.DataFrame:
+    '''
+    Tag the aligned segments of each row as `Safe`, `Deletion`, `Insertion` or `Insertion & Deletion`
+
+    Both ranges should have the same number of segments in each row. Return a `DataFrame` with `INDE_COLUMNS`:
+
+    * `pdb_gap_list`/`unp_gap_list`: JSON list of the gaps between adjacent segments
+    * `var_list`: JSON list of the length difference (unp - pdb) of each segment
+    * `delete`: whether any length difference or unp gap is negative
+    * `var_0_count`/`unp_gap_0_count`: count of zero in `var_list`/`unp_gap_list`
+    * `group_info`: number of segments
+    * `unp_pdb_var`: length difference of the first segment (0 for a row without segment)
+    * `range_tag`: `nan` for a row without segment
+    '''
+    group_info = pdb_ranges.counts
+    size = len(group_info)
+    rows = pdb_ranges.rows
+    var = (unp_ranges.ends - unp_ranges.starts) - (pdb_ranges.ends - pdb_ranges.starts)
+    # segments after the first one of each row
+    gap_index = np.flatnonzero(np.diff(rows, prepend=-1) == 0)
+    gap_rows = rows[gap_index]
+    gap_offsets = np.concatenate(([0], np.cumsum(np.maximum(group_info - 1, 0))))
+    pdb_gap = pdb_ranges.starts[gap_index] - pdb_ranges.ends[gap_index - 1] - 1
+    unp_gap = unp_ranges.starts[gap_index] - unp_ranges.ends[gap_index - 1] - 1
+
+    var_0_count = np.bincount(rows, var == 0, minlength=size).astype(np.int64)
+    unp_gap_0_count = np.bincount(gap_rows, unp_gap == 0, minlength=size).astype(np.int64)
+    delete = (np.bincount(rows, var < 0, minlength=size) + np.bincount(gap_rows, unp_gap < 0, minlength=size)) > 0
+    unp_pdb_var = np.zeros(size, dtype=np.int64)
+    has_segment = group_info > 0
+    unp_pdb_var[has_segment] = var[pdb_ranges.offsets[:-1][has_segment]]
+    single = group_info == 1
+    insertion = (var_0_count == group_info) & (unp_gap_0_count == (group_info - 1))
+    range_tag = np.select(
+        [single & (unp_pdb_var > 0), ~single & insertion, ~single & ~insertion],
+        ['Deletion', 'Insertion', 'Insertion & Deletion'],
+        'Safe').astype(object)
+    range_tag[~has_segment] = np.nan
+    return pd.DataFrame(dict(zip(INDE_COLUMNS, (
+        ragged_to_json(gap_offsets, pdb_gap, separator),
+        ragged_to_json(gap_offsets, unp_gap, separator),
+        ragged_to_json(pdb_ranges.offsets, var, separator),
+        delete, var_0_count, unp_gap_0_count, group_info, unp_pdb_var, range_tag))), index=index)
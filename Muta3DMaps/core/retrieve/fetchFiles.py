@@ -57,6 +57,7 @@ class UnsyncFetch(Abclog):
         # 'after': after_log(logger, logging.WARNING)
         }
     use_existing: bool = False
+    retry_wrapped: bool = False
 
     @classmethod
     async def http_download(cls, method: str, info: Dict, path: str):
@@ -126,20 +127,41 @@ class UnsyncFetch(Abclog):
             cls.logger.error(f"Retry failed for: {info}")
 
     @classmethod
+    def init_retry(cls):
+        '''
+        Wrap the download functions with `tenacity.retry`, only once for the class
+        '''
+        if cls.retry_wrapped:
+            return
+        cls.retry_kwargs['after'] = after_log(cls.logger, logging.WARNING)
+        cls.http_download = retry(cls.http_download, **cls.retry_kwargs)
+        cls.ftp_download = retry(cls.ftp_download, **cls.retry_kwargs)
+        cls.retry_wrapped = True
+
+    @staticmethod
     @unsync
-    async def multi_tasks(cls, tasks: Union[Iterable, Iterator], to_do_func: Optional[Callable] = None, concur_req: int = 4, rate: float = 1.5, logger: Optional[logging.Logger] = None):
+    async def init_semaphore(concur_req: int) -> asyncio.Semaphore:
+        '''
+        Semaphore created in the event loop of `unsync`, to be shared by several calls of `multi_tasks`
+        '''
+        return asyncio.Semaphore(concur_req)
+
+    @classmethod
+    @unsync
+    async def multi_tasks(cls, tasks: Union[Iterable, Iterator], to_do_func: Optional[Callable] = None, concur_req: int = 4, rate: float = 1.5, logger: Optional[logging.Logger] = None, semaphore: Optional[asyncio.Semaphore] = None):
         '''
         Template for multiTasking
 
+        * `semaphore`: a semaphore shared with other calls (see `init_semaphore`),
+          otherwise a new one of `concur_req` is used for the tasks
+
         TODO
-            1. asyncio.Semaphore
-            2. unit func
+            1. unit func
         '''
         cls.init_logger('UnsyncFetch', logger)
-        cls.retry_kwargs['after'] = after_log(cls.logger, logging.WARNING)
-        cls.http_download = retry(cls.http_download, **cls.retry_kwargs)
-        cls.ftp_download = retry(cls.ftp_download, **cls.retry_kwargs)
-        semaphore = asyncio.Semaphore(concur_req)
+        cls.init_retry()
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(concur_req)
         if to_do_func is None:
             tasks = [cls.fetch_file(semaphore, method, info, path, rate) for method, info, path in tasks]
         else:
@@ -7,9 +7,12 @@
 import os
 import gzip
 import shutil
-from typing import Optional, Union, Dict, Tuple, Iterable
+from typing import Optional, Union, Dict, Tuple, Iterable, Iterator
 from logging import Logger
-from pandas import read_csv, DataFrame
+from concurrent.futures import ThreadPoolExecutor
+from pandas import read_csv, concat, DataFrame
+# the strings pandas reads as missing values by default
+from pandas._libs.parsers import STR_NA_VALUES
 from pathlib import Path
 
 
@@ -66,3 +69,32 @@ def related_dataframe(filters: Optional[Union[Dict, Iterable[Tuple]]] = None, df
     for col, (symbol, value) in filters:
         dfrm = dfrm[getattr(getattr(dfrm, col), symbol)(value)]
     return dfrm
+
+
+def read_frames(paths: Iterable, sep: str = '\t', dtype: Optional[Dict] = None, workers: int = 4, iterator: bool = False, **kwargs) -> Union[DataFrame, Iterator[DataFrame], None]:
+    '''
+    Read a list of delimited files in parallel with declared `dtype` instead of per-cell `converters`
+
+    * `None` in `paths` would be skipped
+    * the `str` columns of `dtype` have no missing values (empty fields are read as `''` and `'NA'` is kept),
+      the same as reading them with `converters` of `str`; the other columns keep pandas' default missing values
+    * return the frames joined by one `concat` (`None` if there is no file),
+      or an iterator of the frames in the order of `paths` if `iterator` is `True`
+    '''
+    paths = [path for path in paths if path is not None]
+    dtype = dict() if dtype is None else dtype
+    str_cols = set(col for col, col_type in dtype.items() if col_type is str)
+
+    def read(path):
+        columns = read_csv(path, sep=sep, nrows=0, **kwargs).columns
+        na_values = dict((col, STR_NA_VALUES) for col in columns if col not in str_cols)
+        return read_csv(path, sep=sep, dtype=dtype, keep_default_na=False, na_values=na_values, **kwargs)
+
+    def yieldFrames():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(read, paths)
+
+    if iterator:
+        return yieldFrames()
+    elif paths:
+        return concat(yieldFrames(), sort=False, ignore_index=True)
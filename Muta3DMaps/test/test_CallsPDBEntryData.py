@@ -0,0 +1,137 @@
+# @Created Date: 2020-04-18 02:30:11 pm
+# @Filename: test_CallsPDBEntryData.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-18 02:30:15 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import os
+import shutil
+import asyncio
+import pandas as pd
+from Muta3DMaps.core.AsyncV import CallsPDBEntryData
+from Muta3DMaps.core.AsyncV.CallsPDBEntryData import API_LYST, BASE_URL, RetrieveEntryData
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def fake_retrieve(calls):
+    async def retrieve(session, url, pdbNode):
+        token = url[len(BASE_URL):-5]
+        calls.append((pdbNode.id, token))
+        pdbNode.api_status[token] = 1
+        return b'{}'
+    return retrieve
+
+
+def test_refresh(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(RetrieveEntryData, 'retrieve', staticmethod(fake_retrieve(calls)))
+    demo = RetrieveEntryData(['1a01', '1a02', '1a03'], workdir=str(tmp_path), overviewFileName='overview.tsv')
+    demo.main(4)
+    assert len(calls) == 3*len(API_LYST)
+    with open(demo.overview) as inFile:
+        assert sorted(line.split('\t')[0] for line in inFile) == ['1a01', '1a02', '1a03']
+    calls.clear()
+    demo.refresh(['1a02'], ['1a03'], 4)
+    assert sorted(calls) == sorted(('1a02', api) for api in API_LYST)
+    assert not any(os.path.exists(tmp_path/f'1a03_{api}.json') for api in API_LYST)
+    assert all(os.path.exists(tmp_path/f'{pdb}_{api}.json') for pdb in ('1a01', '1a02') for api in API_LYST)
+    with open(demo.overview) as inFile:
+        assert sorted(line.split('\t')[0] for line in inFile) == ['1a01', '1a02']
+
+
+def test_toFrameAll(tmp_path):
+    pdbs = ('1a01', '2xyn', '3g96', '6lu7')
+    for pdb in pdbs:
+        for api in ('molecules', 'residue_listing'):
+            shutil.copy(os.path.join(DATA, f'{pdb}_{api}.json'), tmp_path/f'{pdb}_{api}.json')
+    # parts left over from an earlier run
+    os.makedirs(tmp_path/'residue_listing')
+    (tmp_path/'residue_listing'/'part-9.tsv').write_text('stale\n')
+    demo = RetrieveEntryData(list(pdbs), workdir=str(tmp_path), overviewFileName='overview.tsv')
+    parts = demo.toFrameAll(shard_bytes=1, max_workers=2)
+    assert sorted(os.listdir(tmp_path/'residue_listing')) == [f'part-{i}.tsv' for i in range(len(pdbs))]
+    assert sorted(parts['residue_listing']) == [str(tmp_path/'residue_listing'/f'part-{i}.tsv') for i in range(len(pdbs))]
+    assert parts['summary'] == []
+    for api in ('molecules', 'residue_listing'):
+        res = demo.readFrame(api)
+        demo.toFrame(api)
+        expected = pd.read_csv(tmp_path/f'{api}.tsv', sep='\t')
+        key = ['pdb_id'] + [col for col in ('entity_id', 'chain_id', 'residue_number') if col in expected.columns]
+        pd.testing.assert_frame_equal(
+            res[expected.columns].sort_values(key).reset_index(drop=True),
+            expected.sort_values(key).reset_index(drop=True), check_dtype=False)
+    # the single table of `toFrame` is read when there is no part
+    assert len(demo.readFrame('molecules')) == len(pd.read_csv(tmp_path/'molecules.tsv', sep='\t'))
+    shutil.rmtree(tmp_path/'molecules')
+    assert demo.readFrame('molecules').equals(pd.read_csv(tmp_path/'molecules.tsv', sep='\t'))
+    assert demo.readFrame('summary') is None
+
+
+def test_window(tmp_path, monkeypatch):
+    calls, state = [], {'alive': 0, 'max': 0}
+    retrieve = fake_retrieve(calls)
+
+    async def slow_retrieve(session, url, pdbNode):
+        state['alive'] += 1
+        state['max'] = max(state['max'], state['alive'])
+        await asyncio.sleep(0.001)
+        state['alive'] -= 1
+        return await retrieve(session, url, pdbNode)
+
+    monkeypatch.setattr(RetrieveEntryData, 'retrieve', staticmethod(slow_retrieve))
+    unit = RetrieveEntryData.unit
+
+    async def counted_unit(self, *args):
+        state['pending'] += 1
+        state['max_pending'] = max(state['max_pending'], state['pending'])
+        try:
+            return await unit(self, *args)
+        finally:
+            state['pending'] -= 1
+
+    monkeypatch.setattr(RetrieveEntryData, 'unit', counted_unit)
+    state.update(pending=0, max_pending=0)
+    pulled = []
+
+    def pdbs():
+        for i in range(20):
+            pulled.append(len(calls))
+            yield '%02dab' % i
+
+    opened = []
+    real_open = open
+
+    def spy_open(path, *args, **kwargs):
+        opened.append(str(path))
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(CallsPDBEntryData, 'open', spy_open, raising=False)
+    demo = RetrieveEntryData(pdbs(), workdir=str(tmp_path), overviewFileName='overview.tsv')
+    demo.main(concur_req=3, window=5)
+    assert len(calls) == 20*len(API_LYST)
+    assert 0 < state['max'] <= 3
+    # at most `window` tasks are pending at the same time
+    assert 3 < state['max_pending'] <= 5
+    # the nodes are taken lazily: a node is pulled only after the requests of the earlier ones have started to finish
+    assert pulled[-1] > 0
+    # one buffered writer for all the status rows
+    assert opened.count(demo.overview) == 1
+    with real_open(demo.overview) as inFile:
+        assert sorted(line.split('\t')[0] for line in inFile) == sorted('%02dab' % i for i in range(20))
+
+
+def test_resume(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(RetrieveEntryData, 'retrieve', staticmethod(fake_retrieve(calls)))
+    demo = RetrieveEntryData(['1a01'], workdir=str(tmp_path), overviewFileName='overview.tsv')
+    demo.main(4)
+    # an interrupted run: 1a02 has two endpoints saved but no status row
+    for api in API_LYST[:2]:
+        (tmp_path/f'1a02_{api}.json').write_text('{}')
+    calls.clear()
+    demo.pdbs = ['1a01', '1a02', '1a03']
+    demo.main(4, resume=True)
+    assert sorted(calls) == sorted([('1a02', api) for api in API_LYST[2:]] + [('1a03', api) for api in API_LYST])
+    with open(demo.overview) as inFile:
+        assert sorted(line.split('\t')[0] for line in inFile) == ['1a01', '1a02', '1a03']
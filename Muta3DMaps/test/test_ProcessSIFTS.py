@@ -0,0 +1,313 @@
+# @Created Date: 2020-04-19 10:21:33 am
+# @Filename: test_ProcessSIFTS.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-19 10:21:37 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import json
+import random
+import numpy as np
+import pandas as pd
+from Muta3DMaps.core.Utils.Tools import Gadget
+from Muta3DMaps.core.Mods.ProcessSIFTS import BestStructureIndex, ReverseMapper, SegmentMapper, deal_with_insertionDeletion_SIFTS, map_muta_from_unp_to_pdb, map_muta_table
+
+METHODS = ('X-RAY DIFFRACTION', 'SOLUTION NMR', 'ELECTRON MICROSCOPY', 'POWDER DIFFRACTION')
+
+
+def randomSIFTS(rng, count=30):
+    rows = []
+    for i in range(count):
+        unp_range, pdb_range, start, seqres = [], [], rng.randint(1, 10), 1
+        for _ in range(rng.randint(1, 3)):
+            length = rng.randint(1, 8)
+            unp_range.append([start, start + length - 1])
+            pdb_range.append([seqres, seqres + length - 1])
+            start += length + rng.randint(0, 4)
+            seqres += length + rng.randint(0, 2)
+        # the scheme may be shorter than the SEQRES of the ranges
+        scheme_len = seqres - 1 - rng.randint(0, 2)
+        auth = [str(num) if rng.random() > 0.3 else '?' for num in range(1, scheme_len + 1)]
+        rows.append({
+            'UniProt': rng.choice(('P00001', 'P00002', 'Q00003')),
+            'pdb_id': '%dabc' % i,
+            'chain_id': rng.choice('AB'),
+            'new_sifts_unp_range': json.dumps(unp_range),
+            'new_sifts_pdb_range': json.dumps(pdb_range),
+            '_pdbx_poly_seq_scheme.auth_seq_num': ';'.join(auth),
+            '_pdbx_poly_seq_scheme.pdb_seq_num': ';'.join(str(num - 5) for num in range(1, scheme_len + 1)),
+            '_pdbx_poly_seq_scheme.pdb_ins_code': ';'.join(rng.choice('.A') for _ in range(scheme_len)),
+            'resolution_score': rng.choice((1.5, 2.0, '2.5,1.8', '?', None)),
+            'method': rng.choice(METHODS),
+            'identity': rng.choice((0.9, 0.95, 1.0))})
+    return pd.DataFrame(rows)
+
+
+def bruteForce(dfrm):
+    ranked = list(Gadget.rankOrder(pd.DataFrame({
+        'resolution_score': -dfrm['resolution_score'].map(Gadget.handleResolution).astype(float),
+        'method': -dfrm['method'].map(BestStructureIndex.METHOD_RANK).fillna(len(BestStructureIndex.METHOD_RANK)),
+        'identity': dfrm['identity']}), list(BestStructureIndex.rank_list)))
+    hits = {}
+    for row, record in dfrm.iterrows():
+        unp = [site for start, end in json.loads(record['new_sifts_unp_range']) for site in range(start, end + 1)]
+        pdb = [seqres for start, end in json.loads(record['new_sifts_pdb_range']) for seqres in range(start, end + 1)]
+        auth = record['_pdbx_poly_seq_scheme.auth_seq_num'].split(';')
+        num = record['_pdbx_poly_seq_scheme.pdb_seq_num'].split(';')
+        ins = record['_pdbx_poly_seq_scheme.pdb_ins_code'].split(';')
+        for site, seqres in zip(unp, pdb):
+            in_scheme = seqres <= len(auth)
+            observed = in_scheme and auth[seqres-1] != '?'
+            author = (num[seqres-1] + (ins[seqres-1] if ins[seqres-1] != '.' else '')) if in_scheme else '0'
+            hits.setdefault((record['UniProt'], site), []).append((not observed, ranked.index(row), row, seqres, author, observed))
+    return dict((key, sorted(value)) for key, value in hits.items())
+
+
+def test_best_structure_index(tmp_path):
+    dfrm = randomSIFTS(random.Random(0))
+    index = BestStructureIndex.build(dfrm, tmp_path/'index')
+    expected = bruteForce(dfrm)
+    keys = sorted(expected) + [('P00001', 0), ('P00001', 1000), ('A00000', 3)]
+    res = index.query([unp for unp, _ in keys], [site for _, site in keys], top=None)
+    for query, hits in res.groupby('query'):
+        assert list(hits['rank']) == list(range(len(hits)))
+        assert [(row['pdb_id'], row['seqres'], row['author_residue'], row['observed']) for _, row in hits.iterrows()] == [
+            (dfrm.loc[row, 'pdb_id'], seqres, author, observed) for _, _, row, seqres, author, observed in expected[keys[query]]]
+    assert set(res['query']) == set(range(len(expected)))
+    top = index.query([unp for unp, _ in keys], [site for _, site in keys])
+    assert list(top['query']) == list(range(len(expected)))
+    unp, site = keys[0]
+    assert index.best(unp, site)['pdb_id'] == dfrm.loc[expected[keys[0]][0][2], 'pdb_id']
+    assert index.best('A00000', 3) is None
+
+
+def test_empty_index(tmp_path):
+    index = BestStructureIndex.build(randomSIFTS(random.Random(0)).iloc[:0], tmp_path/'index')
+    assert len(index.query(['P00001', 'P00002'], [1, 2], top=None)) == 0
+    assert index.best('P00001', 1) is None
+
+
+def segmentMapping(x, muta_col, unp_range_col, pdb_range_col, error_li):
+    # `map_muta_from_unp_to_pdb` before `SegmentMapper`
+    sub_error_li = []
+    muta_li = x[muta_col]
+    if isinstance(muta_li, str):
+        muta_li = json.loads(muta_li.replace('\'', '"'))
+    unp_range = json.loads(x[unp_range_col])
+    pdb_range = json.loads(x[pdb_range_col])
+
+    auth_seq_li = x['_pdbx_poly_seq_scheme.auth_seq_num'].split(';')
+    com_seq_li = x['_pdbx_poly_seq_scheme.pdb_seq_num'].split(';')
+    inscode_seq_li = x['_pdbx_poly_seq_scheme.pdb_ins_code'].split(';')
+    found_muta_1 = x['mutation_content'].split(',')
+    found_muta_2 = [i[1:-1] for i in found_muta_1]
+
+    pdb_li = []
+    unp_li = []
+    new_muta_site = []
+    for ran in pdb_range:
+        pdb_li.extend(list(range(ran[0], ran[1]+1)))
+    for ran in unp_range:
+        unp_li.extend(list(range(ran[0], ran[1]+1)))
+
+    for muta in muta_li:
+        try:
+            int(muta[0])
+            site, mutaType = int(muta), False
+        except ValueError:
+            site, mutaType = int(muta[1:-1]), True
+
+        try:
+            seqresSite = pdb_li[unp_li.index(site)]
+        except ValueError:
+            new_muta_site.append('#')
+            sub_error_li.append('Unmapped #: %s' % muta)
+            continue
+        except IndexError:
+            new_muta_site.append('$')
+            sub_error_li.append('Unmapped $: %s' % muta)
+            continue
+        seq_aa = x['_pdbx_poly_seq_scheme.mon_id'][seqresSite-1]
+        ref_aa = muta[0]
+        inscode = inscode_seq_li[seqresSite-1]
+
+        if seq_aa != ref_aa and mutaType:
+            try:
+                found_muta = found_muta_1[found_muta_2.index(com_seq_li[seqresSite-1])]
+            except ValueError:
+                found_muta = False
+
+            error_info = []
+            if found_muta:
+                if found_muta[0] == ref_aa:
+                    error_info.append('EntityMutation: %s' % found_muta)
+            if seq_aa == 'X':
+                error_info.append('ModifiedResidue: %s%s%s' % (seq_aa, com_seq_li[seqresSite-1], inscode))
+            else:
+                error_info.append('PossibleMutation: %s%s%s' % (seq_aa, com_seq_li[seqresSite-1], inscode))
+            sub_error_li.append('' + ','.join(error_info))
+        elif auth_seq_li[seqresSite-1] == "?":
+            sub_error_li.append('Missing')
+        else:
+            sub_error_li.append('Safe')
+
+        if inscode != '.':
+            new_muta_site.append('%s%s' % (com_seq_li[seqresSite-1], inscode))
+        else:
+            new_muta_site.append(com_seq_li[seqresSite-1])
+
+    error_li.append(sub_error_li)
+    return new_muta_site
+
+
+def mutationRows(rng, count=40):
+    dfrm = randomSIFTS(rng, count)
+    length = dfrm['_pdbx_poly_seq_scheme.auth_seq_num'].str.count(';') + 1
+    dfrm['_pdbx_poly_seq_scheme.mon_id'] = length.map(lambda size: ''.join(rng.choice('ACDX') for _ in range(size)))
+    dfrm['mutation_content'] = [
+        ','.join('%s%s%s' % (rng.choice('ACD'), num - 5, rng.choice('ACD')) for num in rng.sample(range(1, size + 1), min(size, 2)))
+        for size in length]
+    # the chains of the same entity share the ranges and the scheme
+    dfrm = pd.concat([dfrm, dfrm.iloc[:count//2]], ignore_index=True)
+    dfrm['mutation_unp'] = [
+        json.dumps([rng.choice(('%s' % site, '%s%s%s' % (rng.choice('ACD'), site, rng.choice('ACD')))) for site in rng.sample(range(0, 40), 8)])
+        for _ in range(len(dfrm))]
+    return dfrm
+
+
+def test_map_muta_from_unp_to_pdb():
+    dfrm = mutationRows(random.Random(2))
+    dfrm['_pdbx_poly_seq_scheme.auth_seq_num'] = dfrm['_pdbx_poly_seq_scheme.auth_seq_num'] + ';1;2'
+    dfrm['_pdbx_poly_seq_scheme.pdb_seq_num'] = dfrm['_pdbx_poly_seq_scheme.pdb_seq_num'] + ';1;2'
+    dfrm['_pdbx_poly_seq_scheme.pdb_ins_code'] = dfrm['_pdbx_poly_seq_scheme.pdb_ins_code'] + ';.;.'
+    dfrm['_pdbx_poly_seq_scheme.mon_id'] = dfrm['_pdbx_poly_seq_scheme.mon_id'] + 'AA'
+    args = ('mutation_unp', 'new_sifts_unp_range', 'new_sifts_pdb_range')
+    expected_errors, errors = [], []
+    expected = dfrm.apply(lambda x: segmentMapping(x, *args, expected_errors), axis=1).tolist()
+    SegmentMapper.cached.cache_clear()
+    assert dfrm.apply(lambda x: map_muta_from_unp_to_pdb(x, *args, errors), axis=1).tolist() == expected
+    assert errors == expected_errors
+    # one mapper for the rows with the same ranges and scheme
+    info = SegmentMapper.cached.cache_info()
+    scheme_cols = list(args[1:]) + list(SegmentMapper.scheme_cols)
+    assert (info.hits, info.misses) == (len(dfrm) - len(dfrm.drop_duplicates(scheme_cols)), len(dfrm.drop_duplicates(scheme_cols)))
+    row = dfrm.iloc[0]
+    assert SegmentMapper.from_row(row, *args[1:]) is SegmentMapper.from_row(dfrm.iloc[-20], *args[1:])
+    listed = row.copy()
+    listed[args[1]], listed[args[2]] = json.loads(row[args[1]]), json.loads(row[args[2]])
+    assert map_muta_from_unp_to_pdb(listed, *args, []) == expected[0]
+
+
+def test_map_muta_table():
+    rng = random.Random(3)
+    dfrm = mutationRows(rng)
+    # the PDB segments of some rows are shorter than the UniProt ones
+    dfrm['new_sifts_pdb_range'] = [
+        json.dumps([[start, end - 1] if end > start else [start, end] for start, end in json.loads(value)]) if i % 3 == 0 else value
+        for i, value in enumerate(dfrm['new_sifts_pdb_range'])]
+    for col, extra in (('auth_seq_num', ';1;2'), ('pdb_seq_num', ';1;2'), ('pdb_ins_code', ';.;.'), ('mon_id', 'AA')):
+        dfrm['_pdbx_poly_seq_scheme.%s' % col] += extra
+    dfrm.index = dfrm.index * 10
+    args = ('mutation_unp', 'new_sifts_unp_range', 'new_sifts_pdb_range')
+    errors = []
+    expected = dfrm.apply(lambda x: map_muta_from_unp_to_pdb(x, *args, errors), axis=1)
+    res = map_muta_table(dfrm, *args)
+    assert {'#', '$'} <= set(res['mutation_pdb'])
+    assert res['index'].tolist() == [label for label, value in zip(dfrm.index, dfrm['mutation_unp']) for _ in json.loads(value)]
+    assert res.groupby('index', sort=False)['mutation_pdb'].agg(list).tolist() == expected.tolist()
+    assert res.groupby('index', sort=False)['muta_map_info'].agg(list).tolist() == errors
+    assert (res[['UniProt', 'pdb_id', 'chain_id']].to_numpy() == dfrm.loc[res['index'], ['UniProt', 'pdb_id', 'chain_id']].to_numpy()).all()
+
+
+def test_reverse_mapper():
+    rng = random.Random(4)
+    dfrm = randomSIFTS(rng, 20)
+    # a chain mapped to another accession as well
+    dfrm = pd.concat([dfrm, dfrm.iloc[:5].assign(UniProt='O00004')], ignore_index=True)
+    mapper = ReverseMapper(dfrm)
+    expected = {}
+    for _, record in dfrm.iterrows():
+        unp = [site for start, end in json.loads(record['new_sifts_unp_range']) for site in range(start, end + 1)]
+        pdb = [seqres for start, end in json.loads(record['new_sifts_pdb_range']) for seqres in range(start, end + 1)]
+        num = record['_pdbx_poly_seq_scheme.pdb_seq_num'].split(';')
+        ins = record['_pdbx_poly_seq_scheme.pdb_ins_code'].split(';')
+        for site, seqres in zip(unp, pdb):
+            if seqres <= len(num):
+                key = (record['pdb_id'], record['chain_id'], int(num[seqres-1]), '' if ins[seqres-1] == '.' else ins[seqres-1])
+                expected.setdefault(key, set()).add((record['UniProt'], seqres, site))
+    keys = sorted(set(expected) | set(
+        (pdb_id, chain_id, num, ins) for pdb_id, chain_id in dfrm[['pdb_id', 'chain_id']].values.tolist()
+        for num in range(-6, 30) for ins in ('', 'A')) | {('9xyz', 'A', 1, '')})
+    res = mapper.query(*zip(*keys))
+    hits = dict(
+        (keys[query], set(zip(group['UniProt'], group['seqres'], group['unp_site']))) for query, group in res.groupby('query'))
+    assert hits == expected
+    assert (res[['pdb_id', 'chain_id']].to_numpy() == [keys[query][:2] for query in res['query']]).all()
+    assert len(ReverseMapper(dfrm.iloc[:0]).query(['1abc'], ['A'], [1])) == 0
+
+
+def test_ranges_column(tmp_path):
+    dfrm = mutationRows(random.Random(5))
+    for col, extra in (('auth_seq_num', ';1;2'), ('pdb_seq_num', ';1;2'), ('pdb_ins_code', ';.;.'), ('mon_id', 'AA')):
+        dfrm['_pdbx_poly_seq_scheme.%s' % col] += extra
+    ranges = dfrm.astype({'new_sifts_unp_range': 'ranges', 'new_sifts_pdb_range': 'ranges'})
+    args = ('mutation_unp', 'new_sifts_unp_range', 'new_sifts_pdb_range')
+    pd.testing.assert_frame_equal(map_muta_table(ranges, *args), map_muta_table(dfrm, *args))
+    keys = (dfrm['pdb_id'], dfrm['chain_id'], [1]*len(dfrm))
+    pd.testing.assert_frame_equal(ReverseMapper(ranges).query(*keys), ReverseMapper(dfrm).query(*keys))
+    sites = (dfrm['UniProt'], [5]*len(dfrm))
+    pd.testing.assert_frame_equal(
+        BestStructureIndex.build(ranges, tmp_path/'ranges').query(*sites, top=None),
+        BestStructureIndex.build(dfrm, tmp_path/'json').query(*sites, top=None))
+
+
+def baselineInDe(dfrm):
+    # the per-row `deal_with_insertionDeletion_SIFTS` before `classify_segments`
+    def get_gap_list(li):
+        return [li[i+1][0] - li[i][1] - 1 for i in range(len(li) - 1)]
+
+    def get_ran_var(li_a, li_b):
+        return (np.array([ran[1] - ran[0] + 1 for ran in li_a]) - np.array([ran[1] - ran[0] + 1 for ran in li_b])).tolist()
+
+    dfrm = dfrm.copy()
+    dfrm['pdb_GAP_list'] = dfrm.apply(lambda x: json.dumps(get_gap_list(json.loads(x['sifts_pdb_range']))), axis=1)
+    dfrm['unp_GAP_list'] = dfrm.apply(lambda x: json.dumps(get_gap_list(json.loads(x['sifts_unp_range']))), axis=1)
+    dfrm['var_list'] = dfrm.apply(lambda x: json.dumps(get_ran_var(json.loads(x['sifts_unp_range']), json.loads(x['sifts_pdb_range']))), axis=1)
+    dfrm['delete'] = dfrm.apply(lambda x: x['var_list'].find('-') != -1, axis=1)
+    dfrm['delete'] = dfrm.apply(lambda x: True if x['unp_GAP_list'].find('-') != -1 else x['delete'], axis=1)
+    dfrm['var_0_count'] = dfrm.apply(lambda x: json.loads(x['var_list']).count(0), axis=1)
+    dfrm['unp_GAP_0_count'] = dfrm.apply(lambda x: json.loads(x['unp_GAP_list']).count(0), axis=1)
+    dfrm['group_info'] = dfrm.apply(lambda x: len(json.loads(x['sifts_pdb_range'])), axis=1)
+    dfrm['sifts_unp_pdb_var'] = dfrm.apply(lambda x: json.loads(x['var_list'])[0], axis=1)
+    dfrm['sifts_range_tage'] = 'Safe'
+    dfrm.loc[(dfrm['group_info'] == 1) & (dfrm['sifts_unp_pdb_var'] > 0), 'sifts_range_tage'] = 'Deletion'
+    insertion = (dfrm['var_0_count'] == dfrm['group_info']) & (dfrm['unp_GAP_0_count'] == (dfrm['group_info'] - 1))
+    dfrm.loc[(dfrm['group_info'] != 1) & insertion, 'sifts_range_tage'] = 'Insertion'
+    dfrm.loc[(dfrm['group_info'] != 1) & ~insertion, 'sifts_range_tage'] = 'Insertion & Deletion'
+    return dfrm
+
+
+def alignedRanges(rng):
+    pdb_range, unp_range, pdb_start, unp_start = [], [], rng.randint(1, 5), rng.randint(1, 50)
+    for _ in range(rng.randint(1, 4)):
+        length = rng.randint(1, 30)
+        pdb_range.append([pdb_start, pdb_start + length - 1])
+        # the unp segment may be longer or shorter than the pdb one, and may overlap the previous one
+        unp_range.append([unp_start, unp_start + length - 1 + rng.choice((0, 0, rng.randint(-3, 5)))])
+        pdb_start += length + rng.choice((0, rng.randint(1, 5)))
+        unp_start = unp_range[-1][1] + 1 + rng.choice((0, rng.randint(-3, 6)))
+    return pdb_range, unp_range
+
+
+def test_insertion_deletion():
+    rng = random.Random(5)
+    rows = [alignedRanges(rng) for _ in range(300)]
+    dfrm = pd.DataFrame({
+        'pdb_id': ['%dabc' % i for i in range(len(rows))],
+        'sifts_pdb_range': [json.dumps(pdb_range) for pdb_range, _ in rows],
+        'sifts_unp_range': [json.dumps(unp_range) for _, unp_range in rows]})
+    expected = baselineInDe(dfrm)
+    assert set(expected.sifts_range_tage) == {'Safe', 'Deletion', 'Insertion', 'Insertion & Deletion'}
+    pd.testing.assert_frame_equal(deal_with_insertionDeletion_SIFTS(dfrm.copy()), expected, check_dtype=False)
+    # a row without segment is not tagged
+    res = deal_with_insertionDeletion_SIFTS(pd.DataFrame({'sifts_pdb_range': ['[]', '[[1, 5]]'], 'sifts_unp_range': ['[]', '[[1, 5]]']}))
+    assert res.sifts_range_tage.isna().tolist() == [True, False]
@@ -0,0 +1,65 @@
+# @Created Date: 2020-04-19 02:30:41 pm
+# @Filename: test_annotation.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-19 02:30:45 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import os
+import json
+import random
+import pandas as pd
+from Muta3DMaps.core.pdbe.decode import PDBeDecoder
+from Muta3DMaps.core.pdbe.annotation import AnnotationIndex
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def secondaryStructure():
+    with open(os.path.join(DATA, '1a01,2xyn,2hev_secondary_structure.json')) as inFile:
+        data = json.load(inFile)
+    return pd.DataFrame(list(PDBeDecoder.pyexcel_io('pdb/entry/secondary_structure/', data).to_records()))
+
+
+def bruteForce(table, pdb_ids, entity_ids, chain_ids, points):
+    return sorted(
+        (query, row) for query, key in enumerate(zip(pdb_ids, entity_ids, chain_ids, points))
+        for row, record in enumerate(table.itertuples())
+        if (record.pdb_id, record.entity_id, record.chain_id) == key[:3] and record.start <= key[3] <= record.end)
+
+
+def check(index, pdb_ids, entity_ids, chain_ids, points):
+    res = index.query(pdb_ids, entity_ids, chain_ids, points)
+    table = index.table.reset_index().rename(columns={'index': 'row'})
+    rows = res.merge(table, how='left')['row'].tolist()
+    assert sorted(zip(res['query'], rows)) == bruteForce(index.table, pdb_ids, entity_ids, chain_ids, points)
+
+
+def test_secondary_structure():
+    dfrm = secondaryStructure()
+    table = AnnotationIndex.from_secondary_structure(dfrm)
+    assert table.start.tolist() == [json.loads(value)['residue_number'] for value in dfrm.start]
+    assert table.end.tolist() == [json.loads(value)['residue_number'] for value in dfrm.end]
+    # decoded records give the same intervals as the serialized ones
+    decoded = dfrm.assign(start=dfrm.start.map(json.loads), end=dfrm.end.map(json.loads))
+    assert AnnotationIndex.from_secondary_structure(decoded).equals(table)
+    index = AnnotationIndex.build(secondary_structure=dfrm)
+    chains = dfrm[['pdb_id', 'entity_id', 'chain_id']].drop_duplicates().values.tolist()
+    rng = random.Random(0)
+    queries = [chain + [rng.randint(-5, table.end.max() + 5)] for chain in rng.choices(chains, k=300)]
+    check(index, *zip(*queries))
+
+
+def test_negative_numbering():
+    binding_sites = pd.DataFrame({
+        'pdb_id': '1abc', 'entity_id': 1, 'chain_id': ['A', 'A', 'B', 'A'],
+        'residues_type': ['site_residues', 'site_residues', 'site_residues', 'ligand_residues'],
+        'site_id': ['AC1', 'AC1', 'AC2', 'AC1'], 'residue_number': [-3, 0, -1, -2]})
+    modified = pd.DataFrame({
+        'pdb_id': '1abc', 'entity_id': 1, 'chain_id': ['A', 'B'], 'chem_comp_id': ['MSE', 'SEP'], 'residue_number': [-10, 7]})
+    index = AnnotationIndex.build(binding_sites=binding_sites, modified_AA_or_NA=modified)
+    assert len(index) == 5
+    points = list(range(-12, 10))
+    for chain in 'ABC':
+        check(index, ['1abc']*len(points), [1]*len(points), [chain]*len(points), points)
+    res = index.query(['1abc', '1abc'], [1, 1], ['A', 'B'], [-3, -10])
+    assert res[['query', 'name']].values.tolist() == [[0, 'AC1']]
@@ -0,0 +1,109 @@
+# @Created Date: 2020-04-19 11:02:15 am
+# @Filename: test_coverage.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-19 11:02:19 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import json
+import random
+import pytest
+import numpy as np
+import pandas as pd
+from Muta3DMaps.core.ranges import RaggedRanges
+from Muta3DMaps.core.pdbe.coverage import CoverageIndex, fill_bits
+
+
+def range2Set(ranges):
+    return set(site for start, end in ranges for site in range(start, end + 1))
+
+
+def set2Range(sites):
+    ranges = []
+    for site in sorted(sites):
+        if ranges and ranges[-1][1] == site - 1:
+            ranges[-1][1] = site
+        else:
+            ranges.append([site, site])
+    return ranges
+
+
+def randomRanges(rng):
+    ranges, start = [], rng.randint(1, 20)
+    for _ in range(rng.randint(1, 3)):
+        end = start + rng.randint(0, 15)
+        ranges.append([start, end])
+        start = end + rng.randint(2, 10)
+    return ranges
+
+
+def randomSIFTS(rng, count=20):
+    rows = []
+    for i in range(count):
+        covered = randomRanges(rng)
+        observed = set2Range(site for site in range2Set(covered) if rng.random() > 0.2)
+        rows.append({
+            'pdb_id': '%dabc' % i, 'chain_id': rng.choice('AB'), 'UniProt': rng.choice(('P00001', 'P00002', 'Q00003')),
+            'sifts_unp_range': json.dumps(covered), 'observed_unp_range': json.dumps(observed)})
+    return pd.DataFrame(rows)
+
+
+def test_coverage_index(tmp_path):
+    dfrm = randomSIFTS(random.Random(0))
+    built = CoverageIndex.build(dfrm, observed_col='observed_unp_range')
+    built.save(tmp_path)
+    loaded = CoverageIndex.load(tmp_path)
+    for index in (built, loaded):
+        chains = index.chains.merge(dfrm)
+        report = index.report().set_index('UniProt')
+        for unp, group in chains.groupby('UniProt'):
+            covered = set.union(*group['sifts_unp_range'].map(json.loads).map(range2Set))
+            observed = set.union(*group['observed_unp_range'].map(json.loads).map(range2Set))
+            assert index.to_ranges(index.unp_bitmap(unp)) == set2Range(covered)
+            assert index.to_ranges(index.unp_bitmap(unp, 'observed')) == set2Range(observed)
+            assert index.to_ranges(index.union(group.index)) == set2Range(covered)
+            assert index.to_ranges(index.intersection(group.index)) == set2Range(
+                set.intersection(*group['sifts_unp_range'].map(json.loads).map(range2Set)))
+            assert tuple(report.loc[unp, ['length', 'covered_count', 'observed_count', 'chain_count']]) == (
+                max(covered), len(covered), len(observed), len(group))
+            sites = list(range(0, max(covered) + 3))
+            assert list(index.contains([unp] * len(sites), sites)) == [site in covered for site in sites]
+            assert list(index.contains([unp] * len(sites), sites, 'observed')) == [site in observed for site in sites]
+        assert not index.contains(['A00000'], [1]).any()
+        with pytest.raises(KeyError):
+            index.unp_bitmap('A00000')
+        # the chains of different accessions do not share the bit layout
+        mixed = [chains.index[chains['UniProt'] == unp][0] for unp in ('P00001', 'P00002')]
+        with pytest.raises(ValueError):
+            index.union(mixed)
+        with pytest.raises(ValueError):
+            index.intersection([])
+
+
+def test_packed_size():
+    index = CoverageIndex.build(pd.DataFrame({
+        'pdb_id': ['1abc', '2abc'], 'chain_id': ['A', 'A'], 'UniProt': ['P00001', 'P00002'],
+        'sifts_unp_range': ['[[1,9]]', '[[3,3],[16,16]]']}))
+    assert list(index.unp_offsets) == [0, 2, 4]
+    assert np.array_equal(index.unp_bitmap('P00002'), np.packbits([0, 0, 1] + [0] * 12 + [1]))
+
+
+def test_ranges_column():
+    dfrm = randomSIFTS(random.Random(1))
+    expected = CoverageIndex.build(dfrm, observed_col='observed_unp_range')
+    index = CoverageIndex.build(dfrm.astype({'sifts_unp_range': 'ranges', 'observed_unp_range': 'ranges'}), observed_col='observed_unp_range')
+    for name in CoverageIndex.arrays:
+        assert np.array_equal(getattr(index, name), getattr(expected, name))
+
+
+def test_fill_bits():
+    rng = random.Random(2)
+    for chunk in (1, 3, 4096):
+        lengths = [rng.randint(1, 40) for _ in range(6)]
+        bases = np.concatenate(([0], np.cumsum([(length + 7) // 8 for length in lengths]))) * 8
+        values = [[[start, rng.randint(start, length)] for start in rng.sample(range(1, length + 1), rng.randint(0, min(3, length)))] for length in lengths]
+        ranges = RaggedRanges.from_lists(values)
+        bits = np.zeros(bases[-1], dtype=bool)
+        for base, segments in zip(bases, values):
+            for start, end in segments:
+                bits[base + start - 1:base + end] = True
+        assert np.array_equal(fill_bits(bases, ranges.rows, ranges, bases[-1] // 8, chunk), np.packbits(bits))
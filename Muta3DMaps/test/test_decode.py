@@ -0,0 +1,255 @@
+# @Created Date: 2020-04-18 10:20:15 am
+# @Filename: test_decode.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-18 10:20:19 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import os
+import copy
+import types
+import asyncio
+import pytest
+import ujson as json
+import pandas as pd
+from Muta3DMaps.core.retrieve.fetchFiles import UnsyncFetch
+from Muta3DMaps.core.pdbe import decode
+from Muta3DMaps.core.pdbe.constants import RAW_SIFTS_COLUMNS
+from Muta3DMaps.core.pdbe.decode import BASE_URL, ENDPOINTS, BatchTuner, PDBeDecoder, ProcessPDBe, ProcessSIFTS, ProcessEntryData
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+ProcessPDBe.init_logger()
+
+FLATFILE = '''# 2020/04/15 - 09:50 | PDB: 15.20 | UniProt: 2020.02
+PDB\tCHAIN\tSP_PRIMARY\tRES_BEG\tRES_END\tPDB_BEG\tPDB_END\tSP_BEG\tSP_END
+101m\tA\tP02185\t1\t154\t0\t153\t1\t154
+102d\tA\tP00001\t1\t5\t1\t5\t3\t7
+102d\tA\tP00001\t8\t12\t8\t12\t10\t14
+102d\tB\tP00001\t1\t12\t1\t12\t3\t14
+103l\tA\tP00720\t1\t40\t1\t40\t1\t40
+103l\tA\tP00720\t42\t167\t44\t169\t41\t166
+'''
+
+
+def test_flatfile(tmp_path):
+    path = tmp_path/'pdb_chain_uniprot.tsv'
+    path.write_text(FLATFILE)
+    expected = ProcessSIFTS.aggregate(pd.read_csv(path, sep='\t', header=1).rename(columns={
+        'PDB': 'pdb_id', 'CHAIN': 'chain_id', 'SP_PRIMARY': 'UniProt', 'RES_BEG': 'pdb_start',
+        'RES_END': 'pdb_end', 'SP_BEG': 'unp_start', 'SP_END': 'unp_end'}).drop(columns=['PDB_BEG', 'PDB_END']))
+    for chunksize in (1, 2, 4, 100):
+        res = pd.concat(ProcessSIFTS.yieldFlatfile(path, chunksize), ignore_index=True)
+        assert res.columns.tolist() == ['pdb_id', 'chain_id', 'UniProt'] + [
+            col for col in RAW_SIFTS_COLUMNS if col not in ('pdb_id', 'chain_id', 'UniProt', 'pdb_start', 'pdb_end', 'unp_start', 'unp_end')
+        ] + ['sifts_pdb_range', 'sifts_unp_range', 'Entry']
+        pd.testing.assert_frame_equal(res[expected.columns], expected)
+        assert res.is_canonical.all() and res.identity.isna().all()
+    assert res.sifts_unp_range.tolist() == ['[[1,154]]', '[[3,7],[10,14]]', '[[3,14]]', '[[1,40],[41,166]]']
+    res = ProcessSIFTS.from_flatfile(path, isoformPath=path)
+    assert len(res) == 8 and res.is_canonical.tolist() == [True]*4 + [False]*4
+    assert res.sifts_range_tage.tolist() == ProcessSIFTS.dealWithInDe(expected).sifts_range_tage.tolist()*2
+    lines = FLATFILE.splitlines(keepends=True)
+    path.write_text(''.join(lines[:4] + lines[6:] + lines[4:6]))
+    with pytest.raises(ValueError):
+        list(ProcessSIFTS.yieldFlatfile(path, 2))
+
+
+def test_endpoints():
+    assert set(ENDPOINTS) >= {'pdb/entry/status/', 'pdb/entry/residue_listing/', 'mappings/all_isoforms/'}
+    for suffix, info in ENDPOINTS.items():
+        assert suffix.endswith('/') and not suffix.startswith('/')
+        assert info['post'] is ('chunksize' in info)
+        assert info.get('chunksize', 1) > 0
+    assert not ENDPOINTS['pdb/entry/residue_listing/']['post']
+
+
+def test_batch_tuner():
+    tuner = BatchTuner(20, min_size=2, max_size=100, target_bytes=1000, target_seconds=10)
+    tuner.update(20, 100, 1)
+    assert tuner.size == 40
+    tuner.update(40, 2000, 1)
+    assert tuner.size == 20
+    tuner.update(20, 100, 40)
+    assert tuner.size == 5
+    tuner.size = 100
+    tuner.update(100, 1, 0.1)
+    assert tuner.size == 100
+    # concurrent failures of batches of the same size only halve it once
+    tuner.shrink(100)
+    tuner.shrink(100)
+    assert tuner.size == 50
+    tuner.shrink(3)
+    assert tuner.size == 2
+
+
+def fake_status(calls):
+    async def http_download(method, info, path):
+        ids = info['data'].split(',')
+        calls.append(ids)
+        assert method == 'post' and info['url'] == f'{BASE_URL}pdb/entry/status/'
+        if any(pdb.startswith('x') for pdb in ids):
+            raise Exception('code=500')
+        if all(pdb.startswith('n') for pdb in ids):
+            return None
+        with open(path, 'w') as outFile:
+            json.dump(dict((pdb, [{'status_code': 'REL', 'since': '20200101'}]) for pdb in ids if not pdb.startswith('n')), outFile)
+        return path
+    return http_download
+
+
+def test_adaptive_fetch(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(UnsyncFetch, 'http_download', fake_status(calls))
+    monkeypatch.setattr(UnsyncFetch, 'retry_wrapped', True)
+    pdbs = [f'1a{i:02d}' for i in range(30)] + ['xbad', 'n001', 'n002']
+    tuner = BatchTuner(8, target_bytes=2**30)
+    res = ProcessPDBe.adaptive_fetch(pdbs, 'pdb/entry/status/', str(tmp_path), concur_req=3, rate=0, tuner=tuner, columns=('pdb_id', 'status_code')).result()
+    dfrm = pd.concat(pd.read_csv(path, sep='\t', dtype=str) for path in res)
+    assert dfrm.columns.tolist() == ['pdb_id', 'status_code']
+    assert sorted(dfrm.pdb_id) == pdbs[:30]
+    # the batch with the failing id is split down to the id itself, which is skipped
+    assert ['xbad'] in calls and all(len(ids) <= 16 for ids in calls)
+    assert set(pdb for ids in calls for pdb in ids) == set(pdbs)
+    calls.clear()
+    assert ProcessPDBe.adaptive_fetch(['n001', 'n002', 'n003'], 'pdb/entry/status/', str(tmp_path), rate=0).result() == []
+    assert calls == [['n001', 'n002', 'n003']]
+
+
+def fake_entry_data(state):
+    async def http_download(method, info, path):
+        state['running'] += 1
+        state['max'] = max(state['max'], state['running'])
+        await asyncio.sleep(0.01)
+        state['running'] -= 1
+        suffix = info['url'][len(BASE_URL):]
+        api = suffix.split('/')[2]
+        ids = info['data'].split(',') if method == 'post' else [suffix.split('/')[3]]
+        state['calls'].append((api, ids))
+        data = {}
+        for pdb in ids:
+            try:
+                with open(os.path.join(DATA, f'{pdb}_{api}.json')) as inFile:
+                    data.update(json.load(inFile))
+            except FileNotFoundError:
+                pass
+        if not data:
+            return None
+        with open(path, 'w') as outFile:
+            json.dump(data, outFile)
+        return path
+    return http_download
+
+
+def test_pipeline(tmp_path, monkeypatch):
+    state = {'running': 0, 'max': 0, 'calls': []}
+    fake = fake_entry_data(state)
+    monkeypatch.setattr(UnsyncFetch, 'http_download', fake)
+    monkeypatch.setattr(UnsyncFetch, 'retry_wrapped', False)
+    pdbs = ['1a01', '1miu', '2hev', '2xyn', '3g96', '6lu7']
+    ProcessEntryData.pipeline(pdbs, str(tmp_path), chunksize=2, depth=3, concur_req=2, rate=0)
+    # all the requests of the overlapping chunks share one semaphore
+    assert 0 < state['max'] <= 2
+    # the download function is wrapped by `tenacity.retry` only once
+    assert UnsyncFetch.http_download.__wrapped__ is fake
+    assert sorted(pdb for api, ids in state['calls'] if api == 'residue_listing' for pdb in ids) == pdbs
+    chains = pd.concat(pd.read_csv(tmp_path/f'chain_observed_statistic+{i}.tsv', sep='\t') for i in (0, 2, 4))
+    assert chains.columns.tolist() == ['pdb_id', 'entity_id', 'chain_id', 'ob_res', 'ob_moded_res']
+    assert len(chains) and set(chains.pdb_id) <= set(pdbs) and (chains.ob_moded_res == 0).all()
+    pdb_stat = pd.concat(pd.read_csv(tmp_path/f'clean_pdb_statistic+{i}.tsv', sep='\t') for i in (0, 2, 4))
+    assert pdb_stat.columns.tolist() == ['pdb_id', 'chain_count', 'cleaned_chain_count']
+    assert pdb_stat.chain_count.sum() == len(chains)
+
+
+def test_statistic():
+    dfrm = pd.DataFrame({
+        'pdb_id': ['1a01']*5 + ['2xyn']*3,
+        'entity_id': [1, 1, 1, 2, 2, 1, 1, 1],
+        'chain_id': ['A', 'A', 'B', 'C', 'C', 'A', 'A', 'A'],
+        'observed_ratio': [1, 0, 0.5, 1, 1, 0, 1, 1],
+        'chem_comp_id': ['MSE', 'MSE', None, 'SEP', None, None, 'MSE', None]})
+    chains = ProcessEntryData.observed_statistic(dfrm)
+    assert chains.values.tolist() == [['1a01', 1, 'A', 1, 1], ['1a01', 1, 'B', 1, 0], ['1a01', 2, 'C', 2, 1], ['2xyn', 1, 'A', 2, 1]]
+    assert ProcessEntryData.clean_statistic(chains, cutoff=1).values.tolist() == [['1a01', 3, 1], ['2xyn', 1, 0]]
+    # the tables are written with a header row
+    assert ProcessEntryData.clean_statistic(chains).to_csv(sep='\t', index=False).splitlines() == [
+        'pdb_id\tchain_count\tcleaned_chain_count', '1a01\t3\t3', '2xyn\t1\t1']
+
+
+@pytest.mark.parametrize('suffix, name, columns', [
+    ('pdb/entry/summary/', '1a01,2xyn,1miu_summary.json', ('pdb_id', 'title', 'revision_date')),
+    ('pdb/entry/molecules/', '2xyn_molecules.json', ('pdb_id', 'entity_id', 'molecule_type')),
+    ('pdb/entry/residue_listing/', '2xyn_residue_listing.json', ('pdb_id', 'chain_id', 'residue_number', 'observed_ratio')),
+    ('pdb/entry/secondary_structure/', '1a01,2xyn,2hev_secondary_structure.json', ('pdb_id', 'chain_id', 'secondary_structure', 'sheet_id')),
+    ('mappings/all_isoforms/', '1a01_sifts.json', ('pdb_id', 'chain_id', 'UniProt', 'unp_start', 'unp_end'))])
+def test_project(suffix, name, columns, monkeypatch):
+    with open(os.path.join(DATA, name)) as inFile:
+        data = json.load(inFile)
+    full = list(PDBeDecoder.pyexcel_io(suffix, copy.deepcopy(data)).to_records())
+    dumped = []
+
+    def dumps(value, *args, **kwargs):
+        dumped.append(value)
+        return json.dumps(value, *args, **kwargs)
+
+    monkeypatch.setattr(decode, 'json', types.SimpleNamespace(dumps=dumps, load=json.load, loads=json.loads))
+    res = list(PDBeDecoder.pyexcel_io(suffix, copy.deepcopy(data), columns).to_records())
+    assert [sorted(record) for record in res] == [sorted(columns)]*len(full)
+    assert [dict(record) for record in res] == [dict((col, record[col]) for col in columns) for record in full]
+    # the nested values of the unrequested columns are never serialized
+    assert dumped == []
+    PDBeDecoder.pyexcel_io(suffix, copy.deepcopy(data), columns + ('start',) if suffix == 'mappings/all_isoforms/' else None)
+    assert dumped
+
+
+def test_delta(tmp_path, monkeypatch):
+    stateFile = tmp_path/'entry_state.tsv'
+    pd.DataFrame({
+        'pdb_id': ['1a01', '1a02', '1a03', '1a04', '1a05'],
+        'status_code': ['REL', 'REL', 'REL', 'OBS', 'REL'],
+        'revision_date': ['20200101']*5}).to_csv(stateFile, sep='\t', index=False)
+    state = pd.DataFrame({
+        # unchanged, revised, superseded, still obsolete, new and new but not released
+        'pdb_id': ['1a01', '1a02', '1a03', '1a04', '2b01', '2b02'],
+        'status_code': ['REL', 'REL', 'OBS', 'OBS', 'REL', 'HPUB'],
+        'revision_date': ['20200101', '20200301', '20200301', '20200101', '20200301', 'nan']})
+    new_state, changed, withdrawn = ProcessEntryData.delta(state, stateFile)
+    assert changed == ['1a02', '2b01'] and withdrawn == ['1a03']
+    # entries not queried this time are kept in the state table
+    assert sorted(new_state.pdb_id) == ['1a01', '1a02', '1a03', '1a04', '1a05', '2b01', '2b02']
+    assert new_state.set_index('pdb_id').loc['1a02', 'revision_date'] == '20200301'
+    assert ProcessEntryData.delta(state, tmp_path/'none.tsv')[1:] == (['1a01', '1a02', '2b01'], [])
+
+    calls = []
+    monkeypatch.setattr(ProcessEntryData, 'revision_state', classmethod(lambda cls, pdbs, folder: state))
+    monkeypatch.setattr(ProcessEntryData, 'pipeline', classmethod(lambda cls, pdbs, *args, **kwargs: calls.append(('pipeline', pdbs))))
+    res = ProcessEntryData.incremental(state.pdb_id.tolist(), str(tmp_path), stateFile, refresh=lambda *args: calls.append(('refresh', *args)))
+    assert res == ['1a02', '2b01']
+    assert calls == [('pipeline', ['1a02', '2b01']), ('refresh', ['1a02', '2b01'], ['1a03'])]
+    # nothing changed since the saved state
+    calls.clear()
+    assert ProcessEntryData.incremental(state.pdb_id.tolist(), str(tmp_path), stateFile, refresh=lambda *args: calls.append(args)) == []
+    assert calls == []
+
+
+def test_delta_missing(tmp_path, caplog):
+    stateFile = tmp_path/'entry_state.tsv'
+    pd.DataFrame({
+        'pdb_id': ['1a01', '1a02', '1a03', '1a04'],
+        'status_code': ['REL', 'REL', 'OBS', 'REL'],
+        'revision_date': ['20200101']*4}).to_csv(stateFile, sep='\t', index=False)
+    # 1a02 and 1a03 are queried but missing from the response, 1a04 is not queried
+    state = pd.DataFrame({'pdb_id': ['1a01'], 'status_code': ['REL'], 'revision_date': ['20200101']})
+    new_state, changed, withdrawn = ProcessEntryData.delta(state, stateFile, ['1a01', '1a02', '1a03'])
+    assert changed == [] and withdrawn == ['1a02']
+    assert "['1a02', '1a03']" in caplog.text
+    assert new_state.set_index('pdb_id').status_code.to_dict() == {'1a01': 'REL', '1a02': 'WDRN', '1a03': 'WDRN', '1a04': 'REL'}
+    # without the queried entries, the missing ones are kept as they are
+    assert ProcessEntryData.delta(state, stateFile)[1:] == ([], [])
+    # once recorded, a missing entry is neither withdrawn nor logged again
+    new_state.to_csv(stateFile, sep='\t', index=False)
+    caplog.clear()
+    assert ProcessEntryData.delta(state, stateFile, ['1a01', '1a02', '1a03'])[1:] == ([], [])
+    assert not caplog.text
+    # and is fetched again once it is released again
+    state = pd.DataFrame({'pdb_id': ['1a01', '1a02'], 'status_code': ['REL', 'REL'], 'revision_date': ['20200101']*2})
+    assert ProcessEntryData.delta(state, stateFile, ['1a01', '1a02'])[1:] == (['1a02'], [])
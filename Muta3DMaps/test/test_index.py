@@ -0,0 +1,61 @@
+# @Created Date: 2020-04-19 04:15:08 pm
+# @Filename: test_index.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-19 04:15:12 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import random
+import pytest
+from itertools import combinations
+from Muta3DMaps.core.pdbe.index import UniProtPDBIndex, min_vertex_cover
+
+
+def randomGraph(rng, left_size, right_size, density):
+    return [sorted(v for v in range(right_size) if rng.random() < density) for _ in range(left_size)]
+
+
+def isCover(adjacency, left, right):
+    left, right = set(left), set(right)
+    return all(u in left or v in right for u, vs in enumerate(adjacency) for v in vs)
+
+
+def bruteForceCover(adjacency, right_size):
+    vertices = [('l', u) for u in range(len(adjacency))] + [('r', v) for v in range(right_size)]
+    for size in range(len(vertices) + 1):
+        for cover in combinations(vertices, size):
+            if isCover(adjacency, (i for side, i in cover if side == 'l'), (i for side, i in cover if side == 'r')):
+                return size
+
+
+def test_min_vertex_cover():
+    rng = random.Random(0)
+    for _ in range(200):
+        left_size, right_size = rng.randint(0, 6), rng.randint(0, 6)
+        adjacency = randomGraph(rng, left_size, right_size, rng.choice((0.1, 0.3, 0.6)))
+        left, right = min_vertex_cover(adjacency, right_size)
+        assert isCover(adjacency, left, right)
+        assert len(left) + len(right) == bruteForceCover(adjacency, right_size)
+
+
+def test_plan_requests(tmp_path):
+    rng = random.Random(1)
+    unps, pdbs = [f'P{i:05d}' for i in range(8)], [f'{i}abc' for i in range(10)]
+    related = dict((unp, rng.sample(pdbs, rng.randint(1, 4))) for unp in unps)
+    path = tmp_path/'uniprot_pdb.tsv'
+    path.write_text('# 2020/04/15 - 09:50 | PDB: 15.20 | UniProt: 2020.02\nSP_PRIMARY\tPDB\n' + ''.join(
+        f'{unp}\t{";".join(values)}\n' for unp, values in related.items()))
+    index = UniProtPDBIndex.build(path, folder=tmp_path/'index')
+    pairs = set((unp, pdb) for unp, values in related.items() for pdb in values)
+    for related_unp, related_pdb in ((None, None), (unps[:4], None), (None, pdbs[:5]), (unps[2:], pdbs[3:])):
+        expected = set(
+            (unp, pdb) for unp, pdb in pairs
+            if (related_unp is None or unp in related_unp) and (related_pdb is None or pdb in related_pdb))
+        sizes = {}
+        for mode in ('auto', 'unp', 'pdb'):
+            plan = index.plan_requests(related_unp, related_pdb, mode)
+            assert all(unp in plan['unp'] or pdb in plan['pdb'] for unp, pdb in expected)
+            assert plan['baseline'] == min(len(set(unp for unp, _ in expected)), len(set(pdb for _, pdb in expected)))
+            sizes[mode] = len(plan['unp']) + len(plan['pdb'])
+        assert sizes['auto'] <= min(sizes['unp'], sizes['pdb']) == plan['baseline']
+    with pytest.raises(ValueError):
+        index.plan_requests(mode='both')
@@ -0,0 +1,66 @@
+# @Created Date: 2020-04-20 10:15:26 am
+# @Filename: test_neo4j.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-20 10:15:30 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import random
+import numpy as np
+import pandas as pd
+import ujson as json
+from Muta3DMaps.core.neo4j.decode import SIFTS
+
+
+def baselineInDe(dfrm):
+    # the per-row `SIFTS.deal_InDe` before `classify_segments`
+    def get_gap_list(li):
+        return [li[i+1][0] - li[i][1] - 1 for i in range(len(li)-1)]
+
+    def get_range_diff(lyst_a, lyst_b):
+        return (np.array([right - left + 1 for left, right in lyst_a]) - np.array([right - left + 1 for left, right in lyst_b])).tolist()
+
+    dfrm['group_info'] = dfrm.apply(lambda x: len(x['pdb_range']), axis=1)
+    focus_index = dfrm[dfrm.group_info.gt(1)].index
+    if len(focus_index) > 0:
+        focus_df = dfrm.loc[focus_index].apply(lambda x: SIFTS.sort_2_range(x['unp_range'], x['pdb_range']), axis=1, result_type='expand')
+        focus_df.index = focus_index
+        focus_df.columns = ['unp_range', 'pdb_range']
+        dfrm.loc[focus_index, ['unp_range', 'pdb_range']] = focus_df
+    dfrm['pdb_gap_list'] = dfrm.apply(lambda x: json.dumps(get_gap_list(x['pdb_range'])), axis=1)
+    dfrm['unp_gap_list'] = dfrm.apply(lambda x: json.dumps(get_gap_list(x['unp_range'])), axis=1)
+    dfrm['var_list'] = dfrm.apply(lambda x: json.dumps(get_range_diff(x['unp_range'], x['pdb_range'])), axis=1)
+    dfrm['repeated'] = dfrm.apply(lambda x: '-' in x['var_list'] or '-' in x['unp_gap_list'], axis=1)
+    dfrm['var_0_count'] = dfrm.apply(lambda x: json.loads(x['var_list']).count(0), axis=1)
+    dfrm['unp_gap_0_count'] = dfrm.apply(lambda x: json.loads(x['unp_gap_list']).count(0), axis=1)
+    dfrm['unp_pdb_var'] = dfrm.apply(lambda x: json.loads(x['var_list'])[0], axis=1)
+    dfrm['sifts_range_tag'] = 'Safe'
+    dfrm.loc[(dfrm['group_info'] == 1) & (dfrm['unp_pdb_var'] > 0), 'sifts_range_tag'] = 'Deletion'
+    insertion = (dfrm['var_0_count'] == dfrm['group_info']) & (dfrm['unp_gap_0_count'] == (dfrm['group_info'] - 1))
+    dfrm.loc[(dfrm['group_info'] != 1) & insertion, 'sifts_range_tag'] = 'Insertion'
+    dfrm.loc[(dfrm['group_info'] != 1) & ~insertion, 'sifts_range_tag'] = 'Insertion & Deletion'
+    return dfrm
+
+
+def collectedRanges(rng):
+    # the segments of a chain as collected by the query, in no particular order
+    pdb_range, unp_range, pdb_start, unp_start = [], [], 1, rng.randint(1, 50)
+    for _ in range(rng.randint(1, 4)):
+        length = rng.randint(1, 30)
+        pdb_range.append([pdb_start, pdb_start + length - 1])
+        unp_range.append([unp_start, unp_start + length - 1 + rng.choice((0, 0, rng.randint(-3, 5)))])
+        pdb_start += length + rng.choice((0, rng.randint(1, 5)))
+        unp_start = unp_range[-1][1] + 1 + rng.choice((0, rng.randint(-3, 6)))
+    order = rng.sample(range(len(pdb_range)), len(pdb_range))
+    return [pdb_range[i] for i in order], [unp_range[i] for i in order]
+
+
+def test_deal_InDe():
+    rng = random.Random(3)
+    rows = [collectedRanges(rng) for _ in range(300)]
+    dfrm = pd.DataFrame({'pdb_id': ['%dabc' % i for i in range(len(rows))], 'pdb_range': [pdb for pdb, _ in rows], 'unp_range': [unp for _, unp in rows]})
+    expected = baselineInDe(dfrm.copy(deep=True))
+    res = SIFTS.deal_InDe(dfrm.copy(deep=True))
+    assert res.columns.tolist() == expected.columns.tolist()
+    for col in res.columns:
+        assert res[col].tolist() == expected[col].tolist()
+        assert [type(value) for value in res[col]] == [type(value) for value in expected[col]]
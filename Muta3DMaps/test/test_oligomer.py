@@ -0,0 +1,131 @@
+# @Created Date: 2020-04-18 09:12:40 am
+# @Filename: test_oligomer.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-18 09:12:44 am
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import random
+import pytest
+import numpy as np
+from itertools import product, combinations, combinations_with_replacement
+from Muta3DMaps.core.ranges import RaggedRanges
+from Muta3DMaps.core.pdbe.oligomer import UnitTable, jaccardIndex, jaccardMatrix, overlapMatrix, range2Set, validateSIFTS, yieldHe, yieldHo
+
+
+def nestedHe(data):
+    # the nested-dict generator before `UnitTable`
+    for pdb_id, entries in data.items():
+        if len(entries) == 1:
+            continue
+        for entry_l, entry_r in combinations(entries, 2):
+            eitities_l, eitities_r = entries[entry_l], entries[entry_r]
+            for entity_id_l, entity_id_r in product(eitities_l, eitities_r):
+                chains_l, chains_r = eitities_l[entity_id_l], eitities_r[entity_id_r]
+                for chain_id_l, chain_id_r in product(chains_l, chains_r):
+                    isoforms_l, isoforms_r = chains_l[chain_id_l], chains_r[chain_id_r]
+                    for isoform_id_l, isoform_id_r in product(isoforms_l, isoforms_r):
+                        unit_l, unit_r = isoforms_l[isoform_id_l], isoforms_r[isoform_id_r]
+                        if entity_id_l == entity_id_r:
+                            jaccard = jaccardIndex(unit_l['sifts_unp_range'], unit_r['sifts_unp_range'])
+                        else:
+                            jaccard = 0
+                        yield pdb_id, (entry_l, entry_r), (entity_id_l, entity_id_r), (chain_id_l, chain_id_r), (isoform_id_l, isoform_id_r), jaccard
+
+
+def nestedHo(data):
+    for pdb_id, entries in data.items():
+        for entry_id, entities in entries.items():
+            for entity_id_l, entity_id_r in combinations_with_replacement(entities.keys(), 2):
+                if entity_id_l != entity_id_r:
+                    chains_l, chains_r = entities[entity_id_l], entities[entity_id_r]
+                    for chain_id_l, chain_id_r in product(chains_l.keys(), chains_r.keys()):
+                        chain_l, chain_r = chains_l[chain_id_l], chains_r[chain_id_r]
+                        assert chain_l.keys() == chain_r.keys()
+                        for isoform_id in chain_l.keys():
+                            yield pdb_id, entry_id, 'ho', False, (chain_id_l, chain_id_r), jaccardIndex(chain_l[isoform_id]['sifts_unp_range'], chain_r[isoform_id]['sifts_unp_range'])
+                else:
+                    for res in combinations(entities[entity_id_l].keys(), 2):
+                        yield pdb_id, entry_id, 'ho', True, res, 1
+
+
+def randomRanges(rng):
+    ranges, start = [], rng.randint(1, 20)
+    for _ in range(rng.randint(1, 3)):
+        end = start + rng.randint(0, 30)
+        ranges.append([start, end])
+        start = end + rng.randint(1, 10)
+    return ranges
+
+
+def randomData(rng, pdb_count=4):
+    isoforms = ('P00001', 'P00001-2', 'Q00002')
+    data = {}
+    for pdb in range(pdb_count):
+        entries = data.setdefault(f'{pdb}abc', {})
+        for entry in rng.sample(range(5), rng.randint(1, 3)):
+            entities = entries.setdefault(entry, {})
+            # `yieldHo` asserts that the chains of an entry share the same isoforms
+            entry_isoforms = rng.sample(isoforms, rng.randint(1, 2))
+            for entity in rng.sample(range(1, 6), rng.randint(1, 3)):
+                for chain in rng.sample('ABCDEFGH', rng.randint(1, 3)):
+                    entities.setdefault(entity, {})[f'{chain}{entry}'] = dict(
+                        (isoform, {'sifts_unp_range': randomRanges(rng)}) for isoform in entry_isoforms)
+    return data
+
+
+FIXTURE = {
+    '1abc': {
+        1: {
+            1: {'A': {'P00001': {'sifts_unp_range': '[[1,10]]'}}, 'B': {'P00001': {'sifts_unp_range': '[[5,20]]'}}},
+            2: {'C': {'P00001': {'sifts_unp_range': [[1, 4], [8, 12]]}}}},
+        2: {
+            1: {'D': {'P00001': {'sifts_unp_range': '[[1,10]]'}}},
+            3: {'E': {'P00001': {'sifts_unp_range': '[[3,9]]'}}}}},
+    '2abc': {
+        1: {1: {'A': {'P00001': {'sifts_unp_range': '[[1,10]]'}}}}}}
+
+
+def test_nested_order():
+    for data in [FIXTURE] + [randomData(random.Random(seed)) for seed in range(30)]:
+        table = UnitTable.from_dict(data)
+        for func, nested in ((yieldHe, nestedHe), (yieldHo, nestedHo)):
+            expected = list(nested(data))
+            for source in (data, table):
+                res = list(func(source))
+                assert res == expected
+                assert [type(row[-1]) for row in res] == [type(row[-1]) for row in expected]
+
+
+def test_jaccard_matrix():
+    rng = random.Random(1)
+    ranges = [randomRanges(rng) for _ in range(40)]
+    overlap = overlapMatrix(RaggedRanges.from_lists(ranges))
+    jaccard = jaccardMatrix(RaggedRanges.from_lists(ranges))
+    for i, j in product(range(len(ranges)), repeat=2):
+        assert overlap[i, j] == len(range2Set(ranges[i]) & range2Set(ranges[j]))
+        assert jaccard[i, j] == jaccardIndex(ranges[i], ranges[j])
+    assert np.array_equal(np.diag(overlap), [len(range2Set(value)) for value in ranges])
+
+
+def test_threshold():
+    data = randomData(random.Random(0), 8)
+    table = UnitTable.from_dict(data)
+    for threshold in (0, 0.3, 0.8, 1):
+        for source in (data, table):
+            assert list(yieldHe(source, threshold)) == [row for row in nestedHe(data) if row[-1] >= threshold]
+            assert list(yieldHo(source, threshold)) == [row for row in nestedHo(data) if row[-1] >= threshold]
+
+
+def test_unit_table():
+    table = UnitTable.from_dict(FIXTURE)
+    he = table.he()
+    assert sorted(map(tuple, he.to_numpy().tolist())) == sorted(
+        (pdb_id, *(value for pair in units for value in pair), value) for pdb_id, *units, value in yieldHe(FIXTURE))
+    ho = table.ho()
+    assert sorted(map(tuple, ho.to_numpy().tolist())) == sorted(
+        (pdb_id, entry_id, same_entity, *chains, value) for pdb_id, entry_id, _, same_entity, chains, value in yieldHo(FIXTURE))
+    validateSIFTS(FIXTURE)
+    with pytest.raises(AssertionError):
+        list(yieldHo({'1abc': {1: {1: {'A': {'P00001': {'sifts_unp_range': '[[1,2]]'}}}, 2: {'B': {'Q00002': {'sifts_unp_range': '[[1,2]]'}}}}}}))
+    with pytest.raises(ValueError):
+        validateSIFTS({'1abc': {1: {1: {'A': {'P00001': {'sifts_unp_range': '[[1,2]]'}}, 'B': {'Q00002': {'sifts_unp_range': '[[1,2]]'}}}}}})
@@ -0,0 +1,114 @@
+# @Created Date: 2020-04-12 04:05:37 pm
+# @Filename: test_ranges.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-12 04:05:41 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import io
+import pytest
+import pandas as pd
+from numpy import nan
+from Muta3DMaps.core.ranges import (
+    IntervalSet, RaggedRanges, RangesArray, aggregate_segments, classify_segments,
+    ragged_difference, ragged_intersection, ragged_lengths)
+
+
+def test_aggregate_segments():
+    dfrm = pd.DataFrame({
+        'pdb_id': ['1a01', '1a01', '1a01', '2xyn'],
+        'chain_id': ['A', 'A', 'B', 'A'],
+        'identity': [0.9, 1.0, 1.0, 0.8],
+        'pdb_start': [1, 11, 1, 5],
+        'pdb_end': [5, 15, 9, 9],
+        'unp_start': [3, 13, 3, 7],
+        'unp_end': [7, 17, 11, 11]})
+    res = aggregate_segments(
+        dfrm, ['pdb_id', 'chain_id'],
+        {'pdb_range': ('pdb_start', 'pdb_end'), 'unp_range': ('unp_start', 'unp_end')})
+    assert res.columns.tolist() == ['pdb_id', 'chain_id', 'identity', 'pdb_range', 'unp_range']
+    assert res.pdb_range.tolist() == ['[[1,5],[11,15]]', '[[1,9]]', '[[5,9]]']
+    assert res.unp_range.tolist() == ['[[3,7],[13,17]]', '[[3,11]]', '[[7,11]]']
+    # keep the last row of each group
+    assert res.identity.tolist() == [1.0, 1.0, 0.8]
+
+
+def test_ragged_to_json():
+    ranges = RaggedRanges([0, 2, 2, 3], [1, 8, 4], [5, 9, 4])
+    assert ranges.to_json() == ['[[1,5],[8,9]]', '[]', '[[4,4]]']
+
+
+def test_classify_segments():
+    pdb_ranges = RaggedRanges.from_json(['[[1,10]]', '[[1,10]]', '[[1,5],[9,13]]', '[[1,5],[6,10]]'])
+    unp_ranges = RaggedRanges.from_json(['[[3,12]]', '[[3,14]]', '[[3,7],[8,12]]', '[[3,7],[11,15]]'])
+    res = classify_segments(pdb_ranges, unp_ranges)
+    assert res.range_tag.tolist() == ['Safe', 'Deletion', 'Insertion', 'Insertion & Deletion']
+    assert res.pdb_gap_list.tolist() == ['[]', '[]', '[3]', '[0]']
+    assert res.unp_gap_list.tolist() == ['[]', '[]', '[0]', '[3]']
+    assert res.var_list.tolist() == ['[0]', '[2]', '[0,0]', '[0,0]']
+    assert res.group_info.tolist() == [1, 1, 2, 2]
+    assert not res.delete.any()
+    # a row without segment is not tagged
+    assert classify_segments(RaggedRanges.from_json(['[]']), RaggedRanges.from_json(['[]'])).range_tag.isna().all()
+
+
+def test_interval_set():
+    left = IntervalSet.from_ranges('[[1, 10], [15, 20]]')
+    right = IntervalSet.from_ranges([(5, 16), (30, 31)])
+    assert (left | right).to_list() == [[1, 20], [30, 31]]
+    assert (left & right).to_list() == [[5, 10], [15, 16]]
+    assert (left - right).to_tuples() == [(1, 4), (17, 20)]
+    assert len(left) == 16 and 18 in left and 12 not in left
+    assert IntervalSet.from_points([5, 1, 2, 3, 7, 8]).to_list() == [[1, 3], [5, 5], [7, 8]]
+    assert IntervalSet.from_ranges(nan).to_list() == []
+    assert IntervalSet.from_ranges([(1, 3)]) <= left
+    assert set(left - right) == set(left) - set(right)
+
+
+def test_ragged_operations():
+    left = RaggedRanges.from_json(['[[1,100]]', '[[1,10],[20,30]]', '[]'])
+    right = RaggedRanges.from_json(['[[5,9],[50,60]]', '[[8,25]]', '[[1,3]]'])
+    assert ragged_difference(left, right).to_json() == ['[[1,4],[10,49],[61,100]]', '[[1,7],[26,30]]', '[]']
+    assert ragged_intersection(left, right).to_json() == ['[[5,9],[50,60]]', '[[8,10],[20,25]]', '[]']
+    assert ragged_lengths(right).tolist() == [16, 18, 3]
+    points = RaggedRanges.from_points([0, 0, 0, 2, 2], [3, 1, 2, 7, 9], 3)
+    assert points.to_json() == ['[[1,3]]', '[]', '[[7,7],[9,9]]']
+
+
+def test_ranges_array(tmp_path):
+    dfrm = pd.DataFrame({'pdb_id': ['1a01', '1a02', '2xyn'], 'sifts_unp_range': ['[[1,10],[15,20]]', nan, '[[5, 5]]']})
+    dfrm['sifts_unp_range'] = dfrm.sifts_unp_range.astype('ranges')
+    assert isinstance(dfrm.sifts_unp_range.array, RangesArray)
+    assert dfrm.sifts_unp_range[0] == ((1, 10), (15, 20))
+    assert dfrm.sifts_unp_range.ranges.length().tolist() == [16, 0, 1]
+    assert dfrm.sifts_unp_range.ranges.contains(5).tolist() == [True, False, True]
+    assert dfrm.sifts_unp_range.take([2, 0]).ranges.to_json().tolist() == ['[[5,5]]', '[[1,10],[15,20]]']
+    buffer = io.StringIO()
+    dfrm.to_csv(buffer, sep='\t', index=False)
+    pd.testing.assert_frame_equal(pd.read_csv(io.StringIO(buffer.getvalue()), sep='\t', dtype={'sifts_unp_range': 'ranges'}), dfrm)
+    pytest.importorskip('pyarrow')
+    dfrm.to_parquet(tmp_path/'ranges.parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path/'ranges.parquet'), dfrm)
+
+
+def test_ranges_setitem():
+    dfrm = pd.DataFrame({'sifts_unp_range': ['[[1,2]]', nan, '[[3,4],[6,7]]', '[[9,9]]']}).astype({'sifts_unp_range': 'ranges'})
+    dfrm.loc[dfrm.index > 1, 'sifts_unp_range'] = '[[5,5]]'
+    assert dfrm.sifts_unp_range.ranges.to_json().tolist() == ['[[1,2]]', nan, '[[5,5]]', '[[5,5]]']
+    assert dfrm.sifts_unp_range.fillna('[[0,0]]').ranges.to_json().tolist() == ['[[1,2]]', '[[0,0]]', '[[5,5]]', '[[5,5]]']
+    dfrm.loc[[0, 1], 'sifts_unp_range'] = ['[[1,1]]', [[2, 3], [8, 8]]]
+    dfrm.iloc[3, 0] = nan
+    values = dfrm.sifts_unp_range.array
+    values[-2] = [(4, 4)]
+    values[:1] = RangesArray._from_sequence(['[]'])
+    assert dfrm.sifts_unp_range.tolist() == [(), ((2, 3), (8, 8)), ((4, 4),), nan]
+    assert dfrm.sifts_unp_range.isna().tolist() == [False, False, False, True]
+    # a null element keeps an empty row
+    assert values.data.counts.tolist() == [0, 2, 1, 0]
+    with pytest.raises(ValueError):
+        values[0] = '[[1]]'
+    with pytest.raises(ValueError):
+        values[0] = 'garbage'
+    with pytest.raises(ValueError):
+        values[[0, 1]] = ['[[1,1]]']
+    with pytest.raises(IndexError):
+        values[4] = '[[1,1]]'
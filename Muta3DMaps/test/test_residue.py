@@ -0,0 +1,91 @@
+# @Created Date: 2020-04-19 03:40:26 pm
+# @Filename: test_residue.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-19 03:40:30 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import os
+import json
+import pytest
+import numpy as np
+import pandas as pd
+from Muta3DMaps.core.pdbe.decode import PDBeDecoder
+from Muta3DMaps.core.pdbe.residue import ResidueStore
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def residueListing(pdb_id, folder):
+    with open(os.path.join(DATA, f'{pdb_id}_residue_listing.json')) as inFile:
+        data = json.load(inFile)
+    dfrm = pd.DataFrame(list(PDBeDecoder.pyexcel_io('pdb/entry/residue_listing/', data).to_records()))
+    path = folder/f'{pdb_id}_residue_listing.tsv'
+    dfrm.to_csv(path, sep='\t', index=False)
+    return path
+
+
+def expected(paths):
+    dfrm = pd.concat(pd.read_csv(path, sep='\t', dtype={'pdb_id': str, 'chain_id': str}, keep_default_na=False, na_values=['']) for path in paths)
+    dfrm['author_insertion_code'] = dfrm.author_insertion_code.fillna('').astype(str).str[:1]
+    return dfrm.sort_values(['pdb_id', 'entity_id', 'chain_id', 'residue_number']).reset_index(drop=True)
+
+
+def test_residue_store(tmp_path):
+    paths = [residueListing(pdb_id, tmp_path) for pdb_id in ('1a01', '2xyn', '3g96')]
+    folder = tmp_path/'store'
+    dfrm = expected(paths)
+    built = ResidueStore.build(paths, folder)
+    stamps = [(folder/f'{name}.npy').stat().st_mtime_ns for name in ResidueStore.arrays]
+    reopened = ResidueStore.from_files(paths, folder)
+    # an unchanged source is reopened from the memory-mapped arrays instead of being rebuilt
+    assert [(folder/f'{name}.npy').stat().st_mtime_ns for name in ResidueStore.arrays] == stamps
+    assert isinstance(reopened.residue_number, np.memmap)
+    chains = dfrm[['pdb_id', 'entity_id', 'chain_id']].drop_duplicates().reset_index(drop=True)
+    for store in (built, reopened):
+        assert len(store) == len(chains)
+        assert store.chain_keys().equals(chains)
+        for pdb_id, entity_id, chain_id in chains.itertuples(index=False):
+            frame = store.chain_frame(pdb_id, entity_id, chain_id)
+            part = dfrm[(dfrm.pdb_id == pdb_id) & (dfrm.entity_id == entity_id) & (dfrm.chain_id == chain_id)]
+            for col in ('residue_number', 'author_residue_number', 'author_insertion_code'):
+                assert frame[col].tolist() == part[col].tolist()
+            assert np.allclose(frame.observed_ratio.to_numpy(np.float64), part.observed_ratio, atol=1e-3)
+        with pytest.raises(KeyError):
+            store.locate('1a01', 99, 'A')
+        with pytest.raises(KeyError):
+            store.locate('0000', 1, 'A')
+
+
+def test_stale_store(tmp_path):
+    paths = [residueListing('2xyn', tmp_path)]
+    folder = tmp_path/'store'
+    ResidueStore.from_files(paths, folder)
+    # a changed source is rebuilt
+    paths.append(residueListing('1a01', tmp_path))
+    store = ResidueStore.from_files(paths, folder)
+    assert set(store.chain_keys().pdb_id) == {'1a01', '2xyn'}
+    # so is a store interrupted before the meta file is written
+    (folder/ResidueStore.meta_file).unlink()
+    store = ResidueStore.from_files(paths[:1], folder)
+    assert set(store.chain_keys().pdb_id) == {'2xyn'}
+
+
+def test_verify_store(tmp_path, monkeypatch):
+    paths = [residueListing('2xyn', tmp_path), residueListing('1a01', tmp_path)]
+    folder = tmp_path/'store'
+    ResidueStore.from_files(paths, folder)
+    builds = []
+    build = ResidueStore.build.__func__
+    monkeypatch.setattr(ResidueStore, 'build', classmethod(lambda cls, *args: builds.append(args) or build(cls, *args)))
+    # a file rewritten in place is only caught by stat-ing the files
+    dfrm = pd.read_csv(paths[0], sep='\t')
+    dfrm[dfrm.chain_id == dfrm.chain_id.iloc[0]].to_csv(paths[0], sep='\t', index=False)
+    ResidueStore.from_files(paths, folder)
+    assert len(builds) == 0
+    store = ResidueStore.from_files(paths, folder, verify=True)
+    assert len(builds) == 1
+    assert len(store) == len(expected(paths)[['pdb_id', 'entity_id', 'chain_id']].drop_duplicates())
+    # a file added to the folder of the sources is caught from the folder's mtime
+    residueListing('3g96', tmp_path)
+    ResidueStore.from_files(paths, folder)
+    assert len(builds) == 2
@@ -0,0 +1,29 @@
+# @Created Date: 2020-04-15 02:41:09 pm
+# @Filename: test_utils.py
+# @Email:  1730416009@stu.suda.edu.cn
+# @Author: ZeFeng Zhu
+# @Last Modified: 2020-04-15 02:41:13 pm
+# @Copyright (c) 2020 MinghuiGroup, Soochow University
+import pytest
+import pandas as pd
+from Muta3DMaps.core.utils import read_frames
+
+
+def test_read_frames(tmp_path):
+    converters = {'pdb_id': str, 'chain_id': str, 'entity_id': int, 'author_insertion_code': str}
+    paths = []
+    for i, rows in enumerate((
+            'pdb_id\tchain_id\tentity_id\tauthor_insertion_code\tobserved_ratio\tnote\n1a01\tA\t1\t\t1.0\tnull\n1a01\tNA\t2\tA\t\tx\n',
+            'pdb_id\tchain_id\tentity_id\tauthor_insertion_code\tobserved_ratio\tnote\n2e3f\tB\t1\t\tNA\tNA\n')):
+        path = tmp_path/f'{i}.tsv'
+        path.write_text(rows)
+        paths.append(path)
+    expected = pd.concat((pd.read_csv(path, sep='\t', converters=converters) for path in paths), sort=False, ignore_index=True)
+    res = read_frames(paths + [None], dtype=converters, workers=2)
+    pd.testing.assert_frame_equal(res, expected)
+    # the columns without a declared `str` keep pandas' default missing values
+    assert res.chain_id.tolist() == ['A', 'NA', 'B']
+    assert res.note.isna().tolist() == [True, False, True]
+    assert res.observed_ratio.isna().tolist() == [False, True, True]
+    assert [len(dfrm) for dfrm in read_frames(paths, dtype=converters, iterator=True)] == [2, 1]
+    assert read_frames([None]) is None